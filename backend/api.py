@@ -2,9 +2,11 @@ from flask import Flask
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 import os
+import atexit
 import logging
 from datetime import timedelta
 from routes import bp
+import engine
 
 from dotenv import load_dotenv
 
@@ -48,6 +50,14 @@ logging.basicConfig(level=logging.INFO)
 
 app.register_blueprint(bp)
 
+# Start the matching engine (journal, order books, write-behind writer).
+# The debug reloader runs this file in a watcher process as well, only the
+# process that actually serves requests may own the journal.
+if __name__ != "__main__" or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+    engine.start()
+    # Flush the write-behind queue and leave a fresh snapshot on a clean exit
+    atexit.register(engine.stop)
+
 
 # JWT error handlers
 @jwt.expired_token_loader
@@ -0,0 +1,165 @@
+# ASGI entry point, the asyncio serving mode
+# GET requests for the endpoints in async_routes.VIEWS are served on the
+# event loop, so thousands of polling clients cost coroutines instead of
+# threads (the sync ones among them run on the loop's executor); everything else (the write path, login, market data streams)
+# runs in the Flask app on a bounded pool of worker threads, unchanged.
+#
+#     uvicorn asgi:application --port 5000
+#
+# One process only (no --workers): the process owns the order journal.
+
+import asyncio
+import contextvars
+import io
+import logging
+import os
+import sys
+from functools import partial
+
+from a2wsgi import WSGIMiddleware
+from werkzeug.exceptions import HTTPException
+
+from api import app
+from async_db_pool import close_pool
+from async_routes import VIEWS
+
+# Worker threads for requests handed to the Flask app, each open market data
+# stream holds one for as long as it is connected
+WSGI_THREADS = int(os.getenv("WSGI_THREADS", 32))
+
+wsgi_application = WSGIMiddleware(app, workers=WSGI_THREADS)
+
+
+def _environ(scope):
+    """WSGI environ of a bodyless ASGI request, for Flask's request context and URL map"""
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1").upper().replace("-", "_")
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = f"HTTP_{name}"
+        value = value.decode("latin-1")
+        # Repeated headers are joined the way WSGI servers do it
+        environ[name] = f"{environ[name]},{value}" if name in environ else value
+    return environ
+
+
+def _match(environ):
+    """(view, view args) when the request goes to an event loop view, otherwise None"""
+    if environ["REQUEST_METHOD"] != "GET":
+        return None
+    try:
+        endpoint, args = app.url_map.bind_to_environ(environ).match()
+    except HTTPException:
+        # 404s, 405s and redirects are Flask's to answer
+        return None
+    view = VIEWS.get(endpoint)
+    return (view, args) if view is not None else None
+
+
+async def _dispatch(environ, view, args):
+    """
+    Run a view inside a Flask request context, with the app's before/after
+    request hooks (CORS) and error handlers (JWT) applied as Flask would.
+    Views that are not coroutines take the engine's locks, they run on the
+    loop's executor so they never hold up the event loop.
+    """
+    ctx = app.request_context(environ)
+    ctx.push()
+    try:
+        try:
+            rv = app.preprocess_request()
+            if rv is None:
+                if asyncio.iscoroutinefunction(view):
+                    rv = await view(**args)
+                else:
+                    # The copy carries the request context over to the thread
+                    context = contextvars.copy_context()
+                    rv = await asyncio.get_running_loop().run_in_executor(
+                        None, partial(context.run, view, **args)
+                    )
+            response = app.make_response(rv)
+        except Exception as e:
+            try:
+                response = app.make_response(app.handle_user_exception(e))
+            except Exception:
+                logging.exception(f"Error serving {environ['PATH_INFO']}")
+                response = app.make_response(({"error": "Internal server error"}, 500))
+        return app.process_response(response)
+    finally:
+        ctx.pop()
+
+
+async def _send_body(send, response):
+    """Send a response body, a streamed one (?stream=1) chunk by chunk as the view yields it"""
+    if response.is_sequence:
+        await send({"type": "http.response.body", "body": response.get_data()})
+        return
+
+    # The generator encodes on the executor, under the request context
+    # stream_with_context() pushes in the copied context
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    chunks = response.iter_encoded()
+    try:
+        while True:
+            chunk = await loop.run_in_executor(None, context.run, next, chunks, None)
+            if chunk is None:
+                break
+            if chunk:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    finally:
+        response.close()
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await close_pool()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+
+    if scope["type"] == "http":
+        environ = _environ(scope)
+        matched = _match(environ)
+        if matched is not None:
+            response = await _dispatch(environ, *matched)
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": response.status_code,
+                    "headers": [
+                        (name.lower().encode("latin-1"), value.encode("latin-1"))
+                        for name, value in response.headers.items()
+                    ],
+                }
+            )
+            await _send_body(send, response)
+            return
+
+    await wsgi_application(scope, receive, send)
@@ -0,0 +1,61 @@
+# async connection pool for the read endpoints served by asgi.py
+# same database and credentials as db_pool, connections are only ever
+# waited on by coroutines, so one event loop thread can keep many
+# queries in flight
+
+import aiomysql
+import asyncio
+from contextlib import asynccontextmanager
+import logging
+import os
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+pool_config = {
+    'user': os.getenv('DB_USER'),
+    'password': os.getenv('DB_PASSWORD'),
+    'host': os.getenv('DB_HOST', 'localhost'),
+    'db': os.getenv('DB_NAME', 'orderbook_db'),
+    'minsize': 1,
+    # reads only, a connection is held for a single query
+    'maxsize': int(os.getenv('ASYNC_DB_POOL_SIZE', 20)),
+    'autocommit': True,
+}
+
+_pool = None
+_pool_lock = asyncio.Lock()
+
+
+async def get_pool():
+    """The pool of the running event loop, created on first use"""
+    global _pool
+    async with _pool_lock:
+        if _pool is None:
+            try:
+                _pool = await aiomysql.create_pool(**pool_config)
+            except aiomysql.Error as err:
+                logging.error(f"Error creating async connection pool: {err}")
+                raise
+    return _pool
+
+
+async def close_pool():
+    global _pool
+    async with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            await _pool.wait_closed()
+            _pool = None
+
+
+@asynccontextmanager
+async def get_async_db_connection():
+    pool = _pool or await get_pool()
+    async with pool.acquire() as connection:
+        try:
+            yield connection
+        except aiomysql.Error as err:
+            logging.error(f"Database error: {err}")
+            raise
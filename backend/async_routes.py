@@ -0,0 +1,172 @@
+# Read endpoints for the asyncio serving mode (see asgi.py)
+# the MySQL backed reads are coroutines on the async pool, with the queries
+# and response shapes of their routes.py counterparts; reads served from
+# memory run their routes.py view as is, on the loop's executor since they
+# take the engine's locks
+
+import asyncio
+import logging
+import time
+from functools import wraps
+
+import aiomysql
+from flask import Response, jsonify, request
+from flask_jwt_extended import verify_jwt_in_request
+
+import routes
+from async_db_pool import get_async_db_connection
+from engine import writer
+from helpers import get_user_id_int
+from orderbook import ORDER_COLUMNS, order_books
+from routes import (
+    USER_ORDERS_WAIT,
+    USER_TRANSACTION_ENCODER,
+    _compact,
+    _history_filters,
+    _history_page,
+    _json_response,
+    _rows,
+    _rows_response,
+    _transactions_body,
+    _user_order_changes,
+    _user_orders_response,
+    response_cache,
+)
+from storage import (
+    ORDER_QUERY,
+    STORAGE_BACKEND,
+    transactions_query,
+    user_orders_query,
+    user_transactions_query,
+)
+
+# Seconds between checks while GET /user/orders waits for the write-behind writer
+PERSISTED_POLL = 0.01
+
+
+def async_jwt_required(view):
+    """jwt_required() for coroutine views, which would otherwise be run through async_to_sync"""
+
+    @wraps(view)
+    async def wrapper(*args, **kwargs):
+        verify_jwt_in_request()
+        return await view(*args, **kwargs)
+
+    return wrapper
+
+
+async def _fetch(query, params):
+    async with get_async_db_connection() as db:
+        async with db.cursor() as cursor:
+            await cursor.execute(query, params)
+            return await cursor.fetchall()
+
+
+async def _wait_persisted(seq, timeout):
+    """writer.wait_persisted() that sleeps the coroutine instead of a thread"""
+    deadline = time.monotonic() + timeout
+    while writer.persisted_seq < seq:
+        if time.monotonic() >= deadline:
+            return False
+        await asyncio.sleep(PERSISTED_POLL)
+    return True
+
+
+@async_jwt_required
+async def get_user_orders():
+    try:
+        user_id = get_user_id_int()
+        since = request.args.get("since", type=int)
+        changes = _user_order_changes(user_id, since)
+        if changes is not None:
+            return changes
+
+        version, journal_seq = order_books.user_version(user_id)
+        current = await _wait_persisted(journal_seq, USER_ORDERS_WAIT)
+        if current and request.if_none_match.contains(str(version)):
+            return Response(status=304)
+
+        orders = await _fetch(*user_orders_query(user_id))
+        return _user_orders_response(orders, since, version if current else None)
+
+    except aiomysql.Error as err:
+        logging.error(f"Error fetching user orders: {err}")
+        return jsonify({"error": "Database error"}), 500
+
+
+@async_jwt_required
+async def get_order(order_id):
+    try:
+        order = _rows(await _fetch(ORDER_QUERY, (order_id,)), ORDER_COLUMNS)
+        if order:
+            return jsonify(order[0])
+        else:
+            return Response(status=404)
+    except aiomysql.Error as err:
+        logging.error(f"Error fetching order: {err}")
+        return Response(status=500)
+
+
+@async_jwt_required
+async def get_transactions():
+    try:
+        filters, limit = _history_filters(request.args)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid filter: {e}"}), 400
+
+    try:
+        # Shares the cache of the threaded view, misses are not coalesced
+        # here: waiting on another request's build would block the loop
+        compact = _compact()
+        key = ("transactions", filters, limit, compact)
+        generation = writer.trades_seq
+        body = response_cache.peek(key, generation)
+        if body is None:
+            transactions = await _fetch(*transactions_query(filters, limit + 1))
+            body = _transactions_body(transactions, limit, compact)
+            response_cache.put(key, generation, body)
+        return _json_response(body)
+    except aiomysql.Error as err:
+        logging.error(f"Error fetching transactions: {err}")
+        return jsonify({"error": "Database error"}), 500
+
+
+@async_jwt_required
+async def get_user_transactions():
+    try:
+        filters, limit = _history_filters(request.args)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid filter: {e}"}), 400
+
+    try:
+        user_id = get_user_id_int()
+        transactions = await _fetch(*user_transactions_query(user_id, filters, limit + 1))
+        envelope, page = _history_page(transactions, limit)
+        return _rows_response(USER_TRANSACTION_ENCODER, page, envelope, "transactions")
+    except aiomysql.Error as err:
+        logging.error(f"Error fetching user transactions: {err}")
+        return jsonify({"error": "Database error"}), 500
+
+
+# Flask endpoint -> view run on the event loop, every other endpoint is
+# handed to the Flask app on a worker thread
+VIEWS = {
+    # Served from memory, sync views asgi runs on the loop's executor
+    "bp.get_orders": routes.get_orders,
+    "bp.get_user_balances": routes.get_user_balances,
+    "bp.get_book_depth": routes.get_book_depth,
+    "bp.get_market": routes.get_market,
+    "bp.get_candles": routes.get_candles,
+    "bp.get_tickers": routes.get_tickers,
+    "bp.get_ticker": routes.get_ticker,
+}
+# Other storages are read through the Flask views
+if STORAGE_BACKEND == "mysql":
+    VIEWS.update(
+        {
+            "bp.get_user_orders": get_user_orders,
+            "bp.get_order": get_order,
+            "bp.get_transactions": get_transactions,
+            "bp.get_user_transactions": get_user_transactions,
+        }
+    )
@@ -0,0 +1,2 @@
+# Benchmarks for the matching engine, run from the backend directory, e.g.
+#   python -m benchmarks.restart
@@ -0,0 +1,232 @@
+"""
+HTTP throughput and latency of the order endpoints.
+
+Logs the demo users of database/dummy_data.sql in against a running API
+and replays seeded order flow (see benchmarks.orderflow) through it, one
+client thread and one flow per user: POST /orders, DELETE and PUT
+/orders/<id> and DELETE /orders?symbol=, mixed with a share of GETs of
+the read endpoints.  Quantities are cut down to a few lots so the demo
+balances last; orders the API turns down (balance, already filled) count
+as rejects.
+
+    python -m benchmarks.endpoints --url http://127.0.0.1:5000 --count 2000
+"""
+
+import argparse
+import http.client
+import json
+import random
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+from benchmarks.orderflow import SCENARIOS, OrderFlow, demo_symbols, demo_users
+from benchmarks.report import compare, print_results, save_baseline, summarize
+from fixedpoint import from_lots, from_ticks
+
+# Flow quantities are divided by this, at least one lot is kept
+QUANTITY_DIVISOR = 100
+# GETs mixed into the flow, {symbol} is filled in with the order's symbol
+READ_PATHS = ("/orders", "/user/orders", "/book/{symbol}/depth", "/market/ticker")
+
+
+class Client:
+    """One user's keep-alive connection to the API"""
+
+    def __init__(self, url, token=None):
+        parts = urlsplit(url)
+        if parts.scheme == "https":
+            self.connection = http.client.HTTPSConnection(parts.hostname, parts.port)
+        else:
+            self.connection = http.client.HTTPConnection(parts.hostname, parts.port)
+        self.token = token
+
+    def request(self, method, path, body=None):
+        """(status, decoded JSON body or None)"""
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        payload = json.dumps(body) if body is not None else None
+        try:
+            self.connection.request(method, path, payload, headers)
+            response = self.connection.getresponse()
+            data = response.read()
+        except (http.client.HTTPException, OSError):
+            # Dropped keep-alive connection, the next request reconnects
+            self.connection.close()
+            return 0, None
+        try:
+            return response.status, json.loads(data) if data else None
+        except ValueError:
+            return response.status, None
+
+    def close(self):
+        self.connection.close()
+
+
+class HttpDriver:
+    """Applies orderflow operations of one user through the order endpoints"""
+
+    def __init__(self, client):
+        self.client = client
+        # flow ref -> (order id, symbol, side)
+        self.orders = {}
+
+    def place(self, ref, user_id, symbol, side, price, quantity):
+        status, body = self.client.request(
+            "POST",
+            "/orders",
+            {
+                "symbol": symbol,
+                "side": side,
+                "price": from_ticks(price),
+                "quantity": from_lots(max(1, quantity // QUANTITY_DIVISOR)),
+            },
+        )
+        if status != 201:
+            return False
+        self.orders[ref] = (body["order"]["id"], symbol, side)
+        return True
+
+    def cancel(self, ref):
+        order = self.orders.pop(ref, None)
+        if order is None:
+            return False
+        status, _ = self.client.request("DELETE", f"/orders/{order[0]}")
+        return status == 200
+
+    def amend(self, ref, price, quantity):
+        order = self.orders.get(ref)
+        if order is None:
+            return False
+        order_id, symbol, side = order
+        status, _ = self.client.request(
+            "PUT",
+            f"/orders/{order_id}",
+            {
+                "symbol": symbol,
+                "side": side,
+                "price": from_ticks(price),
+                "quantity": from_lots(max(1, quantity // QUANTITY_DIVISOR)),
+            },
+        )
+        return status == 200
+
+    def cancel_all(self, user_id, symbol):
+        status, _ = self.client.request("DELETE", f"/orders?symbol={symbol}")
+        return status == 200
+
+    def read(self, path):
+        status, _ = self.client.request("GET", path)
+        return status == 200
+
+
+def login(url, email, password):
+    client = Client(url)
+    status, body = client.request("POST", "/login", {"email": email, "password": password})
+    client.close()
+    if status != 200:
+        raise SystemExit(f"Could not log in as {email}: HTTP {status}")
+    return body["token"]
+
+
+def run_user(url, token, flow, scenario, count, reads, seed, samples, rejects):
+    """Replay one user's flow, per kind latencies go to samples and rejects"""
+    client = Client(url, token)
+    driver = HttpDriver(client)
+    rng = random.Random(seed)
+    clock = time.perf_counter
+    try:
+        for kind, *args in flow.operations(scenario, count):
+            if rng.random() < reads:
+                path = rng.choice(READ_PATHS).format(symbol=rng.choice(flow.symbols))
+                kind, args = "read", [path]
+            begin = clock()
+            accepted = getattr(driver, kind)(*args)
+            samples.setdefault(kind, []).append(clock() - begin)
+            if not accepted:
+                rejects[kind] = rejects.get(kind, 0) + 1
+    finally:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--password", default="password123")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="mixed")
+    parser.add_argument("--count", type=int, default=2000, help="operations per user")
+    parser.add_argument("--reads", type=float, default=0.2, help="share of operations that are GETs")
+    parser.add_argument(
+        "--symbols",
+        type=int,
+        help="symbols to trade, default the demo pairs; the API's SYMBOLS must list any SYMnnnUSD padding",
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--baseline", help="compare against this baseline file")
+    parser.add_argument("--save-baseline", help="write the results to this baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    symbols = demo_symbols(args.symbols)
+    users = demo_users()
+    tokens = {user_id: login(args.url, email, args.password) for user_id, _, email in users}
+
+    # user id -> that user's kind -> samples / rejects, merged once the threads are done
+    samples = {user_id: {} for user_id in tokens}
+    rejects = {user_id: {} for user_id in tokens}
+    threads = [
+        threading.Thread(
+            target=run_user,
+            args=(
+                args.url,
+                token,
+                OrderFlow(args.seed + user_id, symbols, [user_id]),
+                args.scenario,
+                args.count,
+                args.reads,
+                args.seed + user_id,
+                samples[user_id],
+                rejects[user_id],
+            ),
+        )
+        for user_id, token in tokens.items()
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    by_kind = {}
+    rejected = {}
+    for user_id in tokens:
+        for kind, kind_samples in samples[user_id].items():
+            by_kind.setdefault(kind, []).extend(kind_samples)
+        for kind, count in rejects[user_id].items():
+            rejected[kind] = rejected.get(kind, 0) + count
+
+    name = f"http {args.scenario}"
+    results = {
+        name: summarize(
+            [sample for kind in by_kind.values() for sample in kind],
+            elapsed,
+            sum(rejected.values()),
+        )
+    }
+    for kind, kind_samples in sorted(by_kind.items()):
+        # Per kind throughput is over the whole run, the kinds share it
+        results[f"{name} {kind}"] = summarize(kind_samples, elapsed, rejected.get(kind, 0))
+    print_results(results)
+
+    if args.save_baseline:
+        settings = {key: value for key, value in vars(args).items() if "baseline" not in key}
+        save_baseline(args.save_baseline, results, settings)
+    if args.baseline and compare(results, args.baseline, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Settlement flush time against MySQL.
+
+Flushes synthetic SettlementBatch writes of growing size, each in a
+transaction that is rolled back, and compares the multi-row statements of
+settlement.py with the per-row executemany() they replaced, both on a plain
+cursor and through db_pool.PreparedStatements.  Besides the time per flush
+it reports the statements and prepared statement resets the server counted,
+which is what the per-row path pays for: mysql-connector sends a prepared
+executemany() as one reset and one execute per row.
+
+Needs the schema and demo users of database/ and the DB_* settings of the
+API.  The orders the trades reference are inserted before each timed flush
+and rolled back with it.
+
+    python -m benchmarks.flush --trades 1 10 100 1000 --repeat 20
+"""
+
+import argparse
+import random
+import time
+
+from benchmarks.orderflow import demo_assets, demo_users
+from benchmarks.report import percentile
+from db_pool import get_db_connection, prepared_statements
+from fixedpoint import lots_decimal, ticks_decimal, units_decimal
+from settlement import SettlementBatch
+
+# The single-row statements flushed with executemany() before the
+# multi-row ones
+INSERT_TRANSACTION = """
+    INSERT INTO transactions (
+        buy_order_id, sell_order_id, symbol, quantity, price, executed_at,
+        buyer_id, seller_id
+    ) VALUES (%s, %s, %s, %s, %s, FROM_UNIXTIME(%s), %s, %s)
+"""
+
+UPDATE_FILL = """
+    UPDATE orders
+    SET filled_quantity = %s,
+        status = CASE WHEN filled_quantity >= quantity THEN 'FILLED' ELSE 'PARTIAL' END,
+        updated_at = NOW()
+    WHERE id = %s
+"""
+
+UPSERT_BALANCE = """
+    INSERT INTO balances (user_id, asset, available, reserved, updated_at)
+    VALUES (%s, %s, %s, %s, NOW())
+    ON DUPLICATE KEY UPDATE
+        available = available + VALUES(available),
+        reserved = GREATEST(reserved + VALUES(reserved), 0),
+        updated_at = NOW()
+"""
+
+# Session status counters read around every flush
+COUNTERS = ("Questions", "Com_stmt_execute", "Com_stmt_reset")
+
+
+def per_row_flush(batch, cursor):
+    """SettlementBatch.flush() as it was with one executemany() row per write"""
+    cursor.executemany(
+        INSERT_TRANSACTION,
+        [
+            t[:3] + (lots_decimal(t[3]), ticks_decimal(t[4])) + t[5:]
+            for t in batch.transactions
+        ],
+    )
+    cursor.executemany(
+        UPDATE_FILL,
+        [(lots_decimal(filled), order_id) for order_id, filled in batch.fills.items()],
+    )
+    cursor.executemany(
+        UPSERT_BALANCE,
+        [
+            (user_id, asset, units_decimal(available), units_decimal(reserved))
+            for (user_id, asset), (available, reserved) in batch.deltas.items()
+        ],
+    )
+
+
+def insert_orders(cursor, count, users, rng):
+    """count resting orders to trade against, their ids in insert order"""
+    cursor.executemany(
+        """
+        INSERT INTO orders (symbol, side, price, quantity, user_id)
+        VALUES ('BTCUSD', %s, 100.00, 10.0000, %s)
+        """,
+        [(("BUY", "SELL")[index % 2], rng.choice(users)) for index in range(count)],
+    )
+    cursor.execute(
+        "SELECT id FROM orders WHERE id >= LAST_INSERT_ID() ORDER BY id LIMIT %s", (count,)
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def settlement(order_ids, users, assets, rng):
+    """A batch of one trade per pair of orders, with its fills and deltas"""
+    batch = SettlementBatch()
+    now = time.time()
+    for buy_id, sell_id in zip(order_ids[::2], order_ids[1::2]):
+        buyer, seller = rng.choice(users), rng.choice(users)
+        lots = rng.randint(1, 1000) * 100
+        batch.add_transaction(buy_id, sell_id, "BTCUSD", lots, 10000, now, buyer, seller)
+        batch.fill(buy_id, lots)
+        batch.fill(sell_id, lots)
+        asset = rng.choice(assets)
+        batch.adjust(buyer, asset, available_change=lots)
+        batch.adjust(seller, asset, reserved_change=-lots)
+    return batch
+
+
+def session_counters(cursor):
+    names = ", ".join(f"'{name}'" for name in COUNTERS)
+    cursor.execute(f"SHOW SESSION STATUS WHERE Variable_name IN ({names})")
+    return {name: int(value) for name, value in cursor.fetchall()}
+
+
+def run(trades, repeat, path, prepared, seed, users, assets):
+    """Seconds per flush and server counters per flush of one path"""
+    rng = random.Random(seed)
+    samples = []
+    counted = dict.fromkeys(COUNTERS, 0)
+    with get_db_connection(prepared=True) as connection:
+        cursor = connection.cursor()
+        statements = prepared_statements(connection) if prepared else cursor
+        for _ in range(repeat):
+            order_ids = insert_orders(cursor, trades * 2, users, rng)
+            batch = settlement(order_ids, users, assets, rng)
+            before = session_counters(cursor)
+            started = time.perf_counter()
+            if path == "multi-row":
+                batch.flush(statements)
+            else:
+                per_row_flush(batch, statements)
+            samples.append(time.perf_counter() - started)
+            after = session_counters(cursor)
+            for name in COUNTERS:
+                # Less the SHOW SESSION STATUS itself
+                counted[name] += after[name] - before[name] - (name == "Questions")
+            connection.rollback()
+        cursor.close()
+    samples.sort()
+    return {
+        "p50_ms": percentile(samples, 0.5) * 1e3,
+        "p99_ms": percentile(samples, 0.99) * 1e3,
+        **{name: counted[name] / repeat for name in COUNTERS},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--trades", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=20, help="flushes per batch size and path")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    users = [user_id for user_id, _, _ in demo_users()]
+    assets = demo_assets()
+    print(
+        f"{'trades':>7} {'path':<10} {'cursor':<9} {'p50 ms':>9} {'p99 ms':>9} "
+        f"{'statements':>11} {'executes':>9} {'resets':>7}"
+    )
+    for trades in args.trades:
+        for path in ("per-row", "multi-row"):
+            for prepared in (False, True):
+                result = run(trades, args.repeat, path, prepared, args.seed, users, assets)
+                print(
+                    f"{trades:>7} {path:<10} {'prepared' if prepared else 'plain':<9} "
+                    f"{result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f} "
+                    f"{result['Questions']:>11.1f} {result['Com_stmt_execute']:>9.1f} "
+                    f"{result['Com_stmt_reset']:>7.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
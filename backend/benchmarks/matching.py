@@ -0,0 +1,204 @@
+"""
+Order path throughput and latency against book depth.
+
+Runs seeded order flow (see benchmarks.orderflow) through the functions the
+order endpoints run on a symbol's sequencer worker: balance reservation,
+journaling and matching, cancels, amends and mass cancels, with the
+journal in a scratch directory and the demo users funded in the ledger.
+The books are filled with resting quotes first, untimed, to the given
+depth.  Every scenario and depth runs in a fresh process, nothing talks to
+MySQL.  --durable adds the wait for the journal flush the endpoints do
+before they answer.  --storage also runs the write-behind writer against
+that storage backend (see storage.py), and the clock only stops once it has
+caught up; mysql wants an empty database, the scratch journal starts the
+order ids over.
+
+    python -m benchmarks.matching --depths 0 10000 100000 --count 50000
+    python -m benchmarks.matching --baseline benchmarks/baselines/matching.json
+    python -m benchmarks.matching --storage memory --depths 10000
+"""
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.orderflow import SCENARIOS, OrderFlow, demo_symbols, demo_users
+from benchmarks.report import compare, print_results, save_baseline, summarize
+
+# Balance every demo user gets in every asset, in amount units
+FUNDING = 10**17
+
+
+class EngineDriver:
+    """Applies orderflow operations the way the order endpoints do"""
+
+    def __init__(self, durable=False):
+        # Imported here, once ORDERBOOK_DATA_DIR points at the scratch directory
+        import engine
+        import helpers
+        import routes
+
+        self.engine = engine
+        self.helpers = helpers
+        self.routes = routes
+        self.durable = durable
+        # flow ref -> Order
+        self.orders = {}
+
+    def fund(self, users, symbols):
+        assets = {"USD"} | {self.helpers.get_base_asset(symbol) for symbol in symbols}
+        for user_id in users:
+            for asset in sorted(assets):
+                self.engine.ledger.set(user_id, asset, FUNDING, 0)
+
+    def _resting(self, order):
+        # The endpoints look closed orders up in MySQL to word their error
+        return order is not None and order.id in self.engine.order_books.get(order.symbol)
+
+    def _done(self, seq):
+        if self.durable and seq:
+            self.engine.journal.wait_durable(seq)
+        return True
+
+    def place(self, ref, user_id, symbol, side, price, quantity):
+        try:
+            self.helpers.reserve_balance_for_order(
+                self.engine.ledger, user_id, side, symbol, quantity, price
+            )
+        except ValueError:
+            return False
+        order = self.engine.new_order(user_id, symbol, side, price, quantity)
+        self.orders[ref] = order
+        return self._done(self.engine.submit_order(order))
+
+    def cancel(self, ref):
+        order = self.orders.pop(ref, None)
+        if not self._resting(order):
+            return False
+        _, status, seq = self.routes._cancel_order(order.id, order.user_id, order.symbol)
+        return status == 200 and self._done(seq)
+
+    def amend(self, ref, price, quantity):
+        order = self.orders.get(ref)
+        if not self._resting(order):
+            return False
+        _, status, seq, _ = self.routes._amend_order(
+            order.id, order.user_id, order.symbol, order.symbol, order.side, price, quantity
+        )
+        return status == 200 and self._done(seq)
+
+    def cancel_all(self, user_id, symbol):
+        orders, seq = self.routes._cancel_orders(symbol, user_id, None)
+        return bool(orders) and self._done(seq)
+
+
+def run_case(scenario, depth, count, symbol_count, seed, durable, storage=None):
+    """One scenario at one book depth, in a process of its own"""
+    directory = tempfile.mkdtemp(prefix="orderbook-matching-")
+    os.environ["ORDERBOOK_DATA_DIR"] = directory
+    os.environ["STORAGE_BACKEND"] = storage or "memory"
+    try:
+        driver = EngineDriver(durable)
+        engine = driver.engine
+        engine.journal.open()
+
+        users = [user_id for user_id, _, _ in demo_users()]
+        symbols = demo_symbols(symbol_count)
+        driver.fund(users, symbols)
+        flow = OrderFlow(seed, symbols, users)
+        for _, *args in flow.quotes(depth):
+            driver.place(*args)
+        operations = flow.operations(scenario, count)
+        if storage:
+            # The book filling is persisted before the clock starts
+            engine.journal.wait_durable(engine.journal.last_seq)
+            engine.writer.drain()
+            engine.writer.start()
+
+        samples = {}
+        rejects = {}
+        clock = time.perf_counter
+        started = clock()
+        for kind, *args in operations:
+            begin = clock()
+            accepted = getattr(driver, kind)(*args)
+            samples.setdefault(kind, []).append(clock() - begin)
+            if not accepted:
+                rejects[kind] = rejects.get(kind, 0) + 1
+        if storage:
+            engine.journal.wait_durable(engine.journal.last_seq)
+            engine.writer.wait_persisted(engine.journal.last_seq)
+        elapsed = clock() - started
+
+        name = f"{scenario}@{depth}" + (f" {storage}" if storage else "")
+        results = {
+            name: summarize(
+                [sample for kind in samples.values() for sample in kind],
+                elapsed,
+                sum(rejects.values()),
+            )
+        }
+        for kind, kind_samples in sorted(samples.items()):
+            # Per kind throughput is that of the kind's operations back to back
+            results[f"{name} {kind}"] = summarize(
+                kind_samples, sum(kind_samples), rejects.get(kind, 0)
+            )
+        if storage:
+            engine.writer.stop()
+        engine.journal.close()
+        return results
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--scenarios", nargs="+", choices=sorted(SCENARIOS), default=list(SCENARIOS)
+    )
+    parser.add_argument("--depths", type=int, nargs="+", default=[0, 10_000, 100_000])
+    parser.add_argument("--count", type=int, default=50_000, help="timed operations per run")
+    parser.add_argument("--symbols", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--durable", action="store_true", help="wait for the journal flush")
+    parser.add_argument(
+        "--storage", choices=("memory", "mysql"), help="persist through this storage backend too"
+    )
+    parser.add_argument("--baseline", help="compare against this baseline file")
+    parser.add_argument("--save-baseline", help="write the results to this baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    for depth in args.depths:
+        for scenario in args.scenarios:
+            with ProcessPoolExecutor(1, mp_context=context) as pool:
+                results.update(
+                    pool.submit(
+                        run_case,
+                        scenario,
+                        depth,
+                        args.count,
+                        args.symbols,
+                        args.seed,
+                        args.durable,
+                        args.storage,
+                    ).result()
+                )
+    print_results(results)
+
+    if args.save_baseline:
+        settings = {name: value for name, value in vars(args).items() if "baseline" not in name}
+        save_baseline(args.save_baseline, results, settings)
+    if args.baseline and compare(results, args.baseline, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Resident memory of a book of open orders.
+
+Builds the same book twice, once out of dict orders with datetime times the
+way a dictionary cursor used to hand them to the books, once out of slotted
+Order records, and reports what tracemalloc sees allocated for each.
+
+    python -m benchmarks.memory --orders 1000000
+"""
+
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+from datetime import datetime
+
+from orderbook import Order
+
+SYMBOLS = ["BTCUSD", "ETHUSD", "AAPLUSD", "SOLUSD", "ADAUSD"]
+
+
+def order_fields(count, seed):
+    """(id, user_id, symbol, side, price, quantity) of non-crossing open orders"""
+    rng = random.Random(seed)
+    for order_id in range(1, count + 1):
+        side = rng.choice(("BUY", "SELL"))
+        offset = rng.randint(1, 500)
+        yield (
+            order_id,
+            rng.randint(1, 8),
+            rng.choice(SYMBOLS),
+            side,
+            # ticks and lots, see fixedpoint
+            10000 - offset if side == "BUY" else 10000 + offset,
+            rng.randint(1, 1000) * 100,
+        )
+
+
+def dict_orders(count, seed):
+    for order_id, user_id, symbol, side, price, quantity in order_fields(count, seed):
+        # Every row got its own datetimes from the cursor
+        now = datetime.now()
+        yield {
+            "id": order_id,
+            "user_id": user_id,
+            "symbol": symbol,
+            "side": side,
+            "price": price,
+            "quantity": quantity,
+            "filled_quantity": 0,
+            "status": "PENDING",
+            "created_at": now,
+            "updated_at": datetime.now(),
+        }
+
+
+def record_orders(count, seed):
+    for fields in order_fields(count, seed):
+        now = time.time()
+        yield Order(*fields, created_at=now, updated_at=now)
+
+
+def measure(orders):
+    """Bytes still allocated once the orders sit in an id index"""
+    gc.collect()
+    tracemalloc.start()
+    index = {}
+    for order in orders:
+        key = order["id"] if isinstance(order, dict) else order.id
+        index[key] = order
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del index
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--orders", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{'layout':>8} {'orders':>10} {'MB':>9} {'bytes/order':>12}")
+    for layout, build in (("dict", dict_orders), ("Order", record_orders)):
+        size = measure(build(args.orders, args.seed))
+        print(
+            f"{layout:>8} {args.orders:>10} {size / 1e6:>9.1f} "
+            f"{size / args.orders:>12.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Seeded synthetic order flow for the matching benchmarks.
+
+An OrderFlow turns a seed into the same sequence of operations every time:
+
+    ("place", ref, user_id, symbol, side, price, quantity)
+    ("cancel", ref)
+    ("amend", ref, price, quantity)
+    ("cancel_all", user_id, symbol)
+
+Prices are ticks and quantities lots (see fixedpoint).  ref numbers the
+place operations of a flow, a driver maps it to the order id it got back.
+The flow does not see fills, so a cancel or amend may name an order that
+already traded, the drivers count those as rejects.
+
+    python -m benchmarks.orderflow --scenario mixed --count 20
+"""
+
+import argparse
+import os
+import random
+import re
+
+# The users and balances the demo database starts with
+DUMMY_DATA = os.path.join(
+    os.path.dirname(__file__), os.pardir, os.pardir, "database", "dummy_data.sql"
+)
+
+# Scenario -> weight of each kind of operation
+SCENARIOS = {
+    # Market makers quoting around the mid, little churn
+    "passive": {"quote": 0.85, "cancel": 0.15},
+    # Aggressive orders taking out several levels at once
+    "sweep": {"quote": 0.7, "sweep": 0.3},
+    # Quotes pulled about as fast as they are placed, plus mass cancels
+    "cancel_storm": {"quote": 0.35, "cancel": 0.55, "cancel_all": 0.1},
+    # Resting orders re-priced over and over
+    "amend": {"quote": 0.3, "amend": 0.6, "cancel": 0.1},
+    "mixed": {"quote": 0.55, "sweep": 0.1, "cancel": 0.2, "amend": 0.12, "cancel_all": 0.03},
+}
+
+# Mid price every symbol starts at, in ticks
+START_PRICE = 10000
+# Ticks either side of the mid quotes are spread over
+LEVELS = 20
+
+
+def _insert_rows(path, table):
+    """Text of the VALUES rows of the first INSERT INTO table in a SQL dump"""
+    with open(path) as f:
+        text = f.read()
+    return text.split(f"INSERT INTO `{table}`", 1)[1].split(";", 1)[0]
+
+
+def demo_users(path=DUMMY_DATA):
+    """(user_id, username, email) of the demo users, ids in insert order"""
+    rows = re.findall(r"^\('([^']+)', '([^']+)'", _insert_rows(path, "users"), re.M)
+    return [(user_id, username, email) for user_id, (username, email) in enumerate(rows, 1)]
+
+
+def demo_assets(path=DUMMY_DATA):
+    """Assets the demo users hold, in the order they first appear"""
+    assets = re.findall(r"^\(\d+, '(\w+)'", _insert_rows(path, "balances"), re.M)
+    return list(dict.fromkeys(assets))
+
+
+def demo_symbols(count=None, path=DUMMY_DATA):
+    """
+    USD pairs of the demo assets, padded with synthetic SYMnnnUSD pairs up
+    to count symbols
+    """
+    symbols = [f"{asset}USD" for asset in demo_assets(path) if asset != "USD"]
+    if count is None:
+        return symbols
+    symbols.extend(f"SYM{index:03d}USD" for index in range(count - len(symbols)))
+    return symbols[:count]
+
+
+class OrderFlow:
+    """Seeded operation stream over a set of symbols and user ids"""
+
+    def __init__(self, seed, symbols, users, levels=LEVELS, drift=0.05):
+        self.rng = random.Random(seed)
+        self.symbols = list(symbols)
+        self.users = list(users)
+        self.levels = levels
+        # Chance per operation that a symbol's mid moves a tick
+        self.drift = drift
+        self.mid = {symbol: START_PRICE for symbol in self.symbols}
+        self._next_ref = 1
+        # ref -> (user_id, symbol, side) of orders the flow thinks are resting
+        self._live = {}
+        # refs to pick cancels and amends from, entries no longer live are skipped
+        self._refs = []
+        # (user_id, symbol) -> refs, for mass cancels
+        self._by_user = {}
+
+    def _place(self, user_id, symbol, side, price, quantity):
+        ref = self._next_ref
+        self._next_ref += 1
+        self._live[ref] = (user_id, symbol, side)
+        self._refs.append(ref)
+        self._by_user.setdefault((user_id, symbol), set()).add(ref)
+        return ("place", ref, user_id, symbol, side, price, quantity)
+
+    def _quote_price(self, symbol, side):
+        offset = self.rng.randint(1, self.levels)
+        mid = self.mid[symbol]
+        return mid - offset if side == "BUY" else mid + offset
+
+    def _quote(self):
+        symbol = self.rng.choice(self.symbols)
+        side = self.rng.choice(("BUY", "SELL"))
+        return self._place(
+            self.rng.choice(self.users),
+            symbol,
+            side,
+            self._quote_price(symbol, side),
+            self.rng.randint(1, 20) * 100,
+        )
+
+    def _sweep(self):
+        """A marketable order priced through every quoted level"""
+        symbol = self.rng.choice(self.symbols)
+        side = self.rng.choice(("BUY", "SELL"))
+        mid = self.mid[symbol]
+        price = mid + self.levels if side == "BUY" else mid - self.levels
+        return self._place(
+            self.rng.choice(self.users), symbol, side, price, self.rng.randint(20, 100) * 100
+        )
+
+    def _pick(self):
+        """A random live ref, or None when nothing is resting"""
+        while self._refs:
+            index = self.rng.randrange(len(self._refs))
+            self._refs[index], self._refs[-1] = self._refs[-1], self._refs[index]
+            ref = self._refs[-1]
+            if ref in self._live:
+                return ref
+            self._refs.pop()
+        return None
+
+    def _cancel(self):
+        ref = self._pick()
+        if ref is None:
+            return self._quote()
+        self._refs.pop()
+        user_id, symbol, _ = self._live.pop(ref)
+        self._by_user[(user_id, symbol)].discard(ref)
+        return ("cancel", ref)
+
+    def _amend(self):
+        ref = self._pick()
+        if ref is None:
+            return self._quote()
+        _, symbol, side = self._live[ref]
+        return ("amend", ref, self._quote_price(symbol, side), self.rng.randint(1, 20) * 100)
+
+    def _cancel_all(self):
+        user_id = self.rng.choice(self.users)
+        symbol = self.rng.choice(self.symbols)
+        for ref in self._by_user.pop((user_id, symbol), ()):
+            self._live.pop(ref, None)
+        return ("cancel_all", user_id, symbol)
+
+    def quotes(self, count):
+        """count resting quotes, without moving the mids, to give the books depth"""
+        return [self._quote() for _ in range(count)]
+
+    def operations(self, scenario, count):
+        """count operations of a scenario, see SCENARIOS"""
+        weights = SCENARIOS[scenario]
+        kinds = list(weights)
+        generators = [getattr(self, f"_{kind}") for kind in kinds]
+        cumulative = []
+        total = 0
+        for kind in kinds:
+            total += weights[kind]
+            cumulative.append(total)
+
+        operations = []
+        for _ in range(count):
+            if self.rng.random() < self.drift:
+                symbol = self.rng.choice(self.symbols)
+                self.mid[symbol] += self.rng.choice((-1, 1))
+            generate = self.rng.choices(generators, cum_weights=cumulative)[0]
+            operations.append(generate())
+        return operations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="mixed")
+    parser.add_argument("--count", type=int, default=20)
+    parser.add_argument("--symbols", type=int, help="symbols to trade, default the demo pairs")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    users = [user_id for user_id, _, _ in demo_users()]
+    flow = OrderFlow(args.seed, demo_symbols(args.symbols), users)
+    for operation in flow.operations(args.scenario, args.count):
+        print(*operation)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Throughput and latency summaries shared by the benchmarks, and the
+baseline files they are compared against.
+
+A baseline is the JSON of a previous run's results.  compare() reports a
+row as a regression when its throughput fell or its p99 rose by more than
+the tolerance, so a run can fail a CI job:
+
+    python -m benchmarks.matching --save-baseline benchmarks/baselines/matching.json
+    python -m benchmarks.matching --baseline benchmarks/baselines/matching.json
+"""
+
+import json
+import platform
+import time
+
+PERCENTILES = (("p50", 0.5), ("p99", 0.99), ("p999", 0.999))
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of sorted samples"""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(samples, elapsed, rejects=0):
+    """Throughput and latency percentiles (microseconds) of per-operation seconds"""
+    ordered = sorted(samples)
+    summary = {
+        "ops": len(ordered),
+        "rejects": rejects,
+        "ops_per_s": len(ordered) / elapsed if elapsed else 0.0,
+    }
+    for name, fraction in PERCENTILES:
+        summary[f"{name}_us"] = percentile(ordered, fraction) * 1e6
+    summary["max_us"] = ordered[-1] * 1e6 if ordered else 0.0
+    return summary
+
+
+def print_results(results):
+    """results: row name -> summarize() dict"""
+    width = max([len(name) for name in results] + [8])
+    print(
+        f"{'run':<{width}} {'ops':>8} {'rejects':>8} {'ops/s':>10} "
+        f"{'p50 us':>9} {'p99 us':>9} {'p999 us':>9} {'max us':>9}"
+    )
+    for name, row in results.items():
+        print(
+            f"{name:<{width}} {row['ops']:>8} {row['rejects']:>8} {row['ops_per_s']:>10.0f} "
+            f"{row['p50_us']:>9.1f} {row['p99_us']:>9.1f} {row['p999_us']:>9.1f} {row['max_us']:>9.1f}"
+        )
+
+
+def save_baseline(path, results, settings):
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "settings": settings,
+                "results": {
+                    name: {key: round(value, 1) for key, value in row.items()}
+                    for name, row in results.items()
+                },
+            },
+            f,
+            indent=2,
+            sort_keys=True,
+        )
+        f.write("\n")
+
+
+def compare(results, path, tolerance):
+    """
+    Print every row next to the baseline in path, returns the names of the
+    rows that regressed by more than tolerance (a fraction)
+    """
+    with open(path) as f:
+        baseline = json.load(f)["results"]
+
+    regressions = []
+    print(f"\nagainst {path}, tolerance {tolerance:.0%}")
+    print(f"{'run':<32} {'ops/s':>10} {'base':>10} {'change':>8} {'p99 us':>9} {'base':>9} {'change':>8}")
+    for name, row in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<32} {row['ops_per_s']:>10.0f} {'-':>10} {'':>8} {row['p99_us']:>9.1f}")
+            continue
+        throughput = row["ops_per_s"] / base["ops_per_s"] - 1 if base["ops_per_s"] else 0.0
+        latency = row["p99_us"] / base["p99_us"] - 1 if base["p99_us"] else 0.0
+        regressed = throughput < -tolerance or latency > tolerance
+        if regressed:
+            regressions.append(name)
+        print(
+            f"{name:<32} {row['ops_per_s']:>10.0f} {base['ops_per_s']:>10.0f} {throughput:>+8.1%} "
+            f"{row['p99_us']:>9.1f} {base['p99_us']:>9.1f} {latency:>+8.1%}"
+            + ("  REGRESSED" if regressed else "")
+        )
+    return regressions
@@ -0,0 +1,153 @@
+"""
+Restart time against book size.
+
+Compares a warm restart (latest snapshot plus the journal tail after it)
+with rebuilding the books from open order rows the way a cold start does
+after re-querying MySQL.  The row rebuild leaves out the query itself, so
+it is a lower bound for the cold start.  Use the numbers to size
+SNAPSHOT_INTERVAL: the tail to replay grows with the time since the last
+snapshot.
+
+    python -m benchmarks.restart --sizes 10000 100000 1000000 --tail 10000
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime
+
+import snapshot
+from journal import Journal
+from fixedpoint import lots_decimal, ticks_decimal
+from orderbook import ORDER_COLUMNS, BookRegistry, Order, book_order
+
+SYMBOLS = ["BTCUSD", "ETHUSD", "AAPLUSD", "SOLUSD", "ADAUSD"]
+
+
+def resting_orders(count, rng, first_id=1):
+    """Non-crossing open orders: bids below 100, asks above it"""
+    now = time.time()
+    for order_id in range(first_id, first_id + count):
+        side = rng.choice(("BUY", "SELL"))
+        offset = rng.randint(1, 500)
+        yield Order(
+            order_id,
+            rng.randint(1, 8),
+            rng.choice(SYMBOLS),
+            side,
+            # ticks and lots, see fixedpoint
+            10000 - offset if side == "BUY" else 10000 + offset,
+            rng.randint(1, 1000) * 100,
+            created_at=now,
+            updated_at=now,
+        )
+
+
+def journal_tail(journal, count, rng, first_id):
+    """Append new orders and cancels after the snapshot"""
+    open_ids = []
+    for order in resting_orders(count, rng, first_id):
+        if open_ids and rng.random() < 0.3:
+            order_id, symbol = open_ids.pop(rng.randrange(len(open_ids)))
+            journal.append(
+                {"type": "cancel", "id": order_id, "symbol": symbol, "updated_at": time.time()}
+            )
+            continue
+        event = {column: getattr(order, column) for column in ORDER_COLUMNS}
+        event["type"] = "order"
+        journal.append(event)
+        open_ids.append((order.id, order.symbol))
+    journal.flush()
+
+
+def as_rows(orders):
+    """What a plain cursor hands back for the same orders, in ORDER_COLUMNS order"""
+    for order in orders:
+        created_at = datetime.fromtimestamp(order.created_at)
+        yield (
+            order.id,
+            order.user_id,
+            order.symbol,
+            order.side,
+            ticks_decimal(order.price),
+            lots_decimal(order.quantity),
+            lots_decimal(order.filled_quantity),
+            order.status,
+            created_at,
+            created_at,
+        )
+
+
+def run(size, tail, seed, directory):
+    rng = random.Random(seed)
+    registry = BookRegistry()
+    orders = list(resting_orders(size, rng))
+    for order in orders:
+        registry.get(order.symbol).add(order)
+
+    journal = Journal(os.path.join(directory, "orders.journal"), flush_interval=0)
+    journal.open()
+
+    started = time.perf_counter()
+    current = snapshot.take(registry, journal, size + 1)
+    path = snapshot.write(os.path.join(directory, "snapshots"), current)
+    write_time = time.perf_counter() - started
+
+    journal_tail(journal, tail, rng, size + 1)
+    journal.close()
+
+    # Warm restart, as engine.start() does it
+    started = time.perf_counter()
+    journal = Journal(journal.path)
+    journal.open()
+    latest = snapshot.read_latest(os.path.join(directory, "snapshots"))
+    records = journal.read(latest.seq, latest.offset)
+    restored = BookRegistry()
+    snapshot.restore(restored, latest, records)
+    warm_time = time.perf_counter() - started
+    journal.close()
+
+    # Cold restart from open order rows
+    rows = list(as_rows(orders))
+    started = time.perf_counter()
+    cold = BookRegistry()
+    for row in rows:
+        order = book_order(row)
+        cold.get(order.symbol).add(order)
+    cold_time = time.perf_counter() - started
+
+    return {
+        "orders": size,
+        "tail": len(records),
+        "snapshot_mb": os.path.getsize(path) / 1e6,
+        "write_s": write_time,
+        "warm_s": warm_time,
+        "rows_s": cold_time,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--tail", type=int, default=10_000, help="journal events after the snapshot")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{'orders':>10} {'tail':>8} {'snapshot MB':>12} {'write s':>9} {'warm s':>9} {'rows s':>9}")
+    for size in args.sizes:
+        directory = tempfile.mkdtemp(prefix="orderbook-restart-")
+        try:
+            result = run(size, args.tail, args.seed, directory)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        print(
+            f"{result['orders']:>10} {result['tail']:>8} {result['snapshot_mb']:>12.1f} "
+            f"{result['write_s']:>9.3f} {result['warm_s']:>9.3f} {result['rows_s']:>9.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
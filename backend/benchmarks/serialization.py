@@ -0,0 +1,133 @@
+"""
+JSON serialization time of large order and trade payloads.
+
+Encodes the same rows, as a plain cursor returns them from the orders and
+transactions tables, the way the listings used to (a dict per row through
+jsonify) and with the serializer encoders, as objects and compact arrays.
+
+    python -m benchmarks.serialization --sizes 10000 100000
+"""
+
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from flask import Flask, jsonify
+
+from serializer import RowEncoder, encode_rows
+
+SYMBOLS = ["BTCUSD", "ETHUSD", "AAPLUSD", "SOLUSD", "ADAUSD"]
+
+ORDER_FIELDS = (
+    ("id", "int"),
+    ("symbol", "str"),
+    ("side", "str"),
+    ("price", "decimal"),
+    ("quantity", "decimal"),
+    ("status", "str"),
+    ("filled_quantity", "decimal"),
+    ("created_at", "datetime"),
+    ("updated_at", "datetime"),
+)
+TRANSACTION_FIELDS = (
+    ("id", "int"),
+    ("buy_order_id", "int"),
+    ("sell_order_id", "int"),
+    ("buyer_id", "int"),
+    ("seller_id", "int"),
+    ("symbol", "str"),
+    ("price", "decimal"),
+    ("quantity", "decimal"),
+    ("executed_at", "datetime"),
+)
+
+
+def order_rows(count, rng):
+    start = datetime(2025, 1, 1)
+    for order_id in range(1, count + 1):
+        created_at = start + timedelta(seconds=order_id)
+        yield (
+            order_id,
+            rng.choice(SYMBOLS),
+            rng.choice(("BUY", "SELL")),
+            Decimal(rng.randint(9000, 11000)) / 100,
+            Decimal(rng.randint(1, 100000)) / 10000,
+            "PENDING",
+            Decimal("0.0000"),
+            created_at,
+            created_at,
+        )
+
+
+def transaction_rows(count, rng):
+    start = datetime(2025, 1, 1)
+    for transaction_id in range(1, count + 1):
+        yield (
+            transaction_id,
+            rng.randint(1, count),
+            rng.randint(1, count),
+            rng.randint(1, 8),
+            rng.randint(1, 8),
+            rng.choice(SYMBOLS),
+            Decimal(rng.randint(9000, 11000)) / 100,
+            Decimal(rng.randint(1, 100000)) / 10000,
+            start + timedelta(seconds=transaction_id),
+        )
+
+
+def timed(encode, repeat):
+    """Best of repeat runs, in seconds, and the body size"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = encode()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(body)
+
+
+def run(app, fields, rows, repeat):
+    names = [name for name, _ in fields]
+    encoder = RowEncoder(fields)
+    with app.test_request_context("/"):
+        return {
+            "jsonify": timed(
+                lambda: jsonify({"rows": [dict(zip(names, row)) for row in rows]}).get_data(),
+                repeat,
+            ),
+            "objects": timed(lambda: "".join(encode_rows(encoder, rows, {}, "rows")), repeat),
+            "compact": timed(
+                lambda: "".join(encode_rows(encoder, rows, {}, "rows", compact=True)), repeat
+            ),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    print(f"{'payload':>12} {'rows':>8} {'path':>8} {'ms':>9} {'MB':>7} {'speedup':>8}")
+    for size in args.sizes:
+        rng = random.Random(args.seed)
+        payloads = (
+            ("orders", ORDER_FIELDS, list(order_rows(size, rng))),
+            ("transactions", TRANSACTION_FIELDS, list(transaction_rows(size, rng))),
+        )
+        for payload, fields, rows in payloads:
+            results = run(app, fields, rows, args.repeat)
+            baseline = results["jsonify"][0]
+            for path, (elapsed, length) in results.items():
+                print(
+                    f"{payload:>12} {size:>8} {path:>8} {elapsed * 1000:>9.1f} "
+                    f"{length / 1e6:>7.1f} {baseline / elapsed:>7.1f}x"
+                )
+
+
+if __name__ == "__main__":
+    main()
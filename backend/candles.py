@@ -0,0 +1,359 @@
+# OHLCV candles
+# trades are rolled into bars per symbol and interval as they execute, the
+# API serves them from memory and closed bars are persisted in the background
+# prices are ticks, volumes lots and notionals ticks * lots, see fixedpoint
+
+import logging
+import threading
+import time
+from collections import deque
+
+from fixedpoint import (
+    PRICE_SCALE,
+    from_lots,
+    from_ticks,
+    lots_decimal,
+    notional_decimal,
+    ticks_decimal,
+    to_lots,
+    to_notional,
+    to_ticks,
+)
+from storage import storage
+
+# Interval name -> bar length in seconds, every length divides a day
+INTERVALS = {"1s": 1, "1m": 60, "5m": 300, "1h": 3600, "1d": 86400}
+# Closed bars kept in memory per symbol and interval
+HISTORY = {"1s": 3600, "1m": 1440, "5m": 2016, "1h": 720, "1d": 365}
+# Closed bars written to the candles table per write
+PERSIST_BATCH = 1000
+
+
+class Candle:
+    """One OHLCV bar, start is the epoch second the bar opens at"""
+
+    __slots__ = ("start", "open", "high", "low", "close", "volume", "notional", "trades")
+
+    def __init__(self, start, open, high, low, close, volume, notional, trades=1):
+        self.start = start
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+        # sum of price * quantity, volume-weighted average price = notional / volume
+        self.notional = notional
+        self.trades = trades
+
+    def merge(self, other):
+        """Fold a later bar (or a single trade as a bar) into this one"""
+        if other.high > self.high:
+            self.high = other.high
+        if other.low < self.low:
+            self.low = other.low
+        self.close = other.close
+        self.volume += other.volume
+        self.notional += other.notional
+        self.trades += other.trades
+
+    def copy(self, start):
+        return Candle(
+            start,
+            self.open,
+            self.high,
+            self.low,
+            self.close,
+            self.volume,
+            self.notional,
+            self.trades,
+        )
+
+    def to_dict(self):
+        return {
+            "time": self.start,
+            "open": from_ticks(self.open),
+            "high": from_ticks(self.high),
+            "low": from_ticks(self.low),
+            "close": from_ticks(self.close),
+            "volume": from_lots(self.volume),
+            "vwap": self.notional / self.volume / PRICE_SCALE if self.volume else None,
+            "trades": self.trades,
+        }
+
+
+class CandleSeries:
+    """The open bar and the most recent closed bars of one symbol and interval"""
+
+    __slots__ = ("seconds", "current", "closed")
+
+    def __init__(self, seconds, history):
+        self.seconds = seconds
+        self.current = None
+        self.closed = deque(maxlen=history)
+
+    def add(self, bar):
+        """Fold a bar of this or a finer interval in, returns the bar it closed, if any"""
+        start = bar.start - bar.start % self.seconds
+        current = self.current
+        if current is not None and start <= current.start:
+            # A clock step back must not reopen closed bars, count it in the open one
+            current.merge(bar)
+            return None
+        self.current = bar.copy(start)
+        if current is not None:
+            self.closed.append(current)
+        return current
+
+    def roll(self, now):
+        """Close the open bar once its interval is over, returns it if it did"""
+        current = self.current
+        if current is None or current.start + self.seconds > now:
+            return None
+        self.closed.append(current)
+        self.current = None
+        return current
+
+    def bars(self, limit):
+        bars = list(self.closed)
+        if self.current is not None:
+            bars.append(self.current)
+        return bars[-limit:]
+
+
+class CandleEngine:
+    """
+    Candles for every symbol that traded.  add_trade() runs on the matching
+    path and only touches memory, a background thread closes bars whose
+    interval is over and writes the closed bars to the candles table.
+    """
+
+    def __init__(self, flush_interval=1.0, history=HISTORY):
+        self.flush_interval = flush_interval
+        self.history = history
+        # symbol -> {interval name: CandleSeries}
+        self._series = {}
+        # symbol -> (price, executed_at) of the last trade
+        self._last_trade = {}
+        # (symbol, interval name, Candle) closed but not persisted yet
+        self._pending = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _symbol_series(self, symbol):
+        series = self._series.get(symbol)
+        if series is None:
+            series = self._series[symbol] = {
+                name: CandleSeries(seconds, self.history[name])
+                for name, seconds in INTERVALS.items()
+            }
+        return series
+
+    def _add_bar(self, symbol, bar):
+        for name, series in self._symbol_series(symbol).items():
+            closed = series.add(bar)
+            if closed is not None:
+                self._pending.append((symbol, name, closed))
+
+    def add_trade(self, symbol, price, quantity, executed_at):
+        bar = Candle(
+            int(executed_at), price, price, price, price, quantity, price * quantity
+        )
+        with self._lock:
+            self._add_bar(symbol, bar)
+            self._last_trade[symbol] = (price, executed_at)
+
+    def add_bar(self, symbol, bar):
+        """Fold an already aggregated bar, e.g. from aggregate_trades(), into every interval"""
+        with self._lock:
+            self._add_bar(symbol, bar)
+
+    def symbols(self):
+        with self._lock:
+            return list(self._series)
+
+    def candles(self, symbol, interval, limit=500):
+        """Recent bars of a symbol, oldest first, the last one may still be open"""
+        with self._lock:
+            series = self._series.get(symbol)
+            if series is None:
+                return []
+            return [bar.to_dict() for bar in series[interval].bars(limit)]
+
+    def summary(self, symbol):
+        """Last trade plus the current day's bar, or None if the symbol never traded"""
+        with self._lock:
+            series = self._series.get(symbol)
+            last = self._last_trade.get(symbol)
+            if series is None or last is None:
+                return None
+            day = series["1d"].current
+            return {
+                "last_price": from_ticks(last[0]),
+                "last_trade_at": last[1],
+                "day": day.to_dict() if day is not None else None,
+            }
+
+    def roll(self, now=None):
+        """Close every bar whose interval is over"""
+        now = time.time() if now is None else now
+        with self._lock:
+            for symbol, series in self._series.items():
+                for name, one in series.items():
+                    closed = one.roll(now)
+                    if closed is not None:
+                        self._pending.append((symbol, name, closed))
+
+    def take_closed(self):
+        """Closed bars not handed out yet, as (symbol, interval name, Candle)"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        return pending
+
+    def flush(self):
+        """Write the closed bars collected so far, they are kept for a retry on error"""
+        pending = self.take_closed()
+        if not pending:
+            return 0
+
+        try:
+            for index in range(0, len(pending), PERSIST_BATCH):
+                save_bars(pending[index : index + PERSIST_BATCH])
+        except Exception:
+            with self._lock:
+                self._pending[:0] = pending
+            raise
+        return len(pending)
+
+    def warm_up(self, recent, trades, since):
+        """
+        Rebuild the in-memory bars at startup: closed bars before since from
+        the candles table, then recent (the 1s bars from aggregate_trades()
+        since then, which also recreates the open bars), then trades, the
+        (symbol, price, quantity, executed_at) prints the storage does not have yet.
+        """
+        now = time.time()
+        stored = load_bars(now, since)
+
+        with self._lock:
+            self._series = {}
+            for symbol, name, bar in stored:
+                self._symbol_series(symbol)[name].closed.append(bar)
+            for symbol, bar in recent:
+                self._add_bar(symbol, bar)
+                self._last_trade[symbol] = (bar.close, bar.start)
+        for trade in trades:
+            self.add_trade(*trade)
+
+        self.roll(now)
+        logging.info(
+            f"Candles warmed up: {len(stored)} stored bars, {len(recent)} trade seconds "
+            f"re-aggregated, {len(trades)} journaled trades replayed"
+        )
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.roll()
+                self.flush()
+            except Exception as e:
+                logging.error(f"Candle flush failed: {e}")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="candles", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.flush()
+
+
+def save_bars(bars):
+    """Upsert (symbol, interval name, Candle) rows into the candles table"""
+    storage.save_candles(
+        [
+            (
+                symbol,
+                name,
+                bar.start,
+                ticks_decimal(bar.open),
+                ticks_decimal(bar.high),
+                ticks_decimal(bar.low),
+                ticks_decimal(bar.close),
+                lots_decimal(bar.volume),
+                notional_decimal(bar.notional),
+                bar.trades,
+            )
+            for symbol, name, bar in bars
+        ]
+    )
+
+
+def load_bars(now, before):
+    """Persisted bars that fit in the in-memory history and start before `before`"""
+    bars = []
+    for name, seconds in INTERVALS.items():
+        rows = storage.candles(name, int(now) - HISTORY[name] * seconds, before)
+        bars.extend((row[0], name, _row_candle(row[1:])) for row in rows)
+    return bars
+
+
+def _row_candle(row):
+    """Candle from a (start, open, high, low, close, volume, notional, trades) row"""
+    start, open, high, low, close, volume, notional, trades = row
+    return Candle(
+        int(start),
+        to_ticks(open),
+        to_ticks(high),
+        to_ticks(low),
+        to_ticks(close),
+        to_lots(volume),
+        to_notional(notional),
+        int(trades),
+    )
+
+
+def aggregate_trades(since=0):
+    """
+    A 1s bar per symbol and second with trades since the given epoch
+    second, oldest first.  Coarser intervals are rolled up from these, see
+    CandleSeries.add().
+    """
+    return [(row[0], _row_candle(row[1:])) for row in storage.trade_seconds(since)]
+
+
+def backfill(since=0):
+    """Rebuild and persist every closed bar from the transactions table"""
+    started = time.perf_counter()
+    seconds = aggregate_trades(since)
+
+    # Closed bars go straight to the table, no history is kept
+    engine = CandleEngine(history={name: 0 for name in INTERVALS})
+    for index in range(0, len(seconds), PERSIST_BATCH):
+        for symbol, bar in seconds[index : index + PERSIST_BATCH]:
+            engine.add_bar(symbol, bar)
+        save_bars(engine.take_closed())
+    engine.roll()
+    save_bars(engine.take_closed())
+
+    logging.info(
+        f"Backfilled candles from {len(seconds)} trade seconds in {time.perf_counter() - started:.3f}s"
+    )
+    return len(seconds)
+
+
+candle_engine = CandleEngine()
+
+
+if __name__ == "__main__":
+    import argparse
+    from datetime import datetime
+
+    parser = argparse.ArgumentParser(description="Rebuild the candles table from transactions")
+    parser.add_argument("--since", help="only trades from this ISO 8601 time on")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    backfill(datetime.fromisoformat(args.since).timestamp() if args.since else 0)
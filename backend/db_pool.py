@@ -1,37 +1,431 @@
 # for reusing existing connections / limiting total connections
 # leading to better performance
 
-import mysql.connector.pooling
+import mysql.connector
+from mysql.connector.errors import PoolError
+from collections import OrderedDict, deque
 from contextlib import contextmanager
 import logging
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
+from metrics import metrics
+
 # Load environment variables from .env file
 load_dotenv()
 
-pool_config = {
+connection_config = {
     'user': os.getenv('DB_USER'),
     'password': os.getenv('DB_PASSWORD'),
     'host': os.getenv('DB_HOST', 'localhost'),
     'database': os.getenv('DB_NAME', 'orderbook_db'),
-    'pool_name': 'orderbook_pool',
-    'pool_size': 10, # number of connections in the pool - depends on the needs, can be adjusted for scalability
-    'pool_reset_session': True,
     'autocommit': False
 }
 
-try:
-    connection_pool = mysql.connector.pooling.MySQLConnectionPool(**pool_config)
-except mysql.connector.Error as err:
-    logging.error(f"Error creating connection pool: {err}")
-    raise
+# The pool grows on demand up to the max size and shrinks back to the min
+# size as connections sit idle - depends on the needs, can be adjusted for scalability
+POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', 2))
+POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 10))
+# Seconds a checkout waits for a free connection before giving up
+POOL_WAIT_TIMEOUT = float(os.getenv('DB_POOL_WAIT_TIMEOUT', 5))
+# Checkouts allowed to queue at once, beyond that they fail straight away
+POOL_MAX_WAITERS = int(os.getenv('DB_POOL_MAX_WAITERS', 100))
+# Seconds an idle connection above the min size is kept open
+POOL_IDLE_TIMEOUT = float(os.getenv('DB_POOL_IDLE_TIMEOUT', 60))
+# Prepared statements kept per connection, the least recently used are closed beyond it
+MAX_PREPARED_STATEMENTS = int(os.getenv('DB_MAX_PREPARED_STATEMENTS', 32))
+
+# Optional read replica, read-only checkouts go there while it keeps up
+REPLICA_HOST = os.getenv('DB_REPLICA_HOST')
+# Seconds of replication lag a read-only checkout tolerates by default
+REPLICA_MAX_LAG = float(os.getenv('DB_REPLICA_MAX_LAG', 5))
+# Seconds between replication lag checks
+REPLICA_CHECK_INTERVAL = float(os.getenv('DB_REPLICA_CHECK_INTERVAL', 2))
+
+
+class PoolStats:
+    """Counters of a ConnectionPool, times in seconds"""
+
+    __slots__ = (
+        "checkouts",
+        "wait_time",
+        "max_wait_time",
+        "hold_time",
+        "max_hold_time",
+        "exhausted",
+        "timeouts",
+        "opened",
+        "closed",
+        "statements_prepared",
+        "statements_reused",
+    )
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+
+class PreparedStatements:
+    """
+    Server-side prepared statements of one pooled connection, one prepared
+    cursor per SQL text.  A statement is prepared the first time it runs on
+    the connection and reused by every later checkout, until the pool
+    resets the session or closes the connection.  Same execute() and
+    executemany() as a cursor.
+    """
+
+    def __init__(self, connection, max_statements, stats):
+        self.connection = connection
+        self.max_statements = max_statements
+        self.stats = stats
+        # SQL text -> (the text the statement was prepared from, cursor)
+        self._statements = OrderedDict()
+
+    def _statement(self, sql):
+        statement = self._statements.get(sql)
+        if statement is not None:
+            self._statements.move_to_end(sql)
+            self.stats.statements_reused += 1
+            return statement
+        # The cursor re-prepares unless it is handed the very same string
+        # object again, so the first one is kept and used from then on
+        statement = self._statements[sql] = (sql, self.connection.cursor(prepared=True))
+        self.stats.statements_prepared += 1
+        while len(self._statements) > self.max_statements:
+            _, (_, cursor) = self._statements.popitem(last=False)
+            cursor.close()
+        return statement
+
+    def execute(self, sql, params=()):
+        sql, cursor = self._statement(sql)
+        cursor.execute(sql, params)
+        return cursor
+
+    def executemany(self, sql, seq_params):
+        sql, cursor = self._statement(sql)
+        cursor.executemany(sql, seq_params)
+        return cursor
+
+    def close(self):
+        for _, cursor in self._statements.values():
+            try:
+                cursor.close()
+            except mysql.connector.Error:
+                pass
+        self._statements.clear()
+
+
+class ConnectionPool:
+    """
+    Connection pool with a bounded wait queue: a checkout waits up to
+    wait_timeout for a connection instead of failing when all are in use,
+    and fails straight away when max_waiters checkouts are already queued.
+    Connections are opened on demand up to max_size and closed again once
+    idle for idle_timeout while there are more than min_size.  Read-only
+    checkouts only roll back on return, write checkouts reset the session.
+    """
+
+    def __init__(self, config, min_size, max_size, wait_timeout, max_waiters, idle_timeout):
+        self.config = config
+        self.min_size = min_size
+        self.max_size = max_size
+        self.wait_timeout = wait_timeout
+        self.max_waiters = max_waiters
+        self.idle_timeout = idle_timeout
+        self.stats = PoolStats()
+        # (connection, returned at), most recently returned last
+        self._idle = deque()
+        # Connections open or being opened, idle ones included
+        self._size = 0
+        self._waiters = 0
+        self._condition = threading.Condition()
+        # connection id -> checkout time
+        self._checked_out = {}
+        # connection id -> PreparedStatements, only touched by the checkout holding the connection
+        self._statements = {}
+
+        for _ in range(min_size):
+            self._idle.append((self._open(), time.monotonic()))
+
+    def _open(self):
+        connection = mysql.connector.connect(**self.config)
+        with self._condition:
+            self._size += 1
+            self.stats.opened += 1
+        return connection
+
+    def statements(self, connection):
+        """The prepared statements of a connection checked out from this pool"""
+        statements = self._statements.get(id(connection))
+        if statements is None:
+            statements = PreparedStatements(connection, MAX_PREPARED_STATEMENTS, self.stats)
+            self._statements[id(connection)] = statements
+        return statements
+
+    def _drop_statements(self, connection):
+        """Forget the prepared statements of a connection that is reset or closed"""
+        statements = self._statements.pop(id(connection), None)
+        if statements is not None:
+            statements.close()
+
+    def _discard(self, connection):
+        """Close a connection that leaves the pool, called without the lock held"""
+        self._drop_statements(connection)
+        try:
+            connection.close()
+        except mysql.connector.Error:
+            pass
+        with self._condition:
+            self._size -= 1
+            self.stats.closed += 1
+            self._condition.notify()
+
+    def get_connection(self):
+        started = time.monotonic()
+        with self._condition:
+            if not self._idle and self._size >= self.max_size:
+                if self._waiters >= self.max_waiters:
+                    self.stats.exhausted += 1
+                    raise PoolError(f"Connection pool exhausted, {self._waiters} checkouts queued")
+                self._waiters += 1
+                try:
+                    available = self._condition.wait_for(
+                        lambda: self._idle or self._size < self.max_size,
+                        self.wait_timeout,
+                    )
+                finally:
+                    self._waiters -= 1
+                if not available:
+                    self.stats.exhausted += 1
+                    self.stats.timeouts += 1
+                    raise PoolError(
+                        f"No database connection free after {self.wait_timeout}s"
+                    )
+
+            connection = None
+            if self._idle:
+                connection, _ = self._idle.pop()
+            else:
+                # Reserve the slot, the connection is opened outside the lock
+                self._size += 1
+            expired = self._expired(started)
+
+        for stale in expired:
+            self._discard(stale)
+
+        if connection is None:
+            try:
+                connection = mysql.connector.connect(**self.config)
+            except mysql.connector.Error:
+                with self._condition:
+                    self._size -= 1
+                    self._condition.notify()
+                raise
+            with self._condition:
+                self.stats.opened += 1
+
+        checked_out = time.monotonic()
+        wait_time = checked_out - started
+        with self._condition:
+            self._checked_out[id(connection)] = checked_out
+            self.stats.checkouts += 1
+            self.stats.wait_time += wait_time
+            self.stats.max_wait_time = max(self.stats.max_wait_time, wait_time)
+        return connection
+
+    def _expired(self, now):
+        """Take idle connections past idle_timeout out of the pool, oldest first, with the lock held"""
+        expired = []
+        while (
+            self._idle
+            and self._size - len(expired) > self.min_size
+            and now - self._idle[0][1] > self.idle_timeout
+        ):
+            expired.append(self._idle.popleft()[0])
+        return expired
+
+    def release(self, connection, readonly=False, reset=True):
+        """
+        Return a connection, or drop it when it broke while checked out.
+        Write checkouts reset the session, which also deallocates its
+        prepared statements, unless reset is False.
+        """
+        try:
+            if not connection.is_connected():
+                raise mysql.connector.InterfaceError("Connection lost")
+            if readonly or not reset:
+                # Ends the read snapshot, the session itself was left as it was
+                connection.rollback()
+            else:
+                self._drop_statements(connection)
+                connection.reset_session()
+        except mysql.connector.Error:
+            self._checked_in(connection)
+            self._discard(connection)
+            return
+
+        now = time.monotonic()
+        self._checked_in(connection)
+        with self._condition:
+            self._idle.append((connection, now))
+            expired = self._expired(now)
+            self._condition.notify()
+        for stale in expired:
+            self._discard(stale)
+
+    def _checked_in(self, connection):
+        with self._condition:
+            checked_out = self._checked_out.pop(id(connection), None)
+            if checked_out is not None:
+                hold_time = time.monotonic() - checked_out
+                self.stats.hold_time += hold_time
+                self.stats.max_hold_time = max(self.stats.max_hold_time, hold_time)
+
+    def snapshot(self):
+        """Current size, in-use and queue counts plus the counters, as a dict"""
+        with self._condition:
+            values = {name: getattr(self.stats, name) for name in PoolStats.__slots__}
+            values.update(
+                size=self._size,
+                idle=len(self._idle),
+                in_use=len(self._checked_out),
+                waiting=self._waiters,
+                min_size=self.min_size,
+                max_size=self.max_size,
+            )
+        return values
+
+
+class ReplicaMonitor:
+    """
+    Replication lag of the replica, checked at most every check_interval
+    seconds by whichever checkout comes along, the others use the last value.
+    None when the lag is unknown: replication stopped or the check failed.
+    """
+
+    def __init__(self, pool, check_interval):
+        self.pool = pool
+        self.check_interval = check_interval
+        self.lag = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def _check(self):
+        connection = self.pool.get_connection()
+        try:
+            cursor = connection.cursor(dictionary=True)
+            cursor.execute("SHOW REPLICA STATUS")
+            status = cursor.fetchone()
+            cursor.close()
+        finally:
+            self.pool.release(connection, readonly=True)
+        if status is None:
+            # Not replicating from anything, it is as current as it gets
+            return 0
+        return status.get("Seconds_Behind_Source")
+
+    def current_lag(self):
+        now = time.monotonic()
+        due = self._checked_at is None or now - self._checked_at >= self.check_interval
+        if due and self._lock.acquire(blocking=False):
+            try:
+                try:
+                    self.lag = self._check()
+                except mysql.connector.Error as err:
+                    logging.warning(f"Replica lag check failed: {err}")
+                    self.lag = None
+                self._checked_at = now
+            finally:
+                self._lock.release()
+        return self.lag
+
+
+# Opened on the first checkout, so importing this module needs no server
+connection_pool = None
+replica_pool = None
+replica_monitor = None
+_pools_lock = threading.Lock()
+
+
+def _open_pools():
+    global connection_pool, replica_pool, replica_monitor
+    with _pools_lock:
+        if connection_pool is not None:
+            return
+        try:
+            pool = ConnectionPool(
+                connection_config,
+                POOL_MIN_SIZE,
+                POOL_MAX_SIZE,
+                POOL_WAIT_TIMEOUT,
+                POOL_MAX_WAITERS,
+                POOL_IDLE_TIMEOUT,
+            )
+        except mysql.connector.Error as err:
+            logging.error(f"Error creating connection pool: {err}")
+            raise
+
+        if REPLICA_HOST:
+            try:
+                replica_pool = ConnectionPool(
+                    dict(connection_config, host=REPLICA_HOST),
+                    POOL_MIN_SIZE,
+                    POOL_MAX_SIZE,
+                    POOL_WAIT_TIMEOUT,
+                    POOL_MAX_WAITERS,
+                    POOL_IDLE_TIMEOUT,
+                )
+                replica_monitor = ReplicaMonitor(replica_pool, REPLICA_CHECK_INTERVAL)
+            except mysql.connector.Error as err:
+                # Reads stay on the primary, as without a replica
+                logging.error(f"Error creating replica connection pool, reading from the primary: {err}")
+        connection_pool = pool
+
+
+def _read_pool(max_lag):
+    """The replica pool when a read may go there, otherwise None"""
+    if replica_pool is None or not max_lag:
+        return None
+    lag = replica_monitor.current_lag()
+    if lag is None or lag > max_lag:
+        return None
+    return replica_pool
+
+
+def _checkout(readonly, max_lag):
+    """(pool, connection): the replica for reads while it is within max_lag, else the primary"""
+    if connection_pool is None:
+        _open_pools()
+    pool = _read_pool(max_lag) if readonly else None
+    if pool is not None:
+        try:
+            return pool, pool.get_connection()
+        except mysql.connector.Error as err:
+            logging.warning(f"Replica checkout failed, reading from the primary: {err}")
+    return connection_pool, connection_pool.get_connection()
+
 
 @contextmanager
-def get_db_connection():
-    connection = None
+def get_db_connection(readonly=False, max_lag=REPLICA_MAX_LAG, prepared=False):
+    """
+    Check a connection out of the pool.  Pass readonly=True for checkouts
+    that only SELECT: they skip the session reset on return and go to the
+    replica, if there is one, while it is at most max_lag seconds behind
+    the primary.  max_lag=0 keeps a read on the primary, for reads that
+    must see the latest writes.  Writes always use the primary.
+
+    prepared=True is for hot-path writers that run their statements through
+    prepared_statements(connection) and leave no other session state: the
+    session is not reset on return, so the statements stay prepared for the
+    next checkout of the same connection.
+    """
+    pool = connection = None
     try:
-        connection = connection_pool.get_connection()
+        started = metrics.clock()
+        pool, connection = _checkout(readonly, max_lag)
+        metrics.observe("checkout", started)
         yield connection
     except mysql.connector.Error as err:
         if connection:
@@ -39,5 +433,16 @@ def get_db_connection():
         logging.error(f"Database error: {err}")
         raise
     finally:
-        if connection and connection.is_connected():
-            connection.close()
\ No newline at end of file
+        if connection:
+            pool.release(connection, readonly, reset=not prepared)
+
+
+def prepared_statements(connection):
+    """The PreparedStatements of a connection from get_db_connection()"""
+    return connection_pool.statements(connection)
+
+
+def pool_snapshots():
+    """Pool name -> ConnectionPool.snapshot() of the pools opened so far"""
+    pools = {"primary": connection_pool, "replica": replica_pool}
+    return {name: pool.snapshot() for name, pool in pools.items() if pool is not None}
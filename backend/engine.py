@@ -0,0 +1,446 @@
+# Order entry engine
+# the in-memory books plus the journal are the system of record for the
+# order path, MySQL is brought up to date by the write-behind writer
+
+import logging
+import os
+import threading
+import time
+
+import candles
+from candles import candle_engine
+from fixedpoint import from_lots, from_ticks
+from helpers import process_trade_settlement
+from journal import Journal, JournalError
+from ledger import BalanceLedger
+from marketdata import market_data, level_message, trade_message, order_message
+from metrics import metrics
+from orderbook import Order, order_books
+from settlement import SettlementBatch
+from storage import storage
+from ticker import tickers
+from writebehind import WriteBehindWriter
+import snapshot
+
+DATA_DIR = os.getenv("ORDERBOOK_DATA_DIR", os.path.join(os.path.dirname(__file__), "data"))
+SNAPSHOT_DIR = os.path.join(DATA_DIR, "snapshots")
+# Seconds between snapshots, 0 disables the periodic snapshots
+SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL", 300))
+
+journal = Journal(os.path.join(DATA_DIR, "orders.journal"))
+writer = WriteBehindWriter(journal)
+ledger = BalanceLedger(journal)
+
+
+class IdAllocator:
+    """Hands out order ids, so orders can be acknowledged before MySQL sees them"""
+
+    def __init__(self, start=1):
+        self._lock = threading.Lock()
+        self.reset(start)
+
+    def reset(self, start):
+        with self._lock:
+            self._next = start
+
+    def next(self):
+        with self._lock:
+            value = self._next
+            self._next += 1
+            return value
+
+    def peek(self):
+        """The id next() would return, without using it up"""
+        return self._next
+
+
+order_ids = IdAllocator()
+
+
+def new_order(user_id, symbol, side, price, quantity):
+    now = time.time()
+    return Order(
+        order_ids.next(),
+        user_id,
+        symbol,
+        side,
+        price,
+        quantity,
+        created_at=now,
+        updated_at=now,
+    )
+
+
+class MatchError(Exception):
+    """
+    An order was journaled but the record of its fills could not be.  The
+    order stays in play as the journal has it, resting unmatched with its
+    reservation held, so it must not be refused and released.  seq is the
+    journal record that put the order in play.
+    """
+
+    def __init__(self, message, seq):
+        super().__init__(message)
+        self.seq = seq
+
+
+def _match(book, order, seq):
+    """
+    Match an order against its book and journal the resulting fills.
+    Must be called with the book's lock held, so the journal and the market
+    data streams see book mutations in the order they happen.  seq is the
+    journal record that put the order in play; returns the sequence number
+    the caller has to wait on, the fills' record if anything traded.
+    """
+    started = metrics.clock()
+    fills = book.fills_for(order)
+    metrics.observe("match", started)
+
+    if not fills:
+        book.fill(order, fills)
+        _publish(book, seq, order, [(order.side, order.price)])
+        return seq
+
+    started = metrics.clock()
+    executed_at = time.time()
+    batch = SettlementBatch()
+    filled = 0
+    for resting, trade_quantity, trade_price in fills:
+        process_trade_settlement(
+            batch, order, resting, trade_quantity, trade_price, executed_at
+        )
+        batch.fill(resting.id, resting.filled_quantity + trade_quantity)
+        filled += trade_quantity
+    batch.fill(order.id, order.filled_quantity + filled)
+
+    # The fills are journaled, and their settlement deltas hit the ledger,
+    # before the book changes, so a failed append leaves nothing unrecorded
+    try:
+        seq = ledger.append(
+            {
+                "type": "match",
+                "symbol": order.symbol,
+                "order_id": order.id,
+                "executed_at": executed_at,
+                **batch.to_event(),
+            }
+        )
+    except JournalError as e:
+        book.add(order)
+        _publish(book, seq, order, [(order.side, order.price)])
+        raise MatchError(f"Could not journal the fills of order {order.id}: {e}", seq) from e
+
+    book.fill(order, fills)
+    for resting, trade_quantity, trade_price in fills:
+        logging.info(f"Executing trade: {from_lots(trade_quantity)} @ {from_ticks(trade_price)}")
+        candle_engine.add_trade(order.symbol, trade_price, trade_quantity, executed_at)
+        tickers.add_trade(order.symbol, trade_price, trade_quantity, executed_at)
+        resting.updated_at = executed_at
+    order.updated_at = executed_at
+    metrics.observe("settle", started)
+    metrics.count("fills", order.symbol, len(fills))
+
+    opposite = "SELL" if order.side == "BUY" else "BUY"
+    touched = [(opposite, price) for price in dict.fromkeys(price for _, _, price in fills)]
+    if order.id in book:
+        touched.append((order.side, order.price))
+    trades = [
+        trade_message(price, quantity, order.side, executed_at)
+        for _, quantity, price in fills
+    ]
+    _publish(book, seq, order, touched, trades, [resting for resting, _, _ in fills])
+    return seq
+
+
+def _publish(book, seq, order, touched, trades=(), makers=()):
+    """
+    Bump the book version for the orders an operation changed and push the
+    levels it touched, its trades and the status of every order involved to
+    the market data streams.  Called with the book's lock held.
+    """
+    order_books.touch([order, *makers], seq)
+    messages = [level_message(book, side, price) for side, price in touched]
+    messages.extend(trades)
+    private = [(order.user_id, order_message(order))]
+    private.extend((resting.user_id, order_message(resting)) for resting in makers)
+    market_data.publish(book.symbol, messages, private)
+
+
+def order_event(kind, order):
+    """Journal record carrying the full state of an order"""
+    return {
+        "type": kind,
+        "id": order.id,
+        "user_id": order.user_id,
+        "symbol": order.symbol,
+        "side": order.side,
+        "price": order.price,
+        "quantity": order.quantity,
+        "filled_quantity": order.filled_quantity,
+        "status": order.status,
+        "created_at": order.created_at,
+        "updated_at": order.updated_at,
+    }
+
+
+def submit_order(order):
+    """
+    Journal and match a new order, runs on the symbol's sequencer worker.
+    Returns the journal sequence number the caller has to wait on before
+    acknowledging the order.
+    """
+    logging.info(
+        f"Matching order {order.id}: {order.side} {from_lots(order.quantity)} {order.symbol} @ {from_ticks(order.price)}"
+    )
+    book = order_books.get(order.symbol)
+    with book.lock:
+        started = metrics.clock()
+        seq = journal.append(order_event("order", order))
+        metrics.observe("journal", started)
+        metrics.count("orders", order.symbol)
+        return _match(book, order, seq)
+
+
+def submit_orders(orders):
+    """
+    Journal and match a run of new orders of one symbol in request order, on
+    the symbol's sequencer worker.  Returns one journal sequence number per
+    order, None for an order the journal could not take.
+    """
+    seqs = []
+    for order in orders:
+        try:
+            seqs.append(submit_order(order))
+        except MatchError as e:
+            logging.error(str(e))
+            seqs.append(e.seq)
+        except JournalError as e:
+            logging.error(f"Could not journal order {order.id}: {e}")
+            seqs.append(None)
+    return seqs
+
+
+def cancel_order(order):
+    """Take a resting order out of its book and journal the cancel"""
+    book = order_books.get(order.symbol)
+    with book.lock:
+        book.remove(order.id)
+        order.status = "CANCELLED"
+        order.updated_at = time.time()
+        seq = journal.append(
+            {
+                "type": "cancel",
+                "id": order.id,
+                "symbol": order.symbol,
+                "updated_at": order.updated_at,
+            }
+        )
+        _publish(book, seq, order, [(order.side, order.price)])
+        return seq
+
+
+def cancel_orders(symbol, user_id, side=None):
+    """
+    Take every resting order of a user out of one book, optionally only one
+    side, and journal them as a single mass cancel.  Runs on the symbol's
+    sequencer worker.  Returns (cancelled orders, journal seq), the seq is
+    None when the user had nothing resting.
+    """
+    book = order_books.find(symbol)
+    if book is None:
+        return [], None
+    with book.lock:
+        orders = book.remove_user_orders(user_id, side)
+        if not orders:
+            return [], None
+
+        updated_at = time.time()
+        for order in orders:
+            order.status = "CANCELLED"
+            order.updated_at = updated_at
+        seq = journal.append(
+            {
+                "type": "mass_cancel",
+                "symbol": symbol,
+                "ids": [order.id for order in orders],
+                "updated_at": updated_at,
+            }
+        )
+        touched = list(dict.fromkeys((order.side, order.price) for order in orders))
+        _publish(book, seq, orders[0], touched, makers=orders[1:])
+        logging.info(f"Cancelled {len(orders)} {symbol} orders of user {user_id}")
+        return orders, seq
+
+
+def amend_order(order, symbol, side, price, quantity):
+    """
+    Pull a resting order out of its book and rewrite it, runs on the worker
+    of the order's current symbol.  Within the same symbol the amended order
+    is re-matched straight away.  Returns (journal seq, moved), where moved
+    means it changed symbol and rematch_order() has to run on the worker of
+    the new symbol.
+    """
+    book = order_books.get(order.symbol)
+    with book.lock:
+        book.remove(order.id)
+        old_level = (order.side, order.price)
+        moved = symbol != order.symbol
+        if moved:
+            # Only records that the order left this book, the new book
+            # journals the amend itself when it takes the order
+            seq = journal.append({"type": "move", "id": order.id, "symbol": order.symbol})
+            market_data.publish(book.symbol, [level_message(book, *old_level)])
+
+        order.symbol = symbol
+        order.side = side
+        order.price = price
+        order.quantity = quantity
+        order.updated_at = time.time()
+        if moved:
+            order_books.touch([order], seq)
+            return seq, True
+
+        seq = journal.append(order_event("amend", order))
+        if old_level != (side, price):
+            market_data.publish(book.symbol, [level_message(book, *old_level)])
+        return _match(book, order, seq), False
+
+
+def rematch_order(order):
+    """Take an order that moved symbol into its new book, on that book's worker"""
+    book = order_books.get(order.symbol)
+    with book.lock:
+        seq = journal.append(order_event("amend", order))
+        return _match(book, order, seq)
+
+
+class Snapshotter:
+    """Writes a snapshot every SNAPSHOT_INTERVAL seconds while the journal moves"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.last_seq = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def snapshot(self):
+        if journal.last_seq == self.last_seq:
+            return None
+        current = snapshot.take(order_books, journal, order_ids.peek(), ledger)
+        snapshot.write(SNAPSHOT_DIR, current)
+        self.last_seq = current.seq
+
+        # A restart needs neither the records this snapshot covers nor the
+        # ones the storage holds, only what comes after both
+        _, persisted_offset = writer.position()
+        journal.truncate(min(current.offset, persisted_offset))
+        return current
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.snapshot()
+            except Exception as e:
+                logging.error(f"Snapshot failed: {e}")
+
+    def start(self):
+        if not self.interval:
+            return
+        self._thread = threading.Thread(target=self._run, name="snapshotter", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+
+snapshotter = Snapshotter(SNAPSHOT_INTERVAL)
+
+
+def _warm_start():
+    """Restore the books and balances from the latest snapshot and the journal tail after it"""
+    latest = snapshot.read_latest(SNAPSHOT_DIR)
+    if latest is None:
+        return False
+    if latest.seq > journal.last_seq:
+        logging.warning(
+            f"Snapshot at seq {latest.seq} is ahead of the journal ({journal.last_seq}), ignoring it"
+        )
+        return False
+    if latest.offset < journal.base:
+        logging.warning(
+            f"Journal records after snapshot seq {latest.seq} were truncated, ignoring it"
+        )
+        return False
+
+    started = time.perf_counter()
+    writer.seek(latest.seq, latest.offset)
+    records = journal.read(latest.seq, latest.offset)
+    order_ids.reset(snapshot.restore(order_books, latest, records, ledger))
+    snapshotter.last_seq = latest.seq
+
+    logging.info(
+        f"Restored {latest.order_count()} orders from snapshot at seq {latest.seq} "
+        f"and replayed {len(records)} journal events in {time.perf_counter() - started:.3f}s"
+    )
+    return True
+
+
+def _cold_start():
+    """Bring the storage up to date with the journal and load the open orders and balances from it"""
+    writer.drain()
+
+    order_books.load(storage.open_orders())
+    ledger.load(storage.balances())
+    order_ids.reset(storage.max_order_id() + 1)
+
+
+def _warm_up_market_data():
+    """Rebuild candles and tickers from recent transactions plus the journal tail"""
+    # Start of yesterday (UTC): covers the 24h ticker window and today's bars
+    since = (int(time.time()) // 86400 - 1) * 86400
+    recent = candles.aggregate_trades(since)
+
+    # Trades the storage does not have yet are only in the journal
+    persisted_seq, offset = writer.position()
+    trades = [
+        (symbol, price, quantity, executed_at)
+        for _, event, _ in journal.read(persisted_seq, offset)
+        if event["type"] == "match"
+        for _, _, symbol, quantity, price, executed_at, *_ in event["transactions"]
+    ]
+
+    candle_engine.warm_up(recent, trades, since)
+    tickers.warm_up(recent, trades)
+
+
+def start():
+    """
+    Bring the engine up: open the journal, restore the books and balances
+    from the latest snapshot (or from MySQL when there is none), rebuild
+    candles and tickers
+    and start the background writer, snapshotter and candle flusher.
+    """
+    journal.open()
+    writer.load_checkpoint()
+
+    if not _warm_start():
+        _cold_start()
+    # Every mutation journals at least one record, so continuing from the
+    # journal position keeps book versions increasing across restarts
+    order_books.reset_version(journal.last_seq, journal.last_seq)
+
+    _warm_up_market_data()
+
+    writer.start()
+    snapshotter.start()
+    candle_engine.start()
+
+
+def stop():
+    snapshotter.stop()
+    candle_engine.stop()
+    writer.stop()
+    snapshotter.snapshot()
+    journal.close()
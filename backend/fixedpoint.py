@@ -0,0 +1,95 @@
+# Fixed-point units
+# prices are integer ticks, quantities integer lots and balances integer
+# amount units, each scaled to the DECIMAL column it is stored in, so the
+# order path only ever compares and adds ints
+
+from decimal import Decimal, ROUND_DOWN, ROUND_HALF_EVEN
+
+# DECIMAL(10,2) prices
+PRICE_SCALE = 100
+# DECIMAL(10,4) quantities
+QUANTITY_SCALE = 10000
+# DECIMAL(18,8) balances
+AMOUNT_SCALE = 100000000
+# price * quantity, e.g. candle notionals
+NOTIONAL_SCALE = PRICE_SCALE * QUANTITY_SCALE
+
+# Largest price and quantity the DECIMAL(10,2) and DECIMAL(10,4) columns hold
+MAX_TICKS = 10**10 - 1
+MAX_LOTS = 10**10 - 1
+
+# Amount units per lot of the base asset, and per tick * lot of quote asset
+LOT_UNITS = AMOUNT_SCALE // QUANTITY_SCALE
+NOTIONAL_UNITS = AMOUNT_SCALE // NOTIONAL_SCALE
+
+
+def _to_fixed(value, scale, rounding):
+    """
+    Scale a decimal number (str, int, float or Decimal) to integer units,
+    raises ValueError for anything that is not a finite number
+    """
+    try:
+        return int((Decimal(str(value)) * scale).to_integral_value(rounding))
+    except ArithmeticError as e:
+        raise ValueError(f"Not a finite number: {value!r}") from e
+
+
+def to_ticks(value):
+    return _to_fixed(value, PRICE_SCALE, ROUND_HALF_EVEN)
+
+
+def to_lots(value):
+    # Never trade or reserve more than was asked for
+    return _to_fixed(value, QUANTITY_SCALE, ROUND_DOWN)
+
+
+def to_units(value):
+    return _to_fixed(value, AMOUNT_SCALE, ROUND_DOWN)
+
+
+def to_notional(value):
+    return _to_fixed(value, NOTIONAL_SCALE, ROUND_HALF_EVEN)
+
+
+def from_ticks(ticks):
+    """Price as a float, for JSON"""
+    return ticks / PRICE_SCALE
+
+
+def from_lots(lots):
+    return lots / QUANTITY_SCALE
+
+
+def from_units(units):
+    return units / AMOUNT_SCALE
+
+
+def from_notional(notional):
+    return notional / NOTIONAL_SCALE
+
+
+def ticks_decimal(ticks):
+    """Exact Decimal of a price, for MySQL"""
+    return Decimal(ticks) / PRICE_SCALE
+
+
+def lots_decimal(lots):
+    return Decimal(lots) / QUANTITY_SCALE
+
+
+def units_decimal(units):
+    return Decimal(units) / AMOUNT_SCALE
+
+
+def notional_decimal(notional):
+    return Decimal(notional) / NOTIONAL_SCALE
+
+
+def notional_units(ticks, lots):
+    """Quote asset amount units of lots at a price"""
+    return ticks * lots * NOTIONAL_UNITS
+
+
+def lot_units(lots):
+    """Base asset amount units of a quantity"""
+    return lots * LOT_UNITS
@@ -1,7 +1,8 @@
-import mysql.connector
 import logging
 from flask_jwt_extended import get_jwt_identity
 
+from fixedpoint import from_lots, from_ticks, from_units, lot_units, notional_units
+
 
 def get_base_asset(symbol):
     """Extract base asset from trading symbol (e.g., BTC from BTCUSD)"""
@@ -13,314 +14,130 @@ def get_user_id_int():
     return int(get_jwt_identity())
 
 
-def get_user_balance(cursor, user_id, asset):
-    """Get user balance for a specific asset"""
-    cursor.execute(
-        "SELECT available, reserved FROM balances WHERE user_id = %s AND asset = %s",
-        (user_id, asset),
-    )
-    return cursor.fetchone()
-
-
-def update_balance(cursor, user_id, asset, available_change=0, reserved_change=0):
-    """Update user balance with specified changes"""
-    balance = get_user_balance(cursor, user_id, asset)
-    if not balance:
-        raise ValueError(f"{asset} balance not found for user {user_id}")
-
-    new_available = float(balance["available"]) + available_change
-    new_reserved = float(balance["reserved"]) + reserved_change
+def get_user_balance(ledger, user_id, asset):
+    """Get user balance for a specific asset, in amount units"""
+    balance = ledger.get(user_id, asset)
+    if balance is None:
+        return None
+    return {"available": balance[0], "reserved": balance[1]}
 
-    if new_available < 0:
-        raise ValueError(f"Insufficient {asset} balance")
 
-    cursor.execute(
-        """UPDATE balances 
-           SET available = %s, reserved = %s, updated_at = NOW()
-           WHERE user_id = %s AND asset = %s""",
-        (new_available, new_reserved, user_id, asset),
-    )
-
-    return new_available, new_reserved
+def update_balance(ledger, user_id, asset, available_change=0, reserved_change=0):
+    """
+    Apply relative changes to a user balance.
+    The availability check and the change happen atomically in the ledger,
+    so concurrent requests cannot overwrite each other.  Returns the
+    journal seq of the change, None if there was nothing to change.
+    """
+    return ledger.transfer(user_id, [(asset, available_change, reserved_change)])
 
 
-def reserve_balance_for_order(cursor, user_id, side, symbol, quantity, price):
+def reserve_balance_for_order(ledger, user_id, side, symbol, quantity, price):
     """Reserve balance for a new order"""
-    if side == "BUY":
-        total_cost = quantity * price
-        balance = get_user_balance(cursor, user_id, "USD")
-
-        if not balance or float(balance["available"]) < total_cost:
-            available = float(balance["available"]) if balance else 0
-            raise ValueError(
-                f"Insufficient USD balance. Required: ${total_cost:.2f}, Available: ${available:.2f}"
-            )
+    asset, amount = order_reservation(side, symbol, quantity, price)
+    balance = get_user_balance(ledger, user_id, asset)
 
-        update_balance(cursor, user_id, "USD", -total_cost, total_cost)
-
-    elif side == "SELL":
-        base_asset = get_base_asset(symbol)
-        balance = get_user_balance(cursor, user_id, base_asset)
-
-        if not balance or float(balance["available"]) < quantity:
-            available = float(balance["available"]) if balance else 0
+    if not balance or balance["available"] < amount:
+        available = balance["available"] if balance else 0
+        if side == "BUY":
             raise ValueError(
-                f"Insufficient {base_asset} balance. Required: {quantity}, Available: {available}"
+                f"Insufficient USD balance. Required: ${from_units(amount):.2f}, Available: ${from_units(available):.2f}"
             )
+        raise ValueError(
+            f"Insufficient {asset} balance. Required: {from_units(amount)}, Available: {from_units(available)}"
+        )
 
-        update_balance(cursor, user_id, base_asset, -quantity, quantity)
+    return update_balance(ledger, user_id, asset, -amount, amount)
 
 
-def release_balance_for_order(cursor, user_id, side, symbol, quantity, price):
-    """Release reserved balance when cancelling an order"""
+def order_reservation(side, symbol, quantity, price):
+    """(asset, amount units) an open order of quantity lots at price ticks keeps reserved"""
     if side == "BUY":
-        total_cost = quantity * price
-        update_balance(cursor, user_id, "USD", total_cost, -total_cost)
-    elif side == "SELL":
-        base_asset = get_base_asset(symbol)
-        update_balance(cursor, user_id, base_asset, quantity, -quantity)
+        return "USD", notional_units(price, quantity)
+    return get_base_asset(symbol), lot_units(quantity)
 
 
-def process_trade_settlement(cursor, buy_order, sell_order, quantity, price):
+def reserve_balances_for_orders(ledger, user_id, orders):
     """
-    Process the balance transfers for a completed trade.
+    Reserve balance for a batch of (side, symbol, quantity, price) orders
+    with one netted ledger change per asset.  Orders are accepted in
+    sequence while the available balance covers them; returns an error
+    message (or None when reserved) per order.
     """
-    try:
-        # Determine which order is buy and which is sell
-        if buy_order["side"] == "BUY":
-            buyer_id = buy_order["user_id"]
-            seller_id = sell_order["user_id"]
-        else:
-            buyer_id = sell_order["user_id"]
-            seller_id = buy_order["user_id"]
-
-        total_cost = quantity * price
-        base_asset = buy_order["symbol"].replace("USD", "").replace("USDT", "")
-
-        # Buyer: Release reserved USD, receive base asset
-        # Get buyer's USD balance
-        cursor.execute(
-            "SELECT available, reserved FROM balances WHERE user_id = %s AND asset = 'USD'",
-            (buyer_id,),
-        )
-        buyer_usd = cursor.fetchone()
-
-        if buyer_usd:
-            # Release reserved USD (reduce reserved by total_cost)
-            new_reserved = max(0, float(buyer_usd["reserved"]) - total_cost)
-            cursor.execute(
-                """UPDATE balances 
-                   SET reserved = %s, updated_at = NOW()
-                   WHERE user_id = %s AND asset = 'USD'""",
-                (new_reserved, buyer_id),
-            )
-
-        # Buyer: Add base asset to available balance
-        cursor.execute(
-            "SELECT available, reserved FROM balances WHERE user_id = %s AND asset = %s",
-            (buyer_id, base_asset),
-        )
-        buyer_asset = cursor.fetchone()
-
-        if buyer_asset:
-            new_available = float(buyer_asset["available"]) + quantity
-            cursor.execute(
-                """UPDATE balances 
-                   SET available = %s, updated_at = NOW()
-                   WHERE user_id = %s AND asset = %s""",
-                (new_available, buyer_id, base_asset),
-            )
-        else:
-            # Create new balance record for buyer
-            cursor.execute(
-                """INSERT INTO balances (user_id, asset, available, reserved, updated_at)
-                   VALUES (%s, %s, %s, 0, NOW())""",
-                (buyer_id, base_asset, quantity),
-            )
-
-        # Seller: Release reserved base asset, receive USD
-        # Get seller's base asset balance
-        cursor.execute(
-            "SELECT available, reserved FROM balances WHERE user_id = %s AND asset = %s",
-            (seller_id, base_asset),
-        )
-        seller_asset = cursor.fetchone()
-
-        if seller_asset:
-            # Release reserved base asset
-            new_reserved = max(0, float(seller_asset["reserved"]) - quantity)
-            cursor.execute(
-                """UPDATE balances 
-                   SET reserved = %s, updated_at = NOW()
-                   WHERE user_id = %s AND asset = %s""",
-                (new_reserved, seller_id, base_asset),
-            )
-
-        # Seller: Add USD to available balance
-        cursor.execute(
-            "SELECT available, reserved FROM balances WHERE user_id = %s AND asset = 'USD'",
-            (seller_id,),
+    needs = [order_reservation(*order) for order in orders]
+    if not needs:
+        return []
+    errors, _ = ledger.reserve_each(user_id, needs)
+    return errors
+
+
+def release_balances_for_orders(ledger, user_id, orders):
+    """Release what a set of open orders reserved, one netted change per asset"""
+    changes = []
+    for o in orders:
+        asset, amount = order_reservation(
+            o.side, o.symbol, o.quantity - o.filled_quantity, o.price
         )
-        seller_usd = cursor.fetchone()
-
-        if seller_usd:
-            new_available = float(seller_usd["available"]) + total_cost
-            cursor.execute(
-                """UPDATE balances 
-                   SET available = %s, updated_at = NOW()
-                   WHERE user_id = %s AND asset = 'USD'""",
-                (new_available, seller_id),
-            )
-        else:
-            # Create new USD balance for seller
-            cursor.execute(
-                """INSERT INTO balances (user_id, asset, available, reserved, updated_at)
-                   VALUES (%s, 'USD', %s, 0, NOW())""",
-                (seller_id, total_cost),
-            )
+        changes.append((asset, amount, -amount))
+    return ledger.transfer(user_id, changes)
 
-        logging.info(
-            f"Trade settled: {quantity} {base_asset} @ ${price} between users {buyer_id} and {seller_id}"
-        )
 
-    except Exception as e:
-        logging.error(f"Error in trade settlement: {e}")
-        raise
+def release_balance_for_order(ledger, user_id, side, symbol, quantity, price):
+    """Release reserved balance when cancelling an order"""
+    asset, amount = order_reservation(side, symbol, quantity, price)
+    return update_balance(ledger, user_id, asset, amount, -amount)
 
 
-def match_orders(cursor, new_order_id, db):
+def move_reservation(ledger, user_id, old, new):
     """
-    Match orders in the order book for the given new order.
-    Returns True if the order was fully filled, False otherwise.
+    Swap what an order reserved for what its amended version needs, in one
+    atomic ledger change.  old and new are (side, symbol, unfilled quantity,
+    price); raises ValueError when the balance does not cover the new one.
     """
-    try:
-        # Get the new order details
-        cursor.execute(
-            "SELECT * FROM orders WHERE id = %s AND status IN ('PENDING', 'PARTIAL')", (new_order_id,)
-        )
-        new_order = cursor.fetchone()
-
-        if not new_order:
-            return False
-
-        logging.info(
-            f"Matching order {new_order_id}: {new_order['side']} {new_order['quantity']} {new_order['symbol']} @ {new_order['price']}"
-        )
-
-        # Find matching orders (opposite side, same symbol, compatible price)
-        # For BUY orders, find SELL orders with price <= new_order_price
-        # For SELL orders, find BUY orders with price >= new_order_price
-        if new_order["side"] == "BUY":
-            match_sql = """
-                SELECT * FROM orders 
-                WHERE symbol = %s 
-                AND side = 'SELL' 
-                AND status IN ('PENDING', 'PARTIAL')
-                AND price <= %s
-                AND user_id != %s
-                ORDER BY price ASC, created_at ASC
-            """
-        else:  # SELL
-            match_sql = """
-                SELECT * FROM orders 
-                WHERE symbol = %s 
-                AND side = 'BUY' 
-                AND status IN ('PENDING', 'PARTIAL')
-                AND price >= %s
-                AND user_id != %s
-                ORDER BY price DESC, created_at ASC
-            """
-
-        cursor.execute(
-            match_sql, (new_order["symbol"], new_order["price"], new_order["user_id"])
-        )
-        matching_orders = cursor.fetchall()
-
-        remaining_quantity = float(new_order["quantity"]) - float(
-            new_order["filled_quantity"]
-        )
-
-        for match_order in matching_orders:
-            if remaining_quantity <= 0:
-                break
-
-            match_remaining = float(match_order["quantity"]) - float(
-                match_order["filled_quantity"]
-            )
-            if match_remaining <= 0:
-                continue
-
-            # Calculate trade quantity (minimum of both remaining quantities)
-            trade_quantity = min(remaining_quantity, match_remaining)
-            # Use the existing order's price (price-time priority)
-            trade_price = float(match_order["price"])
-
-            logging.info(f"Executing trade: {trade_quantity} @ {trade_price}")
-
-            # Create transaction record
-            cursor.execute(
-                """
-                INSERT INTO transactions (
-                    buy_order_id, sell_order_id, symbol, quantity, price, executed_at
-                ) VALUES (%s, %s, %s, %s, %s, NOW())
-            """,
-                (
-                    (
-                        new_order["id"]
-                        if new_order["side"] == "BUY"
-                        else match_order["id"]
-                    ),
-                    (
-                        match_order["id"]
-                        if new_order["side"] == "BUY"
-                        else new_order["id"]
-                    ),
-                    new_order["symbol"],
-                    trade_quantity,
-                    trade_price,
-                ),
-            )
-
-            # Update filled quantities
-            new_filled = float(new_order["filled_quantity"]) + trade_quantity
-            match_filled = float(match_order["filled_quantity"]) + trade_quantity
-
-            # Update new order
-            cursor.execute(
-                """
-                UPDATE orders 
-                SET filled_quantity = %s, 
-                    status = CASE WHEN filled_quantity >= quantity THEN 'FILLED' ELSE 'PARTIAL' END,
-                    updated_at = NOW()
-                WHERE id = %s
-            """,
-                (new_filled, new_order["id"]),
-            )
-
-            # Update matching order
-            cursor.execute(
-                """
-                UPDATE orders 
-                SET filled_quantity = %s,
-                    status = CASE WHEN filled_quantity >= quantity THEN 'FILLED' ELSE 'PARTIAL' END,
-                    updated_at = NOW()
-                WHERE id = %s
-            """,
-                (match_filled, match_order["id"]),
-            )
-
-            # Process balance transfers
-            process_trade_settlement(
-                cursor, new_order, match_order, trade_quantity, trade_price
-            )
-
-            remaining_quantity -= trade_quantity
+    old_asset, old_amount = order_reservation(*old)
+    new_asset, new_amount = order_reservation(*new)
+    return ledger.transfer(
+        user_id,
+        [(old_asset, old_amount, -old_amount), (new_asset, -new_amount, new_amount)],
+    )
 
-            # Update the new_order data for next iteration
-            new_order["filled_quantity"] = new_filled
 
-        return remaining_quantity <= 0
+def process_trade_settlement(batch, buy_order, sell_order, quantity, price, executed_at):
+    """
+    Record the balance transfers for a completed trade on a SettlementBatch.
+    Nothing is written until the batch is flushed.
+    """
+    # Determine which order is buy and which is sell
+    if buy_order.side != "BUY":
+        buy_order, sell_order = sell_order, buy_order
+
+    buyer_id = buy_order.user_id
+    seller_id = sell_order.user_id
+    total_cost = notional_units(price, quantity)
+    base_amount = lot_units(quantity)
+    base_asset = get_base_asset(buy_order.symbol)
+
+    # Buyer: release the USD reserved at the order's limit price, refund any
+    # price improvement and receive the base asset
+    reserved_cost = notional_units(buy_order.price, quantity)
+    batch.adjust(buyer_id, "USD", reserved_cost - total_cost, -reserved_cost)
+    batch.adjust(buyer_id, base_asset, base_amount, 0)
+
+    # Seller: release reserved base asset, receive USD
+    batch.adjust(seller_id, base_asset, 0, -base_amount)
+    batch.adjust(seller_id, "USD", total_cost, 0)
+
+    batch.add_transaction(
+        buy_order.id,
+        sell_order.id,
+        buy_order.symbol,
+        quantity,
+        price,
+        executed_at,
+        buyer_id,
+        seller_id,
+    )
 
-    except Exception as e:
-        logging.error(f"Error in order matching: {e}")
-        raise
+    logging.info(
+        f"Trade settled: {from_lots(quantity)} {base_asset} @ ${from_ticks(price)} between users {buyer_id} and {seller_id}"
+    )
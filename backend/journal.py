@@ -0,0 +1,330 @@
+# Append-only, memory-mapped event journal
+# every order and trade event gets a sequence number and is appended to a
+# preallocated, memory-mapped file; a flusher thread msyncs pending records
+# in groups so many appends share a single disk flush, and truncate() drops
+# the records a snapshot and the write-behind writer no longer need
+
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+MAGIC = b"OBJRNL01"
+
+# magic, offset of the first record: offsets count from the start of the
+# very first journal file, so they stay valid across truncate()
+FILE_HEADER = struct.Struct("<8sQ")
+# payload length, crc32 of the payload, sequence number
+HEADER = struct.Struct("<IIQ")
+
+GROW_BY = 64 * 1024 * 1024
+# Bytes per read while truncate() copies the records it keeps
+COPY_CHUNK = 1024 * 1024
+
+
+class JournalError(Exception):
+    pass
+
+
+class Journal:
+    """
+    Sequenced event log backed by a memory-mapped file.
+
+    append() only copies the record into the map and returns its sequence
+    number.  Durability comes from the flusher thread, which msyncs every
+    record appended since the previous flush in one go; callers that must
+    not acknowledge before the record is on disk use wait_durable().
+    """
+
+    def __init__(self, path, flush_interval=0.002):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.last_seq = 0
+        self.durable_seq = 0
+        # Offset of the first record, what truncate() dropped comes before it
+        self.base = 0
+        # File positions, the file header comes first
+        self.durable_offset = FILE_HEADER.size
+        self._file = None
+        self._mmap = None
+        self._size = 0
+        self._offset = FILE_HEADER.size
+        # Bumped whenever truncate() replaces the file
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._truncate_lock = threading.Lock()
+        self._pending = threading.Event()
+        self._durable = threading.Condition()
+        self._closed = False
+        self._flusher = None
+
+    def open(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._file = os.fdopen(fd, "r+b")
+
+        size = os.fstat(fd).st_size
+        if size < GROW_BY:
+            os.ftruncate(fd, GROW_BY)
+            size = GROW_BY
+        self._size = size
+        self._mmap = mmap.mmap(fd, size)
+
+        magic, base = FILE_HEADER.unpack_from(self._mmap, 0)
+        if magic == bytes(len(MAGIC)):
+            FILE_HEADER.pack_into(self._mmap, 0, MAGIC, 0)
+            self._mmap.flush()
+        elif magic != MAGIC:
+            self._mmap.close()
+            self._file.close()
+            self._mmap = None
+            raise JournalError(f"{self.path} is not a journal file")
+        self.base = base
+
+        self._recover()
+        self.durable_seq = self.last_seq
+        self.durable_offset = self._offset
+
+        self._flusher = threading.Thread(
+            target=self._flush_loop, name="journal-flusher", daemon=True
+        )
+        self._flusher.start()
+        logging.info(f"Opened journal {self.path} at seq {self.last_seq}")
+
+    def _recover(self):
+        """Find the end of the valid records, dropping any torn tail"""
+        offset = FILE_HEADER.size
+        seq = 0
+        for record_seq, _, next_offset in self._scan(self._mmap, offset, self._size):
+            seq = record_seq
+            offset = next_offset
+
+        self.last_seq = seq
+        self._offset = offset
+
+        # A torn record leaves garbage after the last valid one, clear it so
+        # new appends cannot be mistaken for a continuation of it
+        if offset + HEADER.size <= self._size:
+            length, _, _ = HEADER.unpack_from(self._mmap, offset)
+            if length:
+                logging.warning(f"Discarding torn journal tail at offset {offset}")
+                self._mmap[offset:] = bytes(self._size - offset)
+                self._mmap.flush()
+
+    @staticmethod
+    def _scan(buf, offset, end, after_seq=None):
+        """Yield (seq, payload, next_offset) for each valid record in buf"""
+        prev_seq = after_seq
+        while offset + HEADER.size <= end:
+            length, crc, seq = HEADER.unpack_from(buf, offset)
+            start = offset + HEADER.size
+            if length == 0 or start + length > end:
+                return
+            if prev_seq is not None and seq != prev_seq + 1:
+                return
+            payload = bytes(buf[start : start + length])
+            if zlib.crc32(payload) != crc:
+                return
+            yield seq, payload, start + length
+            prev_seq = seq
+            offset = start + length
+
+    def _grow(self, needed):
+        """Extend the file and remap it, called with self._lock held"""
+        with self._flush_lock:
+            self._mmap.flush()
+            self._mmap.close()
+            self._size += max(GROW_BY, needed)
+            fd = self._file.fileno()
+            os.ftruncate(fd, self._size)
+            os.fsync(fd)
+            self._mmap = mmap.mmap(fd, self._size)
+
+    def append(self, event):
+        """Append an event dict, returns its sequence number"""
+        if self._mmap is None or self._closed:
+            raise JournalError("Journal is not open")
+
+        payload = json.dumps(event, separators=(",", ":")).encode("utf-8")
+        record_size = HEADER.size + len(payload)
+
+        with self._lock:
+            if self._offset + record_size > self._size:
+                try:
+                    self._grow(record_size)
+                except (OSError, ValueError) as e:
+                    # Nothing was appended, callers can roll back what the event records
+                    raise JournalError(f"Could not grow the journal: {e}") from e
+            seq = self.last_seq + 1
+            start = self._offset + HEADER.size
+            self._mmap[start : start + len(payload)] = payload
+            # Header last, so a reader never sees a length before its payload
+            HEADER.pack_into(self._mmap, self._offset, len(payload), zlib.crc32(payload), seq)
+            self._offset += record_size
+            self.last_seq = seq
+
+        self._pending.set()
+        return seq
+
+    def flush(self):
+        """msync everything appended so far and wake up waiters"""
+        with self._lock:
+            end = self._offset
+            seq = self.last_seq
+            generation = self._generation
+        if seq == self.durable_seq:
+            return
+
+        with self._flush_lock:
+            if generation != self._generation:
+                # truncate() replaced the file and synced all of it
+                return
+            start = (self.durable_offset // mmap.PAGESIZE) * mmap.PAGESIZE
+            self._mmap.flush(start, end - start)
+
+            with self._durable:
+                self.durable_seq = seq
+                self.durable_offset = end
+                self._durable.notify_all()
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._pending.wait()
+            self._pending.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Journal flush failed: {e}")
+            if self.flush_interval:
+                # Let more appends pile up behind the next flush
+                self._pending.wait(self.flush_interval)
+
+    def position(self):
+        """(last sequence number, end offset) of what has been appended so far"""
+        with self._lock:
+            return self.last_seq, self.base + self._offset - FILE_HEADER.size
+
+    def wait_durable(self, seq, timeout=None):
+        """Block until the record with the given sequence number is on disk"""
+        with self._durable:
+            if not self._durable.wait_for(lambda: self.durable_seq >= seq, timeout):
+                raise JournalError(f"Timed out waiting for journal seq {seq}")
+
+    def read(self, after_seq=0, offset=0, limit=None):
+        """
+        Return durable records after after_seq as (seq, event, next_offset).
+        Reading starts at offset, which must be the start of a record, or at
+        the first record still in the journal if that comes later.
+        """
+        with self._durable:
+            end = self.base + self.durable_offset - FILE_HEADER.size
+
+        records = []
+        with open(self.path, "rb") as f:
+            # The file's own header, truncate() may have replaced the file
+            # since end was taken; the new one holds everything up to end too
+            _, base = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+            offset = max(offset, base)
+            if offset >= end:
+                return records
+            f.seek(offset - base + FILE_HEADER.size)
+            buf = f.read(end - offset)
+        for seq, payload, next_offset in self._scan(buf, 0, len(buf)):
+            if seq <= after_seq:
+                continue
+            records.append((seq, json.loads(payload), offset + next_offset))
+            if limit and len(records) >= limit:
+                break
+        return records
+
+    def truncate(self, offset):
+        """
+        Drop the records before offset, which must be the start of a record
+        that a snapshot and the write-behind writer have both covered.  The
+        records after it are copied to a new file that atomically replaces
+        the journal; appends only wait while the ones made during the copy
+        follow.  Returns how many bytes were dropped.
+        """
+        if self._mmap is None or self._closed:
+            raise JournalError("Journal is not open")
+
+        with self._truncate_lock:
+            with self._lock:
+                base = self.base
+                copied = self._offset
+            start = offset - base + FILE_HEADER.size
+            if start <= FILE_HEADER.size:
+                return 0
+            if start > copied:
+                raise JournalError(f"Cannot truncate the journal past its end at {offset}")
+
+            tmp_path = self.path + ".tmp"
+            fd = os.open(tmp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                os.write(fd, FILE_HEADER.pack(MAGIC, offset))
+                source = self._file.fileno()
+                self._copy(source, fd, start, copied)
+                os.fsync(fd)
+
+                with self._lock, self._flush_lock:
+                    end = self._offset
+                    self._copy(source, fd, copied, end)
+                    size = max(GROW_BY, FILE_HEADER.size + end - start)
+                    os.ftruncate(fd, size)
+                    os.fsync(fd)
+                    os.replace(tmp_path, self.path)
+
+                    self._mmap.close()
+                    self._file.close()
+                    self._file = os.fdopen(fd, "r+b")
+                    self._mmap = mmap.mmap(fd, size)
+                    self._size = size
+                    self._offset = FILE_HEADER.size + end - start
+                    self._generation += 1
+                    # Everything is on disk in the new file
+                    with self._durable:
+                        self.base = offset
+                        self.durable_seq = self.last_seq
+                        self.durable_offset = self._offset
+                        self._durable.notify_all()
+            except BaseException as e:
+                if self._file is None or self._file.fileno() != fd:
+                    os.close(fd)
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                if isinstance(e, OSError):
+                    raise JournalError(f"Could not truncate the journal: {e}") from e
+                raise
+
+        directory = os.open(os.path.dirname(self.path) or ".", os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+        logging.info(f"Truncated journal to offset {offset}, dropped {start - FILE_HEADER.size} bytes")
+        return start - FILE_HEADER.size
+
+    @staticmethod
+    def _copy(source, target, start, end):
+        while start < end:
+            chunk = os.pread(source, min(COPY_CHUNK, end - start), start)
+            if not chunk:
+                raise OSError(f"Journal ends before offset {end}")
+            os.write(target, chunk)
+            start += len(chunk)
+
+    def close(self):
+        if self._mmap is None:
+            return
+        self.flush()
+        self._closed = True
+        self._pending.set()
+        if self._flusher:
+            self._flusher.join()
+        self._mmap.close()
+        self._file.close()
+        self._mmap = None
@@ -0,0 +1,200 @@
+# In-memory balance ledger
+# every (user_id, asset) balance lives in memory as integer amount units (see
+# fixedpoint), reservations are checked and applied atomically under one lock
+# and journaled as relative deltas, which the write-behind writer folds into
+# the balances table
+
+import logging
+import threading
+import time
+
+from fixedpoint import from_units, to_units
+
+
+def _changed_at(event):
+    return event["executed_at"] if event["type"] == "match" else event["updated_at"]
+
+
+class Balance:
+    __slots__ = ("available", "reserved", "updated_at")
+
+    def __init__(self, available=0, reserved=0, updated_at=None):
+        self.available = available
+        self.reserved = reserved
+        # epoch seconds of the last change
+        self.updated_at = updated_at
+
+
+class BalanceLedger:
+    """
+    Balances of every user, the source of truth for reads and pre-trade
+    checks.  A change is journaled before it is applied and both happen under
+    the ledger lock, so a snapshot taken under the lock holds exactly the
+    changes up to its journal position.
+    """
+
+    def __init__(self, journal):
+        self.journal = journal
+        # user_id -> {asset: Balance}
+        self._balances = {}
+        self._lock = threading.Lock()
+
+    def load(self, rows):
+        """
+        Replace the ledger with (user_id, asset, available, reserved,
+        updated_at) balances rows, e.g. on a cold start
+        """
+        balances = {}
+        for user_id, asset, available, reserved, updated_at in rows:
+            balances.setdefault(int(user_id), {})[asset] = Balance(
+                to_units(available),
+                to_units(reserved),
+                updated_at.timestamp() if updated_at else None,
+            )
+        with self._lock:
+            self._balances = balances
+        logging.info(f"Loaded {len(rows)} balances into the ledger")
+
+    def get(self, user_id, asset):
+        """(available, reserved) of one balance, None if the user has none"""
+        with self._lock:
+            balance = self._balances.get(user_id, {}).get(asset)
+            if balance is None:
+                return None
+            return balance.available, balance.reserved
+
+    def balances(self, user_id):
+        """asset -> (available, reserved, updated_at) of every balance of a user"""
+        with self._lock:
+            return {
+                asset: (balance.available, balance.reserved, balance.updated_at)
+                for asset, balance in self._balances.get(user_id, {}).items()
+            }
+
+    def _apply(self, deltas, updated_at):
+        for user_id, asset, available, reserved in deltas:
+            assets = self._balances.setdefault(user_id, {})
+            balance = assets.get(asset)
+            if balance is None:
+                balance = assets[asset] = Balance()
+            balance.available += available
+            balance.reserved = max(balance.reserved + reserved, 0)
+            balance.updated_at = updated_at
+
+    def _journal(self, deltas):
+        """Journal and apply a balance change, called with the lock held"""
+        updated_at = time.time()
+        seq = self.journal.append(
+            {"type": "balance", "deltas": deltas, "updated_at": updated_at}
+        )
+        self._apply(deltas, updated_at)
+        return seq
+
+    def transfer(self, user_id, changes, check=True):
+        """
+        Apply (asset, available_change, reserved_change) changes to one user
+        atomically, all or nothing.  With check, every asset must exist and
+        stay non-negative, otherwise ValueError is raised and nothing
+        changes.  Returns the journal seq, None when there was nothing to do.
+        """
+        netted = {}
+        for asset, available, reserved in changes:
+            delta = netted.setdefault(asset, [0, 0])
+            delta[0] += available
+            delta[1] += reserved
+        deltas = [
+            [user_id, asset, available, reserved]
+            for asset, (available, reserved) in netted.items()
+            if available or reserved
+        ]
+        if not deltas:
+            return None
+
+        with self._lock:
+            if check:
+                for _, asset, available, _ in deltas:
+                    balance = self._balances.get(user_id, {}).get(asset)
+                    if balance is None:
+                        raise ValueError(f"{asset} balance not found for user {user_id}")
+                    if balance.available + available < 0:
+                        raise ValueError(f"Insufficient {asset} balance")
+            return self._journal(deltas)
+
+    def reserve_each(self, user_id, needs):
+        """
+        Reserve (asset, amount) needs in sequence while the available balance
+        covers them, with one journaled delta per asset.  Returns
+        (error message or None per need, journal seq or None).
+        """
+        with self._lock:
+            balances = self._balances.get(user_id, {})
+            available = {}
+            errors = []
+            totals = {}
+            for asset, amount in needs:
+                if asset not in available:
+                    balance = balances.get(asset)
+                    available[asset] = balance.available if balance else None
+                if available[asset] is None:
+                    errors.append(f"{asset} balance not found")
+                elif available[asset] < amount:
+                    errors.append(
+                        f"Insufficient {asset} balance. Required: {from_units(amount)}, "
+                        f"Available: {from_units(available[asset])}"
+                    )
+                else:
+                    available[asset] -= amount
+                    totals[asset] = totals.get(asset, 0) + amount
+                    errors.append(None)
+
+            if not totals:
+                return errors, None
+            deltas = [[user_id, asset, -total, total] for asset, total in totals.items()]
+            return errors, self._journal(deltas)
+
+    def set(self, user_id, asset, available, reserved):
+        """Overwrite one balance, journaled as the delta to its current value"""
+        with self._lock:
+            balance = self._balances.get(user_id, {}).get(asset) or Balance()
+            deltas = [[user_id, asset, available - balance.available, reserved - balance.reserved]]
+            return self._journal(deltas)
+
+    def append(self, event):
+        """
+        Journal an event that carries balance deltas (a match) and apply
+        them, no checks: the reservations being settled were checked.
+        """
+        with self._lock:
+            seq = self.journal.append(event)
+            self._apply(event["deltas"], _changed_at(event))
+            return seq
+
+    def take(self):
+        """
+        (journal seq, {(user_id, asset): (available, reserved, updated_at)})
+        of every balance, as one consistent cut
+        """
+        with self._lock:
+            seq, _ = self.journal.position()
+            return seq, {
+                (user_id, asset): (balance.available, balance.reserved, balance.updated_at)
+                for user_id, assets in self._balances.items()
+                for asset, balance in assets.items()
+            }
+
+    def restore(self, seq, balances, records):
+        """
+        Rebuild from a cut made by take() plus the journal records after it,
+        as (seq, event, next_offset) tuples.
+        """
+        with self._lock:
+            self._balances = {}
+            for (user_id, asset), values in balances.items():
+                self._balances.setdefault(user_id, {})[asset] = Balance(*values)
+            replayed = 0
+            for record_seq, event, _ in records:
+                if record_seq <= seq or event["type"] not in ("balance", "match"):
+                    continue
+                self._apply(event["deltas"], _changed_at(event))
+                replayed += 1
+        return replayed
@@ -0,0 +1,225 @@
+# Push market data
+# every book mutation is published once per symbol as sequence-numbered
+# deltas and fanned out to the open streams, so read load no longer grows
+# with the number of screens polling the API
+
+import json
+import logging
+import queue
+import threading
+from collections import deque
+
+from fixedpoint import from_lots, from_ticks
+
+# Deltas kept per symbol so a reconnecting client can catch up without a snapshot
+HISTORY_SIZE = 5000
+# Frames a slow subscriber may fall behind before it is resynced with a snapshot
+QUEUE_SIZE = 10000
+
+
+def sse_frame(message, seq=None):
+    """Encode a message as a server-sent event, public deltas carry their seq as id"""
+    lines = []
+    if seq is not None:
+        lines.append(f"id: {seq}")
+    lines.append(f"event: {message['type']}")
+    lines.append("data: " + json.dumps(message, separators=(",", ":")))
+    return "\n".join(lines) + "\n\n"
+
+
+class Subscription:
+    """One open stream: a bounded queue of encoded frames"""
+
+    def __init__(self, symbol, user_id, maxsize=QUEUE_SIZE):
+        self.symbol = symbol
+        self.user_id = user_id
+        self.frames = queue.Queue(maxsize)
+        self.overflowed = False
+
+    def put(self, frame):
+        try:
+            self.frames.put_nowait(frame)
+        except queue.Full:
+            # Deltas are now missing, the stream has to start over from a snapshot
+            self.overflowed = True
+
+    def get(self, timeout=None):
+        """Next frame, or None if nothing arrived within timeout"""
+        try:
+            return self.frames.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def reset(self):
+        self.frames = queue.Queue(self.frames.maxsize)
+        self.overflowed = False
+
+
+class SymbolFeed:
+    """Sequence counter, replay history and subscribers of one symbol"""
+
+    def __init__(self, symbol, history=HISTORY_SIZE):
+        self.symbol = symbol
+        self.seq = 0
+        # (seq, frame) of the most recent public deltas
+        self.history = deque(maxlen=history)
+        self.subscribers = set()
+        self.lock = threading.Lock()
+
+    def replay(self, since):
+        """Frames after since, or None if the history no longer reaches back that far"""
+        if since > self.seq:
+            return None
+        if since == self.seq:
+            return []
+        if not self.history or self.history[0][0] > since + 1:
+            return None
+        return [frame for seq, frame in self.history if seq > since]
+
+
+class MarketDataHub:
+    """
+    Fans book deltas out to the streaming subscribers of each symbol.
+
+    publish() and subscribe() run under the book's lock, so the sequence of
+    deltas follows the order of the book mutations exactly and a snapshot
+    taken on subscribe is consistent with the first delta after it.
+    Public deltas (levels and trades) are numbered per symbol; a client that
+    sees a gap in seq reconnects with ?since= or takes a fresh snapshot.
+    Order updates are private to their owner and carry the book seq they
+    happened at instead of consuming a sequence number.
+    """
+
+    def __init__(self, history=HISTORY_SIZE, queue_size=QUEUE_SIZE):
+        self.history = history
+        self.queue_size = queue_size
+        self._feeds = {}
+        self._lock = threading.Lock()
+
+    def _feed(self, symbol):
+        feed = self._feeds.get(symbol)
+        if feed is None:
+            with self._lock:
+                feed = self._feeds.setdefault(symbol, SymbolFeed(symbol, self.history))
+        return feed
+
+    def seq(self, symbol):
+        feed = self._feeds.get(symbol)
+        return feed.seq if feed else 0
+
+    def publish(self, symbol, messages, private=()):
+        """
+        Number and fan out public messages, then deliver the private
+        (user_id, message) pairs to their owners' streams.
+        Must be called with the book's lock held.
+        """
+        feed = self._feed(symbol)
+        with feed.lock:
+            subscribers = tuple(feed.subscribers)
+
+        for message in messages:
+            feed.seq += 1
+            message["seq"] = feed.seq
+            message["symbol"] = symbol
+            frame = sse_frame(message, feed.seq)
+            feed.history.append((feed.seq, frame))
+            for subscription in subscribers:
+                subscription.put(frame)
+
+        for user_id, message in private:
+            message["book_seq"] = feed.seq
+            message["symbol"] = symbol
+            frame = None
+            for subscription in subscribers:
+                if subscription.user_id == user_id:
+                    frame = frame or sse_frame(message)
+                    subscription.put(frame)
+
+    def subscribe(self, book, user_id, since=None, levels=None):
+        """
+        Register a stream for book's symbol.  Returns the subscription and
+        the frames to send first: the deltas after since if they are still
+        in the history, otherwise a full snapshot.
+        """
+        subscription = Subscription(book.symbol, user_id, self.queue_size)
+        feed = self._feed(book.symbol)
+        with book.lock:
+            frames = feed.replay(since) if since is not None else None
+            if frames is None:
+                frames = [self._snapshot(book, feed, levels)]
+            with feed.lock:
+                feed.subscribers.add(subscription)
+
+        logging.info(
+            f"Market data subscriber for {book.symbol} (user {user_id}), {len(feed.subscribers)} open"
+        )
+        return subscription, frames
+
+    def resync(self, book, subscription, levels=None):
+        """Restart an overflowed subscription from a fresh snapshot"""
+        feed = self._feed(book.symbol)
+        with book.lock:
+            subscription.reset()
+            return self._snapshot(book, feed, levels)
+
+    def unsubscribe(self, subscription):
+        feed = self._feed(subscription.symbol)
+        with feed.lock:
+            feed.subscribers.discard(subscription)
+
+    @staticmethod
+    def _snapshot(book, feed, levels):
+        depth = book.depth(levels)
+
+        def as_levels(side):
+            return [
+                {"price": from_ticks(price), "quantity": from_lots(quantity), "orders": count}
+                for price, quantity, count in side
+            ]
+
+        message = {
+            "type": "snapshot",
+            "symbol": book.symbol,
+            "seq": feed.seq,
+            "bids": as_levels(depth["bids"]),
+            "asks": as_levels(depth["asks"]),
+        }
+        return sse_frame(message, feed.seq)
+
+
+def level_message(book, side, price):
+    """Absolute state of one price level, quantity 0 means the level is gone"""
+    quantity, count = book.level(side, price)
+    return {
+        "type": "level",
+        "side": side,
+        "price": from_ticks(price),
+        "quantity": from_lots(quantity),
+        "orders": count,
+    }
+
+
+def trade_message(price, quantity, taker_side, executed_at):
+    return {
+        "type": "trade",
+        "price": from_ticks(price),
+        "quantity": from_lots(quantity),
+        "side": taker_side,
+        "executed_at": executed_at,
+    }
+
+
+def order_message(order):
+    return {
+        "type": "order",
+        "id": order.id,
+        "side": order.side,
+        "price": from_ticks(order.price),
+        "quantity": from_lots(order.quantity),
+        "filled_quantity": from_lots(order.filled_quantity),
+        "status": order.status,
+        "updated_at": order.updated_at,
+    }
+
+
+market_data = MarketDataHub()
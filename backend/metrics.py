@@ -0,0 +1,220 @@
+# Latency and activity metrics
+# per-phase latency histograms of the order path plus per-symbol counters,
+# rendered in the Prometheus text format by GET /metrics.  Off unless
+# METRICS_ENABLED=1: every timer and counter call is then a flag check, and
+# with it on nothing is aggregated until a scrape asks for it
+
+import bisect
+import os
+import threading
+import time
+
+METRICS_ENABLED = bool(int(os.getenv("METRICS_ENABLED", 0)))
+
+# Linear sub-buckets per power of two of a LatencyHistogram: values are
+# kept to within 1/32 (about 3%)
+SUB_BUCKET_BITS = 5
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+# Largest value a histogram resolves, 2**26 us (about 67s), longer ones
+# land in the last bucket
+MAX_VALUE_BITS = 26
+BUCKET_COUNT = SUB_BUCKETS * (MAX_VALUE_BITS - SUB_BUCKET_BITS + 2)
+
+# Prometheus bucket bounds in seconds, counted from the finer histogram buckets
+EXPORT_BOUNDS = (
+    0.00001,
+    0.000025,
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+# Phase -> what it times
+PHASES = {
+    "request": "POST /orders from parsed request to response",
+    "checkout": "database pool checkout",
+    "reserve": "balance reservation in the ledger",
+    "sequencer": "hand-off to the symbol's sequencer worker and back, queueing included",
+    "journal": "journal append of a new order",
+    "match": "matching against the book",
+    "settle": "a match's fills into candles, tickers, ledger deltas and the journal",
+    "durable": "wait for the journal flush before answering",
+    "persist": "write-behind batch applied to the storage",
+}
+
+# Counter -> help, counted per symbol unless said otherwise
+COUNTERS = {
+    "orders": "Orders accepted into a book",
+    "fills": "Trades executed",
+    "rejects": "Orders turned down, balance or journal",
+    "rollbacks": "Balance reservations rolled back after the journal refused an order",
+    "persist_rollbacks": "Write-behind batches rolled back, not per symbol",
+}
+
+# Symbol label of counters for symbols that have no book, so request input
+# cannot add label values of its own
+OTHER_SYMBOL = "other"
+
+
+def _escape(value):
+    """A label value as the text format quotes it"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _bucket(micros):
+    """Histogram bucket index of a duration in whole microseconds"""
+    if micros < SUB_BUCKETS:
+        return micros
+    shift = micros.bit_length() - SUB_BUCKET_BITS - 1
+    return min(SUB_BUCKETS * (shift + 1) + (micros >> shift) - SUB_BUCKETS, BUCKET_COUNT - 1)
+
+
+def _bucket_limit(index):
+    """Largest duration in whole microseconds that falls into a bucket"""
+    if index < SUB_BUCKETS:
+        return index
+    shift = index // SUB_BUCKETS - 1
+    return ((SUB_BUCKETS + index % SUB_BUCKETS + 1) << shift) - 1
+
+
+class LatencyHistogram:
+    """
+    HDR-style histogram of durations: log-linear buckets of whole
+    microseconds, so recording is an index computation and an increment
+    whatever the range of values
+    """
+
+    __slots__ = ("counts", "count", "total", "max", "_lock")
+
+    def __init__(self):
+        self.counts = [0] * BUCKET_COUNT
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        index = _bucket(int(seconds * 1e6))
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def snapshot(self):
+        """(sparse {bucket: count}, count, total seconds, max seconds)"""
+        with self._lock:
+            counts = {index: n for index, n in enumerate(self.counts) if n}
+            return counts, self.count, self.total, self.max
+
+    @staticmethod
+    def quantile(counts, count, fraction, largest):
+        """Duration in seconds at a fraction of a snapshot's values, to the bucket's precision"""
+        if not count:
+            return 0.0
+        rank = max(1, int(fraction * count + 0.5))
+        seen = 0
+        for index in sorted(counts):
+            seen += counts[index]
+            if seen >= rank:
+                return min(_bucket_limit(index) / 1e6, largest)
+        return largest
+
+
+class Metrics:
+    """The histograms of every phase and the counters, keyed by (name, symbol)"""
+
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self.histograms = {phase: LatencyHistogram() for phase in PHASES}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def clock(self):
+        """Start of a timed phase, pass it to observe()"""
+        return time.perf_counter() if self.enabled else 0.0
+
+    def observe(self, phase, started):
+        if self.enabled:
+            self.histograms[phase].record(time.perf_counter() - started)
+
+    def count(self, name, symbol=None, n=1):
+        if self.enabled:
+            key = (name, symbol)
+            with self._lock:
+                self.counters[key] = self.counters.get(key, 0) + n
+
+    def render(self, gauges=()):
+        """
+        Prometheus text exposition of everything recorded so far, followed by
+        gauges: (name, help, type, [(labels dict, value)]) families of state
+        owned elsewhere, e.g. the connection pools
+        """
+        lines = [
+            "# HELP orderbook_phase_seconds Latency of the order path phases, see metrics.PHASES",
+            "# TYPE orderbook_phase_seconds histogram",
+        ]
+        quantiles = []
+        for phase, histogram in self.histograms.items():
+            counts, count, total, largest = histogram.snapshot()
+            label = f'phase="{phase}"'
+            cumulative = [0] * len(EXPORT_BOUNDS)
+            for index, n in counts.items():
+                position = bisect.bisect_left(EXPORT_BOUNDS, _bucket_limit(index) / 1e6)
+                if position < len(EXPORT_BOUNDS):
+                    cumulative[position] += n
+            seen = 0
+            for bound, n in zip(EXPORT_BOUNDS, cumulative):
+                seen += n
+                lines.append(f'orderbook_phase_seconds_bucket{{{label},le="{bound}"}} {seen}')
+            lines.append(f'orderbook_phase_seconds_bucket{{{label},le="+Inf"}} {count}')
+            lines.append(f"orderbook_phase_seconds_sum{{{label}}} {total}")
+            lines.append(f"orderbook_phase_seconds_count{{{label}}} {count}")
+            for fraction in QUANTILES:
+                value = LatencyHistogram.quantile(counts, count, fraction, largest)
+                quantiles.append(
+                    f'orderbook_phase_quantile_seconds{{{label},quantile="{fraction}"}} {value}'
+                )
+            quantiles.append(f'orderbook_phase_quantile_seconds{{{label},quantile="1"}} {largest}')
+
+        lines.append("# HELP orderbook_phase_quantile_seconds Phase latency quantiles since start")
+        lines.append("# TYPE orderbook_phase_quantile_seconds gauge")
+        lines.extend(quantiles)
+
+        with self._lock:
+            counters = sorted(self.counters.items(), key=lambda item: item[0][1] or "")
+        for name, help in COUNTERS.items():
+            lines.append(f"# HELP orderbook_{name}_total {help}")
+            lines.append(f"# TYPE orderbook_{name}_total counter")
+            for (counter, symbol), value in counters:
+                if counter == name:
+                    labels = f'{{symbol="{_escape(symbol)}"}}' if symbol is not None else ""
+                    lines.append(f"orderbook_{name}_total{labels} {value}")
+
+        for name, help, kind, samples in gauges:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                rendered = ",".join(f'{key}="{_escape(label)}"' for key, label in labels.items())
+                lines.append(f"{name}{{{rendered}}} {value}" if rendered else f"{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
@@ -0,0 +1,503 @@
+# In-memory price-time priority order book
+# MySQL stays the persistence layer, the book is the matching data structure
+# prices are integer ticks and quantities integer lots, see fixedpoint
+
+import bisect
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from fixedpoint import to_lots, to_ticks
+
+# Listed instruments, comma separated.  Orders for anything else are
+# refused before they can create a book or a sequencer worker
+SYMBOLS = tuple(
+    symbol.strip()
+    for symbol in os.getenv("SYMBOLS", "BTCUSD,ETHUSD,SOLUSD,ADAUSD,AAPLUSD").split(",")
+    if symbol.strip()
+)
+
+# Order changes remembered for ?since= queries, a client that is further
+# behind than this gets the full list again
+CHANGE_LOG_SIZE = 100000
+
+
+class PriceLevel:
+    """FIFO queue of resting orders at a single price"""
+
+    __slots__ = ("price", "orders", "quantity")
+
+    def __init__(self, price):
+        self.price = price
+        # dicts keep insertion order, so this doubles as a FIFO queue
+        # with O(1) removal by order id
+        self.orders = {}
+        # Unfilled quantity resting at this price, kept up to date on every
+        # add, fill and removal so depth queries never walk the orders
+        self.quantity = 0
+
+    def __len__(self):
+        return len(self.orders)
+
+    def append(self, order):
+        self.orders[order.id] = order
+        self.quantity += order.quantity - order.filled_quantity
+
+    def remove(self, order_id):
+        order = self.orders.pop(order_id, None)
+        if order is not None:
+            self.quantity -= order.quantity - order.filled_quantity
+        return order
+
+
+class OrderBook:
+    """
+    Price-time priority book for a single symbol.
+
+    Price levels are kept in sorted key lists so the best bid and best ask
+    are always the last element (O(1)), and inserting a new level is a
+    binary search (O(log n)).  Bids are keyed by price, asks by -price.
+    """
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.lock = threading.Lock()
+        self.clear()
+
+    def __len__(self):
+        return len(self._orders)
+
+    def clear(self):
+        self._levels = {"BUY": {}, "SELL": {}}
+        self._keys = {"BUY": [], "SELL": []}
+        self._orders = {}
+
+    def __contains__(self, order_id):
+        return order_id in self._orders
+
+    @staticmethod
+    def _key(side, price):
+        return price if side == "BUY" else -price
+
+    def _best_level(self, side):
+        keys = self._keys[side]
+        if not keys:
+            return None
+        return self._levels[side][keys[-1]]
+
+    def best_bid(self):
+        level = self._best_level("BUY")
+        return level.price if level else None
+
+    def best_ask(self):
+        level = self._best_level("SELL")
+        return level.price if level else None
+
+    def get(self, order_id):
+        return self._orders.get(order_id)
+
+    def add(self, order):
+        """Rest an order at the back of its price level"""
+        side = order.side
+        key = self._key(side, order.price)
+        levels = self._levels[side]
+        level = levels.get(key)
+        if level is None:
+            level = levels[key] = PriceLevel(order.price)
+            bisect.insort(self._keys[side], key)
+        level.append(order)
+        self._orders[order.id] = order
+
+    def remove(self, order_id):
+        """Remove a resting order, returns it or None if it is not in the book"""
+        order = self._orders.pop(order_id, None)
+        if order is None:
+            return None
+        side = order.side
+        key = self._key(side, order.price)
+        level = self._levels[side][key]
+        level.remove(order_id)
+        if not level:
+            self._drop_level(side, key)
+        return order
+
+    def remove_user_orders(self, user_id, side=None):
+        """
+        Remove every resting order of a user, optionally only one side, in a
+        single pass over the levels.  Returns the removed orders, best price
+        first.
+        """
+        removed = []
+        for book_side in (side,) if side else ("BUY", "SELL"):
+            levels = self._levels[book_side]
+            keys = self._keys[book_side]
+            kept = []
+            for key in reversed(keys):
+                level = levels[key]
+                for order in [o for o in level.orders.values() if o.user_id == user_id]:
+                    level.remove(order.id)
+                    del self._orders[order.id]
+                    removed.append(order)
+                if level:
+                    kept.append(key)
+                else:
+                    del levels[key]
+            kept.reverse()
+            # Rebuilt in place, emptied levels cost no per-level list deletes
+            keys[:] = kept
+        return removed
+
+    def _drop_level(self, side, key):
+        del self._levels[side][key]
+        keys = self._keys[side]
+        if keys and keys[-1] == key:
+            keys.pop()
+        else:
+            del keys[bisect.bisect_left(keys, key)]
+
+    @staticmethod
+    def _crosses(order, level_price):
+        if order.side == "BUY":
+            return level_price <= order.price
+        return level_price >= order.price
+
+    def fills_for(self, order):
+        """
+        Work out how an incoming order matches against the opposite side,
+        without filling anything, so the fills can be journaled before the
+        book changes; fill() then applies them.
+
+        Fills are at the resting order's price, best price first and oldest
+        first within a price.  Orders from the same user are skipped.
+        Returns a list of (resting_order, quantity, price) fills.
+        """
+        opposite = "SELL" if order.side == "BUY" else "BUY"
+        keys = self._keys[opposite]
+        levels = self._levels[opposite]
+        fills = []
+        remaining = order.quantity - order.filled_quantity
+
+        index = len(keys) - 1
+        while remaining > 0 and index >= 0:
+            key = keys[index]
+            level = levels[key]
+            if not self._crosses(order, level.price):
+                break
+
+            # The walk stops at the last fill rather than copying the level
+            stale = []
+            for resting in level.orders.values():
+                resting_remaining = resting.quantity - resting.filled_quantity
+                if resting_remaining <= 0:
+                    # Nothing left to trade, never emit a 0-lot fill for it
+                    stale.append(resting)
+                    continue
+                if resting.user_id == order.user_id:
+                    continue
+
+                trade_quantity = min(remaining, resting_remaining)
+                remaining -= trade_quantity
+                fills.append((resting, trade_quantity, level.price))
+                if remaining <= 0:
+                    break
+
+            # Evicting those is the one change, nothing is traded against them
+            for resting in stale:
+                resting.status = "FILLED"
+                del level.orders[resting.id]
+                del self._orders[resting.id]
+            if not level:
+                self._drop_level(opposite, key)
+            index -= 1
+
+        return fills
+
+    def fill(self, order, fills):
+        """
+        Apply fills from fills_for() to the book.  Filled quantities are
+        updated in place, fully filled resting orders leave the book and any
+        unfilled remainder of the incoming order is rested.
+        """
+        opposite = "SELL" if order.side == "BUY" else "BUY"
+        levels = self._levels[opposite]
+        for resting, trade_quantity, price in fills:
+            key = self._key(opposite, price)
+            level = levels[key]
+            resting.filled_quantity += trade_quantity
+            level.quantity -= trade_quantity
+            order.filled_quantity += trade_quantity
+            if resting.filled_quantity >= resting.quantity:
+                resting.status = "FILLED"
+                del level.orders[resting.id]
+                del self._orders[resting.id]
+                if not level:
+                    self._drop_level(opposite, key)
+            else:
+                resting.status = "PARTIAL"
+
+        remaining = order.quantity - order.filled_quantity
+        if fills:
+            order.status = "FILLED" if remaining <= 0 else "PARTIAL"
+        if remaining > 0:
+            self.add(order)
+
+    def set_filled(self, order_id, filled_quantity):
+        """Apply a known fill to a resting order, removing it once fully filled"""
+        order = self._orders.get(order_id)
+        if order is None:
+            return None
+        if filled_quantity >= order.quantity:
+            self.remove(order_id)
+            order.filled_quantity = filled_quantity
+            order.status = "FILLED"
+        else:
+            level = self._levels[order.side][self._key(order.side, order.price)]
+            level.quantity -= filled_quantity - order.filled_quantity
+            order.filled_quantity = filled_quantity
+            order.status = "PARTIAL"
+        return order
+
+    def depth(self, levels=None):
+        """
+        Aggregated book, best price first on both sides, as
+        {"bids": [(price, quantity, order_count)], "asks": [...]}.
+        Costs O(levels), the aggregates are maintained as orders change.
+        """
+        result = {}
+        for side, name in (("BUY", "bids"), ("SELL", "asks")):
+            keys = self._keys[side]
+            side_levels = self._levels[side]
+            start = 0 if levels is None else max(len(keys) - levels, 0)
+            result[name] = [
+                (level.price, level.quantity, len(level))
+                for level in (side_levels[key] for key in reversed(keys[start:]))
+            ]
+        return result
+
+    def ranked_orders(self):
+        """Resting orders, bids then asks, best price first and oldest first within a price"""
+        ranked = []
+        for side in ("BUY", "SELL"):
+            levels = self._levels[side]
+            for key in reversed(self._keys[side]):
+                ranked.extend(levels[key].orders.values())
+        return ranked
+
+    def level(self, side, price):
+        """(quantity, order_count) resting at a price, (0, 0) for an empty level"""
+        level = self._levels[side].get(self._key(side, price))
+        if level is None:
+            return 0, 0
+        return level.quantity, len(level)
+
+    def orders(self):
+        return list(self._orders.values())
+
+
+# Columns of an order, in Order and SELECT order
+ORDER_COLUMNS = (
+    "id",
+    "user_id",
+    "symbol",
+    "side",
+    "price",
+    "quantity",
+    "filled_quantity",
+    "status",
+    "created_at",
+    "updated_at",
+)
+
+
+class Order:
+    """
+    An order on the matching path: price in ticks, quantities in lots and
+    times in epoch seconds.  Slotted, a resting order costs a fraction of
+    the dict (plus two datetimes) it used to be.
+    """
+
+    __slots__ = ORDER_COLUMNS
+
+    def __init__(
+        self,
+        id,
+        user_id,
+        symbol,
+        side,
+        price,
+        quantity,
+        filled_quantity=0,
+        status="PENDING",
+        created_at=0.0,
+        updated_at=0.0,
+    ):
+        self.id = id
+        self.user_id = user_id
+        self.symbol = symbol
+        self.side = side
+        self.price = price
+        self.quantity = quantity
+        self.filled_quantity = filled_quantity
+        self.status = status
+        self.created_at = created_at
+        self.updated_at = updated_at
+
+    def copy(self):
+        return Order(
+            self.id,
+            self.user_id,
+            self.symbol,
+            self.side,
+            self.price,
+            self.quantity,
+            self.filled_quantity,
+            self.status,
+            self.created_at,
+            self.updated_at,
+        )
+
+
+def book_order(row):
+    """Row factory: Order from an ORDER_COLUMNS tuple as a plain cursor returns it"""
+    order_id, user_id, symbol, side, price, quantity, filled, status, created, updated = row
+    return Order(
+        int(order_id),
+        int(user_id),
+        symbol,
+        side,
+        to_ticks(price),
+        to_lots(quantity),
+        to_lots(filled),
+        status,
+        created.timestamp(),
+        updated.timestamp(),
+    )
+
+
+class BookRegistry:
+    """
+    Holds one OrderBook per symbol, plus the book version: a counter bumped
+    by touch() on every mutation, with a bounded log of the orders each
+    version changed so readers can ask for just the changes after a version.
+    """
+
+    def __init__(self):
+        self._books = {}
+        self._lock = threading.Lock()
+        self.version = 0
+        self._version_lock = threading.Lock()
+        # order_id -> (version, copy of the order), oldest change first
+        self._changes = OrderedDict()
+        # Changes at or below the horizon may have been dropped from the log
+        self._horizon = 0
+        # user_id -> (version, journal seq) of the user's latest order change
+        self._user_versions = {}
+        self._base = (0, 0)
+
+    def get(self, symbol):
+        book = self._books.get(symbol)
+        if book is None:
+            with self._lock:
+                book = self._books.setdefault(symbol, OrderBook(symbol))
+        return book
+
+    def find(self, symbol):
+        """Like get(), but returns None instead of creating an empty book"""
+        return self._books.get(symbol)
+
+    def tradable(self, symbol):
+        """A listed symbol, or one that still has a book from before it was delisted"""
+        return symbol in SYMBOLS or symbol in self._books
+
+    def symbols(self):
+        return list(self._books)
+
+    def clear(self):
+        with self._lock:
+            self._books = {}
+
+    def load(self, rows):
+        """Build every book from the open orders, ORDER_COLUMNS rows oldest first"""
+        self.clear()
+        for row in rows:
+            order = book_order(row)
+            self.get(order.symbol).add(order)
+
+        logging.info(f"Loaded {len(rows)} open orders into {len(self._books)} books")
+
+    def locate(self, order_id):
+        """Return the symbol of the book an order is resting in, or None"""
+        for symbol, book in list(self._books.items()):
+            if order_id in book:
+                return symbol
+        return None
+
+    def remove(self, symbol, order_id):
+        book = self.get(symbol)
+        with book.lock:
+            return book.remove(order_id)
+
+    def reset_version(self, version, journal_seq):
+        """Start counting from version, e.g. the journal position at startup"""
+        with self._version_lock:
+            self.version = self._horizon = version
+            self._changes.clear()
+            self._user_versions = {}
+            self._base = (version, journal_seq)
+
+    def touch(self, orders, journal_seq):
+        """
+        Bump the version for one mutation and log the orders it changed.
+        Called with the book's lock held, right after the mutation, so a
+        reader that sees the new version also sees the change in the book.
+        """
+        copies = [order.copy() for order in orders]
+        with self._version_lock:
+            self.version += 1
+            for order in copies:
+                self._changes.pop(order.id, None)
+                self._changes[order.id] = (self.version, order)
+                self._user_versions[order.user_id] = (self.version, journal_seq)
+            while len(self._changes) > CHANGE_LOG_SIZE:
+                _, (version, _) = self._changes.popitem(last=False)
+                self._horizon = version
+            return self.version
+
+    def user_version(self, user_id):
+        """(version, journal seq) of the latest change to any of the user's orders"""
+        with self._version_lock:
+            return self._user_versions.get(user_id, self._base)
+
+    def changed_since(self, version, user_id=None):
+        """
+        (current version, latest state of the orders changed after version),
+        optionally only the orders of one user.  The orders are None when the
+        change log no longer reaches back to version.
+        """
+        with self._version_lock:
+            current = self.version
+            if version < self._horizon or version > current:
+                return current, None
+            changed = []
+            for order_version, order in reversed(self._changes.values()):
+                if order_version <= version:
+                    break
+                if user_id is None or order.user_id == user_id:
+                    changed.append(order)
+        changed.reverse()
+        return current, changed
+
+    def open_orders(self):
+        """(version, copies of every resting order), ordered by symbol and rank"""
+        with self._version_lock:
+            version = self.version
+        orders = []
+        for symbol in sorted(self.symbols()):
+            book = self.get(symbol)
+            with book.lock:
+                orders.extend(order.copy() for order in book.ranked_orders())
+        return version, orders
+
+
+order_books = BookRegistry()
@@ -0,0 +1,77 @@
+# Response cache for the public read endpoints
+# an entry is tagged with the generation of the data it was built from (the
+# book version, the journal seq of the last persisted trades) and is stale
+# as soon as the order or matching path moves that generation on, so any
+# number of polling clients cost one build per change instead of one per
+# request
+
+import threading
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    Bounded LRU of key -> (generation, value).  Concurrent misses on the
+    same key and generation wait for the first one's build instead of
+    running their own.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # key -> (generation, Event) of the build in progress
+        self._building = {}
+        self._lock = threading.Lock()
+
+    def peek(self, key, generation):
+        """The cached value if it is at least at generation, else None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < generation:
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, generation, value):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= generation:
+                self._entries[key] = (generation, value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key, generation, build):
+        """
+        The value for key at generation or later.  On a miss build() runs
+        and returns (generation it saw, value), which is cached and returned.
+        """
+        while True:
+            value = self.peek(key, generation)
+            if value is not None:
+                return value
+            with self._lock:
+                pending = self._building.get(key)
+                if pending is None or pending[0] < generation:
+                    done = threading.Event()
+                    self._building[key] = (generation, done)
+                    self.misses += 1
+                    break
+            pending[1].wait()
+
+        try:
+            built_generation, value = build()
+            self.put(key, built_generation, value)
+            return value
+        finally:
+            with self._lock:
+                if self._building.get(key, (None, None))[1] is done:
+                    del self._building[key]
+            done.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
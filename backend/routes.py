@@ -1,12 +1,12 @@
-from flask import Blueprint, Flask, Response, jsonify, request, current_app
-from db_pool import get_db_connection
-import mysql.connector
+from flask import Blueprint, Flask, Response, jsonify, request, current_app, stream_with_context
 import logging
+from concurrent.futures import TimeoutError as FutureTimeout
+from functools import partial
 import bcrypt
 import os
 from flask_jwt_extended import jwt_required, get_jwt_identity, create_access_token
 from datetime import datetime, timedelta
-from decimal import Decimal, ROUND_DOWN
+from json.encoder import encode_basestring_ascii
 
 # Import helper functions
 from helpers import (
@@ -16,45 +16,204 @@ from helpers import (
     update_balance,
     reserve_balance_for_order,
     release_balance_for_order,
+    reserve_balances_for_orders,
+    release_balances_for_orders,
+    move_reservation,
     process_trade_settlement,
-    match_orders,
+)
+from fixedpoint import MAX_LOTS, MAX_TICKS, from_lots, from_ticks, to_lots, to_ticks, to_units
+from response_cache import ResponseCache
+from serializer import encode_rows, join_rows, row_encoder
+from orderbook import ORDER_COLUMNS, SYMBOLS, order_books
+from sequencer import sequencer, RESULT_TIMEOUT
+from storage import (
+    DatabaseError,
+    ORDER_FIELDS,
+    TRANSACTION_FIELDS,
+    USER_TRANSACTION_FIELDS,
+    storage,
+)
+from db_pool import pool_snapshots
+from journal import JournalError
+from marketdata import market_data
+from metrics import OTHER_SYMBOL, metrics
+from candles import candle_engine, INTERVALS
+from ticker import tickers
+from engine import (
+    MatchError,
+    journal,
+    writer,
+    ledger,
+    new_order,
+    submit_order,
+    submit_orders,
+    rematch_order,
+    cancel_order,
+    cancel_orders,
+    amend_order,
 )
 
 bp = Blueprint("bp", __name__)
 
+# Seconds of silence after which an open market data stream gets a keepalive
+STREAM_KEEPALIVE = 15
+# Seconds GET /user/orders waits for MySQL to catch up with the user's latest order change
+USER_ORDERS_WAIT = 1.0
+
+# Payloads that are the same for every user, rebuilt when the book version
+# or the persisted trades move on
+response_cache = ResponseCache()
+
+
+# Encoders of the order rows (see serializer): MySQL rows in ORDER_FIELDS
+# order, and Orders from the books in the same shape
+ORDER_ENCODER = row_encoder(
+    zip(
+        ORDER_FIELDS,
+        ("int", "str", "str", "decimal", "decimal", "str", "decimal", "datetime", "datetime"),
+    )
+)
+# Prices and quantities as DECIMAL strings, like the MySQL rows
+BOOK_ORDER_KINDS = (
+    "int", "str", "str", "ticks_decimal", "lots_decimal", "str", "lots_decimal", "epoch", "epoch"
+)
+BOOK_ORDER_ENCODER = row_encoder(zip(ORDER_FIELDS, BOOK_ORDER_KINDS), attributes=True)
+PUBLIC_ORDER_ENCODER = row_encoder(
+    zip(ORDER_FIELDS + ("user_id",), BOOK_ORDER_KINDS + ("int",)), attributes=True
+)
+PUBLIC_ORDER_COLUMNS = PUBLIC_ORDER_ENCODER.names + ("is_own_order",)
+
+
+def _rows(rows, columns):
+    """Row factory for plain cursors: one dict per row, keyed by the selected columns"""
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def _json_response(body):
+    """Response for an already serialized JSON body"""
+    return current_app.response_class(body, mimetype=current_app.json.mimetype)
+
+
+def _compact():
+    """?format=compact: rows as arrays of values, with the field names once as "columns" """
+    return request.args.get("format") == "compact"
+
+
+def _rows_response(encoder, rows, envelope=None, key="rows"):
+    """
+    JSON response of rows through a serializer encoder, in the envelope
+    dict when there is one; ?stream=1 sends the body in chunks as it is
+    encoded instead of building it first
+    """
+    chunks = encode_rows(encoder, rows, envelope, key, _compact())
+    if request.args.get("stream", type=int):
+        return _json_response(stream_with_context(chunks))
+    return _json_response("".join(chunks))
+
+
+def _public_order_fragments(orders, compact):
+    """
+    One JSON object (array when compact) per order with is_own_order false,
+    plus user_id -> [(index, the same with is_own_order true)], the only
+    part that differs between users
+    """
+    encode = PUBLIC_ORDER_ENCODER.array if compact else PUBLIC_ORDER_ENCODER.object
+    false, true = ("false]", "true]") if compact else ('"is_own_order":false}', '"is_own_order":true}')
+    fragments = []
+    own = {}
+    for index, order in enumerate(orders):
+        head = encode(order)[:-1] + ","
+        fragments.append(head + false)
+        own.setdefault(order.user_id, []).append((index, head + true))
+    return fragments, own
+
+
+def _own_order_overlay(fragments, own, user_id):
+    mine = own.get(user_id)
+    if mine:
+        fragments = list(fragments)
+        for index, fragment in mine:
+            fragments[index] = fragment
+    return fragments
+
+
+def _public_orders(compact):
+    """GET /orders fragments of the current book version, for the response cache"""
+    version, orders = order_books.open_orders()
+    return version, (version, *_public_order_fragments(orders, compact))
+
 
 # get all orders
 @bp.route("/orders", methods=["GET"])
 @jwt_required()
 def get_orders():
-    try:
-        current_user_id = get_user_id_int()
-
-        with get_db_connection() as db:
-            cursor = db.cursor(dictionary=True)
-            cursor.execute(
-                """
-                SELECT id, user_id, symbol, side, price, quantity, status, 
-                       filled_quantity, created_at, updated_at,
-                       CASE WHEN user_id = %s THEN true ELSE false END as is_own_order
-                FROM orders 
-                WHERE status IN ('PENDING', 'PARTIAL')
-                ORDER BY 
-                    symbol ASC,
-                    CASE WHEN side = 'BUY' THEN price END DESC,
-                    CASE WHEN side = 'SELL' THEN price END ASC,
-                    created_at ASC
-            """,
-                (current_user_id,),
-            )
-            orders = cursor.fetchall()
-            cursor.close()
-
-            return jsonify(orders)
-
-    except mysql.connector.Error as err:
-        logging.error(f"Error fetching orders: {err}")
-        return Response(status=500)
+    """
+    Open orders straight from the books.  Responses carry the book version as
+    ETag, so an unchanged book costs a 304; ?since=<version> returns only the
+    orders changed after that version, closed ones included.
+    """
+    current_user_id = get_user_id_int()
+    compact = _compact()
+    columns = PUBLIC_ORDER_COLUMNS if compact else None
+
+    since = request.args.get("since", type=int)
+    if since is not None:
+        version, orders = order_books.changed_since(since)
+        full = orders is None
+        if full:
+            version, orders = order_books.open_orders()
+        fragments = _own_order_overlay(
+            *_public_order_fragments(orders, compact), current_user_id
+        )
+        return _json_response(
+            join_rows(fragments, {"version": version, "full": full}, "orders", columns)
+        )
+
+    if request.if_none_match.contains(str(order_books.version)):
+        return Response(status=304)
+
+    version, fragments, own = response_cache.get(
+        ("orders", compact), order_books.version, lambda: _public_orders(compact)
+    )
+    fragments = _own_order_overlay(fragments, own, current_user_id)
+    response = _json_response(join_rows(fragments, columns=columns))
+    response.set_etag(str(version))
+    # Browsers revalidate every poll, an unchanged book then costs a 304
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["Vary"] = "Authorization"
+    return response
+
+
+def _user_order_changes(user_id, since):
+    """Response to ?since=<version> from the book change log, None if it has to be a full list"""
+    if since is None:
+        return None
+    version, orders = order_books.changed_since(since, user_id)
+    if orders is None:
+        return None
+    return _rows_response(
+        BOOK_ORDER_ENCODER, orders, {"success": True, "version": version, "full": False}, "orders"
+    )
+
+
+def _user_orders_response(rows, since, version):
+    """
+    Full order list of a user from ORDER_FIELDS rows, tagged with the book
+    version when MySQL was caught up with it
+    """
+    envelope = {"success": True}
+    if since is not None:
+        envelope["full"] = True
+    if version is not None:
+        envelope["version"] = version
+    response = _rows_response(ORDER_ENCODER, rows, envelope, "orders")
+    if version is None:
+        return response
+
+    response.set_etag(str(version))
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["Vary"] = "Authorization"
+    return response
 
 
 # Add this new route for getting user's orders
@@ -63,29 +222,137 @@ def get_orders():
 def get_user_orders():
     try:
         user_id = get_user_id_int()
+        since = request.args.get("since", type=int)
+        changes = _user_order_changes(user_id, since)
+        if changes is not None:
+            return changes
 
-        with get_db_connection() as db:
-            cursor = db.cursor(dictionary=True)
-            cursor.execute(
-                """
-                SELECT id, symbol, side, price, quantity, status, 
-                       filled_quantity, created_at, updated_at
-                FROM orders 
-                WHERE user_id = %s 
-                ORDER BY created_at DESC
-            """,
-                (user_id,),
-            )
-            orders = cursor.fetchall()
-            cursor.close()
+        # The full list comes from MySQL, which only answers for a version
+        # once the write-behind writer has caught up with it - on the
+        # primary, a replica may still be behind
+        version, journal_seq = order_books.user_version(user_id)
+        current = writer.wait_persisted(journal_seq, USER_ORDERS_WAIT)
+        if current and request.if_none_match.contains(str(version)):
+            return Response(status=304)
+
+        orders = storage.user_orders(user_id)
 
-            return jsonify({"success": True, "orders": orders})
+        return _user_orders_response(orders, since, version if current else None)
 
-    except mysql.connector.Error as err:
+    except DatabaseError as err:
         logging.error(f"Error fetching user orders: {err}")
         return jsonify({"error": "Database error"}), 500
 
 
+# Longest symbol the orders.symbol VARCHAR(10) column holds
+MAX_SYMBOL_LENGTH = 10
+
+
+def _parse_order(data):
+    """
+    Validated (symbol, side, quantity lots, price ticks) of an order request,
+    raises ValueError
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Order must be a JSON object")
+
+    # Validate required fields
+    for field in ("symbol", "side", "quantity"):
+        if field not in data:
+            raise ValueError(f"Missing required field: {field}")
+
+    # Get and validate data
+    try:
+        quantity = to_lots(data["quantity"])
+        price = to_ticks(data.get("price", 0))
+    except (TypeError, ValueError):
+        raise ValueError("Invalid numeric value provided")
+    symbol = data["symbol"]
+    side = str(data["side"]).upper()
+    order_type = data.get("order_type", "LIMIT")
+
+    # Validate values, within what the orders columns hold so the
+    # write-behind writer can persist every order the journal takes
+    if not isinstance(symbol, str) or not 0 < len(symbol) <= MAX_SYMBOL_LENGTH:
+        raise ValueError(f"Symbol must be a string of at most {MAX_SYMBOL_LENGTH} characters")
+    if symbol not in SYMBOLS:
+        raise ValueError(f"Symbol must be one of {', '.join(SYMBOLS)}")
+    if quantity <= 0:
+        raise ValueError("Quantity must be greater than 0")
+    if quantity > MAX_LOTS:
+        raise ValueError(f"Quantity must be at most {from_lots(MAX_LOTS)}")
+    if order_type != "MARKET" and price <= 0:
+        raise ValueError("Price must be greater than 0 for non-market orders")
+    if price > MAX_TICKS:
+        raise ValueError(f"Price must be at most {from_ticks(MAX_TICKS)}")
+    if side not in ["BUY", "SELL"]:
+        raise ValueError("Side must be either 'BUY' or 'SELL'")
+
+    return symbol, side, quantity, price
+
+
+def _metric_symbol(symbol):
+    """Counter label of a requested symbol, OTHER_SYMBOL unless it has a book"""
+    if isinstance(symbol, str) and order_books.find(symbol) is not None:
+        return symbol
+    return OTHER_SYMBOL
+
+
+def _accepted_order(order):
+    return {
+        "id": order.id,
+        "user_id": order.user_id,
+        "symbol": order.symbol,
+        "side": order.side,
+        "price": from_ticks(order.price),
+        "quantity": from_lots(order.quantity),
+        "status": order.status,
+        "filled_quantity": from_lots(order.filled_quantity),
+    }
+
+
+def _pending_order_body(order):
+    """202 body of an order that is accepted but not confirmed on disk yet"""
+    return {
+        "success": True,
+        "message": "Order accepted, still being processed",
+        "order": _accepted_order(order),
+    }
+
+
+def _refused_order(user_id, side, symbol, quantity, price):
+    """Give back the reservation of an order that was never sequenced, 503 response"""
+    release_balance_for_order(ledger, user_id, side, symbol, quantity, price)
+    metrics.count("rejects", _metric_symbol(symbol))
+    metrics.count("rollbacks", _metric_symbol(symbol))
+    return jsonify({"error": "Order could not be accepted"}), 503
+
+
+def _release_if_refused(user_id, orders, future):
+    """
+    Done callback of a sequencer job a request stopped waiting for: release
+    the reservations of the orders the journal refused.  The job returned a
+    seq per order (None when refused) or a single seq, or raised: only a
+    JournalError means the order record itself was never written.
+    """
+    if future.cancelled():
+        refused = orders
+    elif isinstance(future.exception(), JournalError):
+        refused = orders
+    elif future.exception() is not None:
+        return
+    else:
+        result = future.result()
+        seqs = result if isinstance(result, list) else [result]
+        refused = [order for order, seq in zip(orders, seqs) if seq is None]
+    if not refused:
+        return
+    try:
+        release_balances_for_orders(ledger, user_id, refused)
+    except Exception as e:
+        logging.error(f"Could not release balances of refused orders {[o.id for o in refused]}: {e}")
+
+
 # create a new order
 @bp.route("/orders", methods=["POST"])
 @jwt_required()
@@ -93,97 +360,276 @@ def create_order():
     try:
         user_id = get_user_id_int()
 
-        # Validate required fields
-        required_fields = ["symbol", "side", "quantity"]
-        for field in required_fields:
-            if field not in request.json:
-                return jsonify({"error": f"Missing required field: {field}"}), 400
+        try:
+            symbol, side, quantity, price = _parse_order(request.json)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        # Reserve balance for the order
+        request_started = started = metrics.clock()
+        try:
+            reserve_balance_for_order(ledger, user_id, side, symbol, quantity, price)
+        except ValueError as e:
+            metrics.count("rejects", _metric_symbol(symbol))
+            return jsonify({"error": str(e)}), 400
+        metrics.observe("reserve", started)
+
+        # Journal and match on the symbol's sequencer worker, the order is
+        # acknowledged once its journal records are on disk.  Until the
+        # worker has journaled it, any failure gives the reservation back
+        future = None
+        started = metrics.clock()
+        try:
+            order = new_order(user_id, symbol, side, price, quantity)
+            future = sequencer.submit(symbol, submit_order, order)
+            seq = future.result(timeout=RESULT_TIMEOUT)
+        except FutureTimeout:
+            if not future.cancel():
+                # The worker has started on it, the order is sequenced unless
+                # the journal refuses it, which releases the reservation then
+                future.add_done_callback(partial(_release_if_refused, user_id, [order]))
+                logging.warning(f"Order {order.id} still matching after {RESULT_TIMEOUT}s")
+                return jsonify(_pending_order_body(order)), 202
+            logging.error(f"Order of user {user_id} not sequenced within {RESULT_TIMEOUT}s")
+            return _refused_order(user_id, side, symbol, quantity, price)
+        except MatchError as e:
+            # Journaled, only its fills were not: it rests unmatched and
+            # keeps its reservation
+            logging.error(str(e))
+            seq = e.seq
+        except JournalError as e:
+            logging.error(f"Could not journal order: {e}")
+            return _refused_order(user_id, side, symbol, quantity, price)
+        except Exception:
+            # Failed before reaching the worker, a job that raised past the
+            # journal append has sequenced the order and keeps the reservation
+            if future is None:
+                release_balance_for_order(ledger, user_id, side, symbol, quantity, price)
+            raise
+        metrics.observe("sequencer", started)
+
+        started = metrics.clock()
+        try:
+            journal.wait_durable(seq, RESULT_TIMEOUT)
+        except JournalError as e:
+            # The order is sequenced and matched, only the disk flush is late
+            logging.warning(f"Order {order.id} accepted before it was durable: {e}")
+            return jsonify(_pending_order_body(order)), 202
+        metrics.observe("durable", started)
+        metrics.observe("request", request_started)
+        logging.info(f"Order matching completed for order {order.id}")
+
+        return (
+            jsonify(
+                {
+                    "success": True,
+                    "message": "Order created successfully",
+                    "order": _accepted_order(order),
+                }
+            ),
+            201,
+        )
+
+    except ValueError as e:
+        return jsonify({"error": "Invalid numeric value provided"}), 400
+    except DatabaseError as err:
+        logging.error(f"Error creating order: {err}")
+        return jsonify({"error": "Database error"}), 500
+    except Exception as e:
+        logging.error(f"Unexpected error: {e}")
+        return jsonify({"error": "Internal server error"}), 500
+
+
+# Most orders one POST /orders/batch may carry
+MAX_BATCH_ORDERS = 500
+
 
-        # Get and validate data
-        symbol = request.json["symbol"]
-        side = request.json["side"].upper()
-        quantity = float(request.json["quantity"])
-        price = float(request.json.get("price", 0))
-        order_type = request.json.get("order_type", "LIMIT")
-
-        # Validate values
-        if quantity <= 0:
-            return jsonify({"error": "Quantity must be greater than 0"}), 400
-        if order_type != "MARKET" and price <= 0:
+# create many orders in one request
+@bp.route("/orders/batch", methods=["POST"])
+@jwt_required()
+def create_orders_batch():
+    """
+    Validate every order, reserve balances for all of them in one ledger
+    change (one netted delta per asset), then match each symbol's
+    orders in request order on its sequencer worker.  The response holds
+    one result per submitted order, in the same order.
+    """
+    try:
+        user_id = get_user_id_int()
+
+        data = request.json
+        items = data.get("orders") if isinstance(data, dict) else None
+        if not isinstance(items, list) or not items:
+            return jsonify({"error": "orders must be a non-empty list"}), 400
+        if len(items) > MAX_BATCH_ORDERS:
             return (
-                jsonify(
-                    {"error": "Price must be greater than 0 for non-market orders"}
-                ),
+                jsonify({"error": f"At most {MAX_BATCH_ORDERS} orders per batch"}),
                 400,
             )
-        if side not in ["BUY", "SELL"]:
-            return jsonify({"error": "Side must be either 'BUY' or 'SELL'"}), 400
-
-        with get_db_connection() as db:
-            cursor = db.cursor(dictionary=True)
 
-            # Reserve balance for the order
+        results = [None] * len(items)
+        valid = []
+        for index, item in enumerate(items):
             try:
-                reserve_balance_for_order(
-                    cursor, user_id, side, symbol, quantity, price
-                )
+                symbol, side, quantity, price = _parse_order(item)
             except ValueError as e:
-                cursor.close()
-                return jsonify({"error": str(e)}), 400
-
-            # Insert order
-            cursor.execute(
-                """
-                INSERT INTO orders (
-                    user_id, symbol, side, price, quantity, 
-                    status, filled_quantity, created_at, updated_at
-                ) VALUES (%s, %s, %s, %s, %s, 'PENDING', 0.0, NOW(), NOW())
-            """,
-                (user_id, symbol, side, price, quantity),
-            )
+                results[index] = {"index": index, "success": False, "error": str(e)}
+                continue
+            valid.append((index, (side, symbol, quantity, price)))
+
+        errors = reserve_balances_for_orders(ledger, user_id, [fields for _, fields in valid])
+
+        # One sequencer job per symbol: symbols match in parallel, orders of
+        # a symbol in the order they were submitted
+        by_symbol = {}
+        for (index, fields), error in zip(valid, errors):
+            side, symbol, quantity, price = fields
+            if error:
+                results[index] = {"index": index, "success": False, "error": error}
+                metrics.count("rejects", _metric_symbol(symbol))
+                continue
+            order = new_order(user_id, symbol, side, price, quantity)
+            by_symbol.setdefault(order.symbol, []).append((index, order))
+
+        futures = {
+            symbol: sequencer.submit(symbol, submit_orders, [order for _, order in entries])
+            for symbol, entries in by_symbol.items()
+        }
+
+        last_seq = 0
+        refused = []
+        pending = False
+        for symbol, future in futures.items():
+            entries = by_symbol[symbol]
+            try:
+                seqs = future.result(timeout=RESULT_TIMEOUT)
+            except FutureTimeout:
+                if not future.cancel():
+                    # Still matching: sequenced unless refused, see create_order()
+                    orders = [order for _, order in entries]
+                    future.add_done_callback(partial(_release_if_refused, user_id, orders))
+                    logging.warning(f"Order batch for {symbol} still matching after {RESULT_TIMEOUT}s")
+                    pending = True
+                    for index, order in entries:
+                        results[index] = {
+                            "index": index,
+                            "success": True,
+                            "pending": True,
+                            "order": _accepted_order(order),
+                        }
+                    continue
+                logging.error(f"Order batch for {symbol} not sequenced within {RESULT_TIMEOUT}s")
+                seqs = [None] * len(entries)
+            for (index, order), seq in zip(entries, seqs):
+                if seq is None:
+                    refused.append(order)
+                    metrics.count("rejects", _metric_symbol(symbol))
+                    metrics.count("rollbacks", _metric_symbol(symbol))
+                    results[index] = {
+                        "index": index,
+                        "success": False,
+                        "error": "Order could not be accepted",
+                    }
+                    continue
+                last_seq = max(last_seq, seq)
+                results[index] = {
+                    "index": index,
+                    "success": True,
+                    "order": _accepted_order(order),
+                }
 
-            db.commit()
-            order_id = cursor.lastrowid
+        if refused:
+            release_balances_for_orders(ledger, user_id, refused)
 
-            # Attempt to match the new order
+        if last_seq:
             try:
-                match_orders(cursor, order_id, db)
-                db.commit()
-                logging.info(f"Order matching completed for order {order_id}")
-            except Exception as match_error:
-                logging.error(f"Error during order matching: {match_error}")
-                db.rollback()
-                db.commit()
+                journal.wait_durable(last_seq, RESULT_TIMEOUT)
+            except JournalError as e:
+                # Sequenced and matched, only the disk flush is late
+                logging.warning(f"Order batch of user {user_id} accepted before it was durable: {e}")
+                pending = True
+
+        accepted = sum(1 for result in results if result["success"])
+        logging.info(f"Order batch from user {user_id}: {accepted}/{len(items)} accepted")
+        return (
+            jsonify(
+                {
+                    "success": accepted > 0,
+                    "accepted": accepted,
+                    "rejected": len(items) - accepted,
+                    "results": results,
+                }
+            ),
+            (202 if pending else 201) if accepted else 400,
+        )
 
-            cursor.close()
+    except DatabaseError as err:
+        logging.error(f"Error creating order batch: {err}")
+        return jsonify({"error": "Database error"}), 500
+    except Exception as e:
+        logging.error(f"Unexpected error in order batch: {e}")
+        return jsonify({"error": "Internal server error"}), 500
 
-            return (
-                jsonify(
-                    {
-                        "success": True,
-                        "message": "Order created successfully",
-                        "order": {
-                            "id": order_id,
-                            "user_id": user_id,
-                            "symbol": symbol,
-                            "side": side,
-                            "price": price,
-                            "quantity": quantity,
-                            "status": "PENDING",
-                            "filled_quantity": 0.0,
-                        },
-                    }
-                ),
-                201,
-            )
 
-    except ValueError as e:
-        return jsonify({"error": "Invalid numeric value provided"}), 400
-    except mysql.connector.Error as err:
-        logging.error(f"Error creating order: {err}")
+# cancel all of the user's open orders, optionally of one symbol and/or side
+@bp.route("/orders", methods=["DELETE"])
+@jwt_required()
+def delete_orders():
+    """
+    Mass cancel.  Every affected book drops the user's orders in one pass on
+    its sequencer worker and journals them as one event, and the same job
+    releases their reserved balances in one ledger change, netted per asset.
+    """
+    try:
+        user_id = get_user_id_int()
+
+        symbol = request.args.get("symbol")
+        side = request.args.get("side")
+        if side is not None:
+            side = side.upper()
+            if side not in ["BUY", "SELL"]:
+                return jsonify({"error": "Side must be either 'BUY' or 'SELL'"}), 400
+
+        # Only symbols that have a book, a symbol without one has nothing to
+        # cancel and must not get a sequencer worker
+        if symbol:
+            symbols = [symbol] if order_books.find(symbol) is not None else []
+        else:
+            symbols = order_books.symbols()
+        futures = {
+            s: sequencer.submit(s, _cancel_orders, s, user_id, side) for s in symbols
+        }
+
+        cancelled = []
+        last_seq = 0
+        pending = False
+        for s, future in futures.items():
+            try:
+                orders, seq = future.result(timeout=RESULT_TIMEOUT)
+            except FutureTimeout:
+                # The job still releases whatever it cancels
+                logging.warning(f"Mass cancel for {s} still running after {RESULT_TIMEOUT}s")
+                pending = True
+                continue
+            cancelled.extend(orders)
+            last_seq = max(last_seq, seq or 0)
+
+        if last_seq:
+            journal.wait_durable(last_seq, RESULT_TIMEOUT)
+
+        return jsonify(
+            {
+                "success": True,
+                "cancelled": len(cancelled),
+                "order_ids": [order.id for order in cancelled],
+            }
+        ), (202 if pending else 200)
+
+    except DatabaseError as err:
+        logging.error(f"Error cancelling orders: {err}")
         return jsonify({"error": "Database error"}), 500
     except Exception as e:
-        logging.error(f"Unexpected error: {e}")
+        logging.error(f"Unexpected error cancelling orders: {e}")
         return jsonify({"error": "Internal server error"}), 500
 
 
@@ -194,72 +640,23 @@ def delete_order(order_id):
     try:
         user_id = get_user_id_int()
 
-        with get_db_connection() as db:
-            cursor = db.cursor(dictionary=True)
-
-            # Get order details
-            cursor.execute(
-                "SELECT id, user_id, status, symbol, side, quantity, price, filled_quantity FROM orders WHERE id = %s",
-                (order_id,),
-            )
-            order = cursor.fetchone()
-
-            if not order:
-                cursor.close()
-                return jsonify({"error": "Order not found"}), 404
-
-            if order["user_id"] != user_id:
-                cursor.close()
-                return jsonify({"error": "You can only delete your own orders"}), 403
-
-            if order["status"] not in ["PENDING", "PARTIAL"]:
-                cursor.close()
-                return (
-                    jsonify(
-                        {
-                            "error": f"Cannot delete order with status '{order['status']}'. Only PENDING and PARTIAL orders can be cancelled."
-                        }
-                    ),
-                    400,
-                )
-
-            # Calculate remaining unfilled quantity and release reserved balances
-            filled_quantity = float(order.get("filled_quantity", 0))
-            remaining_quantity = float(order["quantity"]) - filled_quantity
-
-            if remaining_quantity > 0:
-                try:
-                    release_balance_for_order(
-                        cursor,
-                        user_id,
-                        order["side"],
-                        order["symbol"],
-                        remaining_quantity,
-                        float(order["price"]),
-                    )
-                except ValueError as e:
-                    cursor.close()
-                    return jsonify({"error": str(e)}), 500
-
-            # Mark order as CANCELLED
-            cursor.execute(
-                "UPDATE orders SET status = 'CANCELLED', updated_at = NOW() WHERE id = %s AND user_id = %s",
-                (order_id, user_id),
-            )
-            db.commit()
-            cursor.close()
-
-            return (
-                jsonify(
-                    {
-                        "success": True,
-                        "message": "Order cancelled and balances released successfully",
-                    }
-                ),
-                200,
-            )
-
-    except mysql.connector.Error as err:
+        symbol = _order_symbol(order_id)
+        if symbol is None:
+            return jsonify({"error": "Order not found"}), 404
+        if not order_books.tradable(symbol):
+            # Delisted with no book left, the order cannot be resting
+            body, status = _closed_order_error(order_id, user_id, "delete", "cancelled")
+            return jsonify(body), status
+
+        # Cancel on the symbol's sequencer so it cannot race a fill
+        body, status, seq = sequencer.run(
+            symbol, _cancel_order, order_id, user_id, symbol
+        )
+        if seq:
+            journal.wait_durable(seq, RESULT_TIMEOUT)
+        return jsonify(body), status
+
+    except DatabaseError as err:
         logging.error(f"Error deleting order: {err}")
         return jsonify({"error": "Database error"}), 500
     except Exception as e:
@@ -267,27 +664,280 @@ def delete_order(order_id):
         return jsonify({"error": "Internal server error"}), 500
 
 
+def _order_symbol(order_id):
+    """Look up which symbol (and so which sequencer worker) owns an order"""
+    symbol = order_books.locate(order_id)
+    if symbol:
+        return symbol
+
+    state = storage.order_state(order_id)
+    return state[1] if state else None
+
+
+def _cancel_orders(symbol, user_id, side):
+    """
+    Cancel every resting order of a user in one book, optionally one side,
+    and release their balances, runs on the sequencer worker.  Returns
+    (cancelled orders, journal seq to wait on or None).
+    """
+    orders, seq = cancel_orders(symbol, user_id, side)
+    if not orders:
+        return orders, seq
+
+    # The orders are out of the book already, so nothing can consume these
+    # reservations in between
+    try:
+        seq = release_balances_for_orders(ledger, user_id, orders) or seq
+    except (ValueError, JournalError):
+        logging.error(
+            f"Could not release balances of cancelled orders "
+            f"{[o.id for o in orders]} of user {user_id}"
+        )
+        raise
+    return orders, seq
+
+
+def _closed_order_error(order_id, user_id, action, done):
+    """Error response for an order that is not resting in any book"""
+    state = storage.order_state(order_id)
+    if not state:
+        return {"error": "Order not found"}, 404
+
+    owner, _, status = state
+    if int(owner) != int(user_id):
+        return {"error": f"You can only {action} your own orders"}, 403
+
+    if status in ["PENDING", "PARTIAL"]:
+        # MySQL has not caught up with the fill or cancel yet
+        return {"error": "Order is no longer open"}, 400
+
+    return {
+        "error": f"Cannot {action} order with status '{status}'. Only PENDING and PARTIAL orders can be {done}."
+    }, 400
+
+
+def _resting_order(symbol, order_id):
+    """An order resting in the book of symbol, without creating the book"""
+    book = order_books.find(symbol)
+    return book.get(order_id) if book is not None else None
+
+
+def _cancel_order(order_id, user_id, symbol):
+    """
+    Cancel a resting order and release its balances, runs on the sequencer
+    worker.  Returns (body, status, journal seq to wait on).
+    """
+    order = _resting_order(symbol, order_id)
+    if order is None:
+        return _closed_order_error(order_id, user_id, "delete", "cancelled") + (None,)
+
+    if order.user_id != user_id:
+        return {"error": "You can only delete your own orders"}, 403, None
+
+    # Calculate remaining unfilled quantity and release reserved balances
+    remaining_quantity = order.quantity - order.filled_quantity
+
+    if remaining_quantity > 0:
+        try:
+            release_balance_for_order(
+                ledger,
+                user_id,
+                order.side,
+                order.symbol,
+                remaining_quantity,
+                order.price,
+            )
+        except ValueError as e:
+            return {"error": str(e)}, 500, None
+
+    seq = cancel_order(order)
+
+    return (
+        {
+            "success": True,
+            "message": "Order cancelled and balances released successfully",
+        },
+        200,
+        seq,
+    )
+
+
 # get a specific order by ID
 @bp.route("/orders/<int:order_id>", methods=["GET"])
 @jwt_required()
 def get_order(order_id):
     try:
-        with get_db_connection() as db:
-            cursor = db.cursor(dictionary=True)
-            sql = "SELECT * FROM orders WHERE id = %s"
-            cursor.execute(sql, (order_id,))
-            order = cursor.fetchone()
-            cursor.close()
+        order = storage.order(order_id)
 
         if order:
-            return jsonify(order)
+            return jsonify(dict(zip(ORDER_COLUMNS, order)))
         else:
             return Response(status=404)
-    except mysql.connector.Error as err:
+    except DatabaseError as err:
         logging.error(f"Error fetching order: {err}")
         return Response(status=500)
 
 
+# get aggregated price levels for a symbol
+@bp.route("/book/<symbol>/depth", methods=["GET"])
+@jwt_required()
+def get_book_depth(symbol):
+    levels = request.args.get("levels", default=20, type=int)
+    if levels <= 0:
+        return jsonify({"error": "levels must be greater than 0"}), 400
+
+    depth = {"bids": [], "asks": []}
+    book = order_books.find(symbol)
+    if book is not None:
+        with book.lock:
+            depth = book.depth(levels)
+
+    def as_levels(side):
+        return [
+            {"price": from_ticks(price), "quantity": from_lots(quantity), "orders": count}
+            for price, quantity, count in side
+        ]
+
+    return jsonify(
+        {
+            "success": True,
+            "symbol": symbol,
+            "bids": as_levels(depth["bids"]),
+            "asks": as_levels(depth["asks"]),
+        }
+    )
+
+
+# stream book deltas, trades and the user's own order updates for a symbol
+@bp.route("/stream/<symbol>", methods=["GET"])
+@jwt_required(locations=["headers", "query_string"])
+def stream_market_data(symbol):
+    """
+    Server-sent events: a snapshot (or the missed deltas when resuming with
+    ?since= / Last-Event-ID), then level, trade and order events.  Level and
+    trade events carry a per-symbol seq, a client that sees a gap reconnects
+    with since set to the last seq it applied.
+    """
+    user_id = get_user_id_int()
+    since = request.args.get("since", type=int)
+    if since is None:
+        since = request.headers.get("Last-Event-ID", type=int)
+    levels = request.args.get("levels", type=int)
+    if levels is not None and levels <= 0:
+        return jsonify({"error": "levels must be greater than 0"}), 400
+
+    book = order_books.find(symbol)
+    if book is None:
+        return jsonify({"error": f"Unknown symbol {symbol}"}), 404
+    subscription, frames = market_data.subscribe(book, user_id, since, levels)
+
+    def generate():
+        try:
+            for frame in frames:
+                yield frame
+            while True:
+                if subscription.overflowed:
+                    logging.warning(f"Market data subscriber for {symbol} fell behind, resyncing")
+                    yield market_data.resync(book, subscription, levels)
+                frame = subscription.get(timeout=STREAM_KEEPALIVE)
+                # A comment line keeps proxies from closing an idle stream
+                yield frame if frame is not None else ": keepalive\n\n"
+        finally:
+            market_data.unsubscribe(subscription)
+
+    return Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# market overview: last price and today's bar per symbol, from memory
+@bp.route("/market", methods=["GET"])
+@jwt_required()
+def get_market():
+    markets = []
+    for symbol in sorted(set(order_books.symbols()) | set(candle_engine.symbols())):
+        market = {
+            "symbol": symbol,
+            "last_price": None,
+            "open": None,
+            "high": None,
+            "low": None,
+            "volume": 0,
+            "trades": 0,
+            "change": None,
+            "change_percent": None,
+            "best_bid": None,
+            "best_ask": None,
+        }
+
+        summary = candle_engine.summary(symbol)
+        if summary is not None:
+            market["last_price"] = summary["last_price"]
+            day = summary["day"]
+            if day is not None:
+                market.update(
+                    {key: day[key] for key in ("open", "high", "low", "volume", "trades")}
+                )
+                market["change"] = summary["last_price"] - day["open"]
+                market["change_percent"] = market["change"] / day["open"] * 100
+
+        book = order_books.find(symbol)
+        if book is not None:
+            with book.lock:
+                best_bid, best_ask = book.best_bid(), book.best_ask()
+            if best_bid is not None:
+                market["best_bid"] = from_ticks(best_bid)
+            if best_ask is not None:
+                market["best_ask"] = from_ticks(best_ask)
+
+        markets.append(market)
+
+    return jsonify({"success": True, "markets": markets})
+
+
+# OHLCV candles for a symbol, ?interval= one of candles.INTERVALS
+@bp.route("/market/<symbol>/candles", methods=["GET"])
+@jwt_required()
+def get_candles(symbol):
+    interval = request.args.get("interval", default="1m")
+    if interval not in INTERVALS:
+        return (
+            jsonify({"error": f"interval must be one of {', '.join(INTERVALS)}"}),
+            400,
+        )
+    limit = request.args.get("limit", default=500, type=int)
+    if limit <= 0:
+        return jsonify({"error": "limit must be greater than 0"}), 400
+
+    return jsonify(
+        {
+            "success": True,
+            "symbol": symbol,
+            "interval": interval,
+            "candles": candle_engine.candles(symbol, interval, limit),
+        }
+    )
+
+
+# rolling 24h statistics for every symbol
+@bp.route("/market/ticker", methods=["GET"])
+@jwt_required()
+def get_tickers():
+    return jsonify({"success": True, "tickers": tickers.tickers()})
+
+
+# rolling 24h statistics for one symbol
+@bp.route("/market/ticker/<symbol>", methods=["GET"])
+@jwt_required()
+def get_ticker(symbol):
+    ticker = tickers.ticker(symbol)
+    if ticker is None:
+        return jsonify({"error": f"No trades for {symbol}"}), 404
+    return jsonify({"success": True, "ticker": ticker})
+
+
 # update an existing order
 @bp.route("/orders/<int:order_id>", methods=["PUT"])
 @jwt_required()
@@ -296,253 +946,68 @@ def update_order(order_id):
         user_id = get_jwt_identity()
 
         # Validate required fields
+        if not isinstance(request.json, dict):
+            return jsonify({"error": "Order must be a JSON object"}), 400
         required_fields = ["symbol", "side", "price", "quantity"]
         for field in required_fields:
             if field not in request.json:
                 return jsonify({"error": f"Missing required field: {field}"}), 400
 
-        # Get new order data
-        new_symbol = request.json["symbol"]
-        new_side = request.json["side"].upper()
-        new_price = float(request.json["price"])
-        new_quantity = float(request.json["quantity"])
-
-        # Validate new values
-        if new_quantity <= 0:
-            return jsonify({"error": "Quantity must be greater than 0"}), 400
-        if new_price <= 0:
-            return jsonify({"error": "Price must be greater than 0"}), 400
-        if new_side not in ["BUY", "SELL"]:
-            return jsonify({"error": "Side must be either 'BUY' or 'SELL'"}), 400
-
-        with get_db_connection() as db:
-            cursor = db.cursor(dictionary=True)
-
-            # First check if the order exists and belongs to the user
-            check_sql = "SELECT id, user_id, status, symbol, side, price, quantity, filled_quantity FROM orders WHERE id = %s"
-            cursor.execute(check_sql, (order_id,))
-            order = cursor.fetchone()
-
-            if not order:
-                cursor.close()
-                return jsonify({"error": "Order not found"}), 404
-
-            # Check if the order belongs to the current user
-            if int(order["user_id"]) != int(user_id):
-                cursor.close()
-                return jsonify({"error": "You can only update your own orders"}), 403
-
-            # Check if order can be updated (only PENDING and PARTIAL orders can be updated)
-            if order["status"] not in ["PENDING", "PARTIAL"]:
-                cursor.close()
-                return (
-                    jsonify(
-                        {
-                            "error": f"Cannot update order with status '{order['status']}'. Only PENDING and PARTIAL orders can be updated."
-                        }
-                    ),
-                    400,
-                )
-
-            # Get filled quantity and calculate remaining
-            filled_quantity = float(order.get("filled_quantity", 0))
-            remaining_quantity = float(order["quantity"]) - filled_quantity
-
-            # For partial orders, new quantity must be at least filled_quantity
-            if order["status"] == "PARTIAL" and new_quantity < filled_quantity:
-                cursor.close()
-                return (
-                    jsonify(
-                        {
-                            "error": f"Cannot reduce quantity below filled amount. Already filled: {filled_quantity}, Minimum new quantity: {filled_quantity}"
-                        }
-                    ),
-                    400,
-                )
-
-            # Release old reservations (only for unfilled portion)
-            old_side = order["side"]
-            old_quantity = float(order["quantity"])
-            old_price = float(order["price"])
-            old_symbol = order["symbol"]
-            old_unfilled_quantity = old_quantity - filled_quantity
-
-            if old_side == "BUY":
-                # Release old USD reservation for unfilled portion
-                old_unfilled_cost = old_unfilled_quantity * old_price
-
-                cursor.execute(
-                    "SELECT available, reserved FROM balances WHERE user_id = %s AND asset = 'USD'",
-                    (int(user_id),),
-                )
-                usd_balance = cursor.fetchone()
-
-                if usd_balance:
-                    new_available = float(usd_balance["available"]) + old_unfilled_cost
-                    new_reserved = max(
-                        0, float(usd_balance["reserved"]) - old_unfilled_cost
-                    )
-
-                    cursor.execute(
-                        """UPDATE balances 
-                           SET available = %s, reserved = %s, updated_at = NOW()
-                           WHERE user_id = %s AND asset = 'USD'""",
-                        (new_available, new_reserved, int(user_id)),
-                    )
-
-            elif old_side == "SELL":
-                # Release old asset reservation for unfilled portion
-                old_base_asset = old_symbol.replace("USD", "").replace("USDT", "")
-
-                cursor.execute(
-                    "SELECT available, reserved FROM balances WHERE user_id = %s AND asset = %s",
-                    (int(user_id), old_base_asset),
-                )
-                asset_balance = cursor.fetchone()
-
-                if asset_balance:
-                    new_available = (
-                        float(asset_balance["available"]) + old_unfilled_quantity
-                    )
-                    new_reserved = max(
-                        0, float(asset_balance["reserved"]) - old_unfilled_quantity
-                    )
-
-                    cursor.execute(
-                        """UPDATE balances 
-                           SET available = %s, reserved = %s, updated_at = NOW()
-                           WHERE user_id = %s AND asset = %s""",
-                        (new_available, new_reserved, int(user_id), old_base_asset),
-                    )
-
-            # Apply new reservations (only for new unfilled portion)
-            new_unfilled_quantity = new_quantity - filled_quantity
-
-            if new_side == "BUY":
-                # Reserve new USD amount for unfilled portion
-                new_unfilled_cost = new_unfilled_quantity * new_price
-
-                cursor.execute(
-                    "SELECT available, reserved FROM balances WHERE user_id = %s AND asset = 'USD'",
-                    (int(user_id),),
-                )
-                usd_balance = cursor.fetchone()
-
-                if not usd_balance:
-                    cursor.close()
-                    return (
-                        jsonify(
-                            {"error": "USD balance not found. Please contact support."}
-                        ),
-                        400,
-                    )
-
-                if float(usd_balance["available"]) < new_unfilled_cost:
-                    cursor.close()
-                    return (
-                        jsonify(
-                            {
-                                "error": f"Insufficient USD balance for updated order. Required for unfilled portion: ${new_unfilled_cost:.2f}, Available: ${float(usd_balance['available']):.2f}"
-                            }
-                        ),
-                        400,
-                    )
-
-                new_available = float(usd_balance["available"]) - new_unfilled_cost
-                new_reserved = float(usd_balance["reserved"]) + new_unfilled_cost
-
-                cursor.execute(
-                    """UPDATE balances 
-                       SET available = %s, reserved = %s, updated_at = NOW()
-                       WHERE user_id = %s AND asset = 'USD'""",
-                    (new_available, new_reserved, int(user_id)),
-                )
-
-            elif new_side == "SELL":
-                # Reserve new asset amount for unfilled portion
-                new_base_asset = new_symbol.replace("USD", "").replace("USDT", "")
-
-                cursor.execute(
-                    "SELECT available, reserved FROM balances WHERE user_id = %s AND asset = %s",
-                    (int(user_id), new_base_asset),
-                )
-                asset_balance = cursor.fetchone()
-
-                if not asset_balance:
-                    cursor.close()
-                    return (
-                        jsonify(
-                            {
-                                "error": f"{new_base_asset} balance not found. Please contact support."
-                            }
-                        ),
-                        400,
-                    )
-
-                if float(asset_balance["available"]) < new_unfilled_quantity:
-                    cursor.close()
-                    return (
-                        jsonify(
-                            {
-                                "error": f"Insufficient {new_base_asset} balance for updated order. Required for unfilled portion: {new_unfilled_quantity}, Available: {float(asset_balance['available'])}"
-                            }
-                        ),
-                        400,
-                    )
-
-                new_available = (
-                    float(asset_balance["available"]) - new_unfilled_quantity
-                )
-                new_reserved = float(asset_balance["reserved"]) + new_unfilled_quantity
-
-                cursor.execute(
-                    """UPDATE balances 
-                       SET available = %s, reserved = %s, updated_at = NOW()
-                       WHERE user_id = %s AND asset = %s""",
-                    (new_available, new_reserved, int(user_id), new_base_asset),
-                )
-
-            # Update the order
-            update_sql = """
-                UPDATE orders 
-                SET symbol = %s, side = %s, price = %s, quantity = %s, updated_at = NOW()
-                WHERE id = %s AND user_id = %s
-            """
-            cursor.execute(
-                update_sql,
-                (new_symbol, new_side, new_price, new_quantity, order_id, int(user_id)),
-            )
-            db.commit()
-
-            if cursor.rowcount > 0:
-                # Try to match the updated order with existing orders
-                try:
-                    match_orders(cursor, order_id, db)
-                    db.commit()
-                    logging.info(f"Order matching completed for updated order {order_id}")
-                except Exception as match_error:
-                    logging.error(f"Error during order matching for updated order: {match_error}")
-                    # Don't fail the update if matching fails, just log it
-                    db.rollback()
-                    db.commit()
-                
-                cursor.close()
-                return (
-                    jsonify(
-                        {
-                            "success": True,
-                            "message": "Order updated successfully with balance adjustments",
-                        }
-                    ),
-                    200,
-                )
-            else:
-                cursor.close()
-                return jsonify({"error": "Failed to update order"}), 500
+        # Same checks and limits as a new order
+        try:
+            new_symbol, new_side, new_quantity, new_price = _parse_order(request.json)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        symbol = _order_symbol(order_id)
+        if symbol is None:
+            return jsonify({"error": "Order not found"}), 404
+        if not order_books.tradable(symbol):
+            # Delisted with no book left, the order cannot be resting
+            body, status = _closed_order_error(order_id, user_id, "update", "updated")
+            return jsonify(body), status
+
+        # Amend on the owning symbol's sequencer so it cannot race a fill
+        body, status, seq, moved = sequencer.run(
+            symbol,
+            _amend_order,
+            order_id,
+            user_id,
+            symbol,
+            new_symbol,
+            new_side,
+            new_price,
+            new_quantity,
+        )
+
+        if moved is not None:
+            # Moved to another symbol, match it on that symbol's worker.  If
+            # that book never takes it, the callback puts it back as it was
+            order, previous = moved
+            future = sequencer.submit(new_symbol, rematch_order, order)
+            future.add_done_callback(partial(_restore_if_refused, int(user_id), order, previous))
+            try:
+                seq = future.result(timeout=RESULT_TIMEOUT)
+                logging.info(f"Order matching completed for updated order {order_id}")
+            except FutureTimeout:
+                future.cancel()
+                logging.warning(f"Order {order_id} still moving after {RESULT_TIMEOUT}s")
+                return jsonify({"success": True, "message": "Order update accepted, still being processed"}), 202
+            except MatchError as e:
+                # Taken by the new book, it rests there unmatched
+                logging.error(str(e))
+                seq = e.seq
+            except JournalError as e:
+                logging.error(f"Could not move order {order_id} to {new_symbol}: {e}")
+                return jsonify({"error": "Order could not be updated"}), 503
+
+        if seq:
+            journal.wait_durable(seq, RESULT_TIMEOUT)
+        return jsonify(body), status
 
     except ValueError as e:
         return jsonify({"error": "Invalid numeric value provided"}), 400
-    except mysql.connector.Error as err:
+    except DatabaseError as err:
         logging.error(f"Error updating order: {err}")
         return jsonify({"error": "Database error"}), 500
     except Exception as e:
@@ -550,6 +1015,96 @@ def update_order(order_id):
         return jsonify({"error": "Internal server error"}), 500
 
 
+def _amend_order(order_id, user_id, symbol, new_symbol, new_side, new_price, new_quantity):
+    """
+    Re-reserve balances and rewrite a resting order, runs on the sequencer
+    worker of the order's current symbol.  Returns (body, status, journal seq,
+    moved), where moved is (order, copy of the order before the amend) when
+    it still has to be matched on the worker of a different symbol.
+    """
+    order = _resting_order(symbol, order_id)
+    if order is None:
+        return _closed_order_error(order_id, user_id, "update", "updated") + (None, None)
+
+    # Check if the order belongs to the current user
+    if int(order.user_id) != int(user_id):
+        return {"error": "You can only update your own orders"}, 403, None, None
+
+    # For partial orders, new quantity must be at least filled_quantity
+    filled_quantity = order.filled_quantity
+    if order.status == "PARTIAL" and new_quantity < filled_quantity:
+        return (
+            {
+                "error": f"Cannot reduce quantity below filled amount. Already filled: {from_lots(filled_quantity)}, Minimum new quantity: {from_lots(filled_quantity)}"
+            },
+            400,
+            None,
+            None,
+        )
+
+    old_unfilled_quantity = order.quantity - filled_quantity
+    new_unfilled_quantity = new_quantity - filled_quantity
+
+    # Swap the old reservation for the new one (only for the unfilled portion)
+    try:
+        move_reservation(
+            ledger,
+            int(user_id),
+            (order.side, order.symbol, old_unfilled_quantity, order.price),
+            (new_side, new_symbol, new_unfilled_quantity, new_price),
+        )
+    except ValueError as e:
+        return {"error": str(e)}, 400, None, None
+
+    # Within the same symbol this also re-matches the updated order
+    previous = order.copy() if new_symbol != order.symbol else None
+    try:
+        seq, moved = amend_order(order, new_symbol, new_side, new_price, new_quantity)
+    except MatchError as e:
+        # The amend is journaled, the order rests unmatched
+        logging.error(str(e))
+        seq, moved = e.seq, False
+
+    body = {
+        "success": True,
+        "message": "Order updated successfully with balance adjustments",
+    }
+    return body, 200, seq, (order, previous) if moved else None
+
+
+def _restore_if_refused(user_id, order, previous, future):
+    """
+    Done callback of the rematch_order() job of an order that moved symbol:
+    when the new book never took it (cancelled, or its amend record was not
+    written), queue _restore_order() on the worker of its old symbol
+    """
+    if future.cancelled() or isinstance(future.exception(), JournalError):
+        sequencer.submit(previous.symbol, _restore_order, user_id, order, previous)
+
+
+def _restore_order(user_id, order, previous):
+    """
+    Put an order that is in no book after a failed move back in its old
+    book as it was, with its old reservation, runs on the worker of its old
+    symbol.  If that reservation is no longer available the order is
+    cancelled instead.  Returns the journal seq.
+    """
+    moved = (order.side, order.symbol, order.quantity - order.filled_quantity, order.price)
+    restored = (previous.side, previous.symbol, previous.quantity - previous.filled_quantity, previous.price)
+    order.symbol = previous.symbol
+    order.side = previous.side
+    order.price = previous.price
+    order.quantity = previous.quantity
+    try:
+        move_reservation(ledger, user_id, moved, restored)
+    except ValueError as e:
+        logging.error(f"Cancelling order {order.id}, its old reservation is gone: {e}")
+        release_balance_for_order(ledger, user_id, *moved)
+        return cancel_order(order)
+    logging.warning(f"Order {order.id} restored to {order.symbol} after a failed move")
+    return rematch_order(order)
+
+
 @bp.route("/login", methods=["POST"])
 def login():
     try:
@@ -559,11 +1114,7 @@ def login():
         if not email or not password:
             return jsonify({"message": "Email and password are required"}), 400
 
-        with get_db_connection() as db:
-            cursor = db.cursor(dictionary=True)
-            cursor.execute("SELECT * FROM users WHERE email = %s", (email,))
-            user = cursor.fetchone()
-            cursor.close()
+        user = storage.user_by_email(email)
 
         # Check password with bcrypt
         if user and bcrypt.checkpw(
@@ -592,7 +1143,7 @@ def login():
         else:
             return jsonify({"message": "Invalid email or password"}), 401
 
-    except mysql.connector.Error as err:
+    except DatabaseError as err:
         logging.error(f"Error logging in: {err}")
         return jsonify({"error": "Database error"}), 500
 
@@ -609,45 +1160,41 @@ def register():
 
         hashed_password = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
 
-        with get_db_connection() as db:
-            cursor = db.cursor()
+        user_id = storage.create_user(username, email, hashed_password)
 
-            # Insert user
-            cursor.execute(
-                "INSERT INTO users (username, email, password) VALUES (%s, %s, %s)",
-                (username, email, hashed_password),
-            )
-            user_id = cursor.lastrowid
-
-            # Create demo balances for new user
-            demo_balances = [
-                ("USD", 10000.00, 0.00),  # $10,000 USD
-                ("BTC", 0.5, 0.00),  # 0.5 BTC
-                ("ETH", 2.0, 0.00),  # 2.0 ETH
-                ("ADA", 1000.0, 0.00),  # 1,000 ADA
-                ("SOL", 50.0, 0.00),  # 50 SOL
-            ]
-
-            for asset, available, reserved in demo_balances:
-                cursor.execute(
-                    """INSERT INTO balances (user_id, asset, available, reserved, updated_at) 
-                       VALUES (%s, %s, %s, %s, NOW())""",
-                    (user_id, asset, available, reserved),
-                )
+        # Create demo balances for new user
+        demo_balances = [
+            ("USD", to_units(10000), 0),  # $10,000 USD
+            ("BTC", to_units("0.5"), 0),  # 0.5 BTC
+            ("ETH", to_units(2), 0),  # 2.0 ETH
+            ("ADA", to_units(1000), 0),  # 1,000 ADA
+            ("SOL", to_units(50), 0),  # 50 SOL
+        ]
 
-            db.commit()
-            cursor.close()
+        # Balances go through the ledger, the write-behind writer creates the rows
+        seq = ledger.transfer(user_id, demo_balances, check=False)
+        journal.wait_durable(seq, RESULT_TIMEOUT)
 
-            return (
-                jsonify({"message": "User registered successfully with demo balances"}),
-                201,
-            )
+        return (
+            jsonify({"message": "User registered successfully with demo balances"}),
+            201,
+        )
 
-    except mysql.connector.Error as err:
+    except DatabaseError as err:
         logging.error(f"Error registering user: {err}")
         return jsonify({"error": "Database error"}), 500
 
 
+BALANCE_ENCODER = row_encoder(
+    (
+        ("available", "units"),
+        ("reserved", "units"),
+        ("total", "units"),
+        ("updated_at", "epoch_iso"),
+    )
+)
+
+
 # Get user balances
 @bp.route("/user/balances", methods=["GET"])
 @jwt_required()
@@ -655,37 +1202,19 @@ def get_user_balances():
     try:
         user_id = get_user_id_int()
 
-        with get_db_connection() as db:
-            cursor = db.cursor(dictionary=True)
-            cursor.execute(
-                """
-                SELECT asset, available, reserved, updated_at
-                FROM balances 
-                WHERE user_id = %s 
-                ORDER BY asset
-            """,
-                (user_id,),
-            )
-            balances = cursor.fetchall()
-            cursor.close()
-
-            # Convert to a more convenient format for frontend
-            balance_dict = {}
-            for balance in balances:
-                balance_dict[balance["asset"]] = {
-                    "available": float(balance["available"]),
-                    "reserved": float(balance["reserved"]),
-                    "total": float(balance["available"]) + float(balance["reserved"]),
-                    "updated_at": (
-                        balance["updated_at"].isoformat()
-                        if balance["updated_at"]
-                        else None
-                    ),
-                }
+        # Served from the ledger, MySQL may still be catching up
+        balances = ledger.balances(user_id)
 
-            return jsonify({"success": True, "balances": balance_dict})
+        # asset -> balance object, the format the frontend expects
+        members = ",".join(
+            encode_basestring_ascii(asset)
+            + ":"
+            + BALANCE_ENCODER.object((available, reserved, available + reserved, updated_at or None))
+            for asset, (available, reserved, updated_at) in sorted(balances.items())
+        )
+        return _json_response('{"success":true,"balances":{' + members + "}}")
 
-    except mysql.connector.Error as err:
+    except DatabaseError as err:
         logging.error(f"Error fetching user balances: {err}")
         return jsonify({"error": "Database error"}), 500
     except Exception as e:
@@ -693,31 +1222,82 @@ def get_user_balances():
         return jsonify({"error": "Internal server error"}), 500
 
 
+# Trade history pages, newest first
+TRANSACTIONS_PAGE_SIZE = 100
+TRANSACTIONS_MAX_PAGE_SIZE = 1000
+TRANSACTION_KINDS = ("int", "int", "int", "int", "int", "str", "decimal", "decimal", "datetime")
+TRANSACTION_ENCODER = row_encoder(zip(TRANSACTION_FIELDS, TRANSACTION_KINDS))
+USER_TRANSACTION_ENCODER = row_encoder(
+    zip(USER_TRANSACTION_FIELDS, TRANSACTION_KINDS + ("str",))
+)
+EXECUTED_AT = TRANSACTION_FIELDS.index("executed_at")
+
+
+def _history_cursor(row):
+    """Opaque position after a transaction row, for the next page"""
+    return f"{row[EXECUTED_AT]:%Y%m%d%H%M%S}-{row[0]}"
+
+
+def _history_filters(args):
+    """
+    ((symbol, from, to, before), page size) for the trade history filters:
+    symbol, from (inclusive) and to (exclusive) as ISO 8601 times, cursor
+    from a previous page and limit.  Raises ValueError on bad input.
+    """
+    start = datetime.fromisoformat(args["from"]) if args.get("from") else None
+    end = datetime.fromisoformat(args["to"]) if args.get("to") else None
+    before = None
+    if args.get("cursor"):
+        executed_at, _, transaction_id = args["cursor"].partition("-")
+        before = (datetime.strptime(executed_at, "%Y%m%d%H%M%S"), int(transaction_id))
+
+    limit = int(args.get("limit", TRANSACTIONS_PAGE_SIZE))
+    if not 0 < limit <= TRANSACTIONS_MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {TRANSACTIONS_MAX_PAGE_SIZE}")
+
+    return (args.get("symbol") or None, start, end, before), limit
+
+
+def _history_page(rows, limit):
+    """Trim the extra row fetched past the page, returns (response envelope, page rows)"""
+    next_cursor = _history_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return {"success": True, "next_cursor": next_cursor}, rows[:limit]
+
+
+def _public_transactions(filters, limit, compact):
+    """(trades generation, JSON body) of a GET /transactions page"""
+    # Read before the query, the rows are at least this current
+    generation = writer.trades_seq
+    # One row past the page tells whether there is a next one
+    transactions = storage.transactions(filters, limit + 1)
+    return generation, _transactions_body(transactions, limit, compact)
+
+
+def _transactions_body(rows, limit, compact):
+    envelope, page = _history_page(rows, limit)
+    return "".join(encode_rows(TRANSACTION_ENCODER, page, envelope, "transactions", compact))
+
+
 # Get transaction history
 @bp.route("/transactions", methods=["GET"])
 @jwt_required()
 def get_transactions():
     try:
-        with get_db_connection() as db:
-            cursor = db.cursor(dictionary=True)
-            cursor.execute(
-                """
-                SELECT t.*, 
-                       bo.user_id as buyer_id,
-                       so.user_id as seller_id
-                FROM transactions t
-                LEFT JOIN orders bo ON t.buy_order_id = bo.id
-                LEFT JOIN orders so ON t.sell_order_id = so.id
-                ORDER BY t.executed_at DESC
-                LIMIT 100
-            """
-            )
-            transactions = cursor.fetchall()
-            cursor.close()
-
-            return jsonify({"success": True, "transactions": transactions})
+        filters, limit = _history_filters(request.args)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid filter: {e}"}), 400
 
-    except mysql.connector.Error as err:
+    try:
+        compact = _compact()
+        key = ("transactions", filters, limit, compact)
+        body = response_cache.get(
+            key,
+            writer.trades_seq,
+            lambda: _public_transactions(filters, limit, compact),
+        )
+        return _json_response(body)
+
+    except DatabaseError as err:
         logging.error(f"Error fetching transactions: {err}")
         return jsonify({"error": "Database error"}), 500
 
@@ -727,35 +1307,18 @@ def get_transactions():
 @jwt_required()
 def get_user_transactions():
     try:
-        user_id = get_user_id_int()
+        filters, limit = _history_filters(request.args)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid filter: {e}"}), 400
 
-        with get_db_connection() as db:
-            cursor = db.cursor(dictionary=True)
-            cursor.execute(
-                """
-                SELECT t.*, 
-                       bo.user_id as buyer_id,
-                       so.user_id as seller_id,
-                       CASE 
-                           WHEN bo.user_id = %s THEN 'BUY'
-                           WHEN so.user_id = %s THEN 'SELL'
-                           ELSE 'UNKNOWN'
-                       END as user_side
-                FROM transactions t
-                LEFT JOIN orders bo ON t.buy_order_id = bo.id
-                LEFT JOIN orders so ON t.sell_order_id = so.id
-                WHERE bo.user_id = %s OR so.user_id = %s
-                ORDER BY t.executed_at DESC
-                LIMIT 100
-            """,
-                (user_id, user_id, user_id, user_id),
-            )
-            transactions = cursor.fetchall()
-            cursor.close()
+    try:
+        user_id = get_user_id_int()
+        transactions = storage.user_transactions(user_id, filters, limit + 1)
 
-            return jsonify({"success": True, "transactions": transactions})
+        envelope, page = _history_page(transactions, limit)
+        return _rows_response(USER_TRANSACTION_ENCODER, page, envelope, "transactions")
 
-    except mysql.connector.Error as err:
+    except DatabaseError as err:
         logging.error(f"Error fetching user transactions: {err}")
         return jsonify({"error": "Database error"}), 500
 
@@ -771,53 +1334,100 @@ def update_user_balance(asset):
         if "available" not in request.json:
             return jsonify({"error": "Missing required field: available"}), 400
 
-        available = float(request.json["available"])
-        reserved = float(request.json.get("reserved", 0))
+        available = to_units(request.json["available"])
+        reserved = to_units(request.json.get("reserved", 0))
 
         if available < 0 or reserved < 0:
             return jsonify({"error": "Balance amounts cannot be negative"}), 400
 
-        with get_db_connection() as db:
-            cursor = db.cursor()
-
-            # Check if balance record exists
-            cursor.execute(
-                "SELECT id FROM balances WHERE user_id = %s AND asset = %s",
-                (int(user_id), asset.upper()),
-            )
-            existing = cursor.fetchone()
-
-            if existing:
-                # Update existing balance
-                cursor.execute(
-                    """UPDATE balances 
-                       SET available = %s, reserved = %s, updated_at = NOW()
-                       WHERE user_id = %s AND asset = %s""",
-                    (available, reserved, int(user_id), asset.upper()),
-                )
-            else:
-                # Create new balance record
-                cursor.execute(
-                    """INSERT INTO balances (user_id, asset, available, reserved, updated_at)
-                       VALUES (%s, %s, %s, %s, NOW())""",
-                    (int(user_id), asset.upper(), available, reserved),
-                )
-
-            db.commit()
-            cursor.close()
+        # Creates the balance if the user has none for this asset yet
+        seq = ledger.set(int(user_id), asset.upper(), available, reserved)
+        journal.wait_durable(seq, RESULT_TIMEOUT)
 
-            return (
-                jsonify(
-                    {"success": True, "message": f"Balance updated for {asset.upper()}"}
-                ),
-                200,
-            )
+        return (
+            jsonify(
+                {"success": True, "message": f"Balance updated for {asset.upper()}"}
+            ),
+            200,
+        )
 
     except ValueError as e:
         return jsonify({"error": "Invalid numeric value provided"}), 400
-    except mysql.connector.Error as err:
+    except DatabaseError as err:
         logging.error(f"Error updating balance: {err}")
         return jsonify({"error": "Database error"}), 500
     except Exception as e:
         logging.error(f"Unexpected error updating balance: {e}")
-        return jsonify({"error": "Internal server error"}), 500
\ No newline at end of file
+        return jsonify({"error": "Internal server error"}), 500
+
+# PoolStats fields that only ever grow, exported as counters
+POOL_COUNTERS = {
+    "checkouts",
+    "wait_time",
+    "hold_time",
+    "exhausted",
+    "timeouts",
+    "opened",
+    "closed",
+    "statements_prepared",
+    "statements_reused",
+}
+
+
+def _metric_gauges():
+    """metrics.render() families of the pools, the response cache, the sequencer and the journal"""
+    snapshots = pool_snapshots()
+    fields = next(iter(snapshots.values()), {})
+    families = [
+        (
+            f"orderbook_db_pool_{field}" + ("_total" if field in POOL_COUNTERS else ""),
+            f"Connection pool {field.replace('_', ' ')}",
+            "counter" if field in POOL_COUNTERS else "gauge",
+            [({"pool": name}, snapshot[field]) for name, snapshot in snapshots.items()],
+        )
+        for field in fields
+    ]
+    families.extend(
+        [
+            (
+                "orderbook_response_cache_hits_total",
+                "Public read payloads served from the response cache",
+                "counter",
+                [({}, response_cache.hits)],
+            ),
+            (
+                "orderbook_response_cache_misses_total",
+                "Public read payloads rebuilt",
+                "counter",
+                [({}, response_cache.misses)],
+            ),
+            (
+                "orderbook_sequencer_queue_depth",
+                "Jobs waiting for a symbol's sequencer worker",
+                "gauge",
+                [
+                    ({"symbol": symbol}, depth)
+                    for symbol, depth in sorted(sequencer.queue_depths().items())
+                ],
+            ),
+            (
+                "orderbook_journal_seq",
+                "Journal seq last appended, flushed to disk and applied to the storage",
+                "gauge",
+                [
+                    ({"stage": "appended"}, journal.last_seq),
+                    ({"stage": "durable"}, journal.durable_seq),
+                    ({"stage": "persisted"}, writer.persisted_seq),
+                ],
+            ),
+        ]
+    )
+    return families
+
+
+# Prometheus scrape target, only served with METRICS_ENABLED=1
+@bp.route("/metrics", methods=["GET"])
+def get_metrics():
+    if not metrics.enabled:
+        return Response(status=404)
+    return Response(metrics.render(_metric_gauges()), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,85 @@
+# Single-writer matching sequencer
+# every symbol gets one worker thread fed by a queue, so all book mutations
+# for an instrument are serialized while different symbols run in parallel
+
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import Future
+
+from orderbook import order_books
+
+# How long a request thread waits for its job before giving up
+RESULT_TIMEOUT = float(os.getenv("MATCH_TIMEOUT", 10))
+
+
+class SymbolWorker(threading.Thread):
+    """Drains the job queue of a single symbol, one job at a time"""
+
+    def __init__(self, symbol):
+        super().__init__(name=f"sequencer-{symbol}", daemon=True)
+        self.symbol = symbol
+        self.jobs = queue.Queue()
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+
+            future, fn, args, kwargs = job
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                logging.error(f"Sequencer job failed for {self.symbol}: {e}")
+                future.set_exception(e)
+
+
+class MatchingSequencer:
+    """Routes jobs to the worker that owns the job's symbol"""
+
+    def __init__(self):
+        self._workers = {}
+        self._lock = threading.Lock()
+
+    def _worker(self, symbol):
+        worker = self._workers.get(symbol)
+        if worker is None:
+            # Workers never exit, so only instruments with a book get one
+            if not order_books.tradable(symbol):
+                raise ValueError(f"Unknown symbol: {symbol}")
+            with self._lock:
+                worker = self._workers.get(symbol)
+                if worker is None:
+                    worker = self._workers[symbol] = SymbolWorker(symbol)
+                    worker.start()
+        return worker
+
+    def submit(self, symbol, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs) on the symbol's worker, returns a Future"""
+        future = Future()
+        self._worker(symbol).jobs.put((future, fn, args, kwargs))
+        return future
+
+    def run(self, symbol, fn, *args, **kwargs):
+        """Submit a job and block the calling thread until it has run"""
+        return self.submit(symbol, fn, *args, **kwargs).result(timeout=RESULT_TIMEOUT)
+
+    def queue_depths(self):
+        return {symbol: w.jobs.qsize() for symbol, w in self._workers.items()}
+
+    def shutdown(self):
+        with self._lock:
+            workers = list(self._workers.values())
+            self._workers = {}
+        for worker in workers:
+            worker.jobs.put(None)
+        for worker in workers:
+            worker.join()
+
+
+sequencer = MatchingSequencer()
@@ -0,0 +1,183 @@
+# Batched, netted trade settlement
+# a match collects its balance deltas per (user_id, asset) and writes them
+# together with the transaction rows and order fills in a handful of multi-row
+# statements, each a server-side prepared statement when flushed with one
+
+import logging
+
+from fixedpoint import lots_decimal, ticks_decimal, units_decimal
+
+# Rows per multi-row statement: a flush sends its rows in statements of
+# these sizes only, so every statement takes a handful of shapes to prepare
+# and mysql-connector's prepared executemany(), one reset and one execute
+# round trip per row, is never used
+STATEMENT_SIZES = (1, 4, 16, 64)
+
+
+def _sized_chunks(rows, pad=None):
+    """
+    rows in chunks of STATEMENT_SIZES lengths, largest first.  With pad,
+    the rest is padded with pad(last row) rows up to the next size in one
+    statement, otherwise it is split into smaller ones.
+    """
+    largest = STATEMENT_SIZES[-1]
+    index = 0
+    while len(rows) - index >= largest:
+        yield rows[index : index + largest]
+        index += largest
+    rest = rows[index:]
+    if not rest:
+        return
+    if pad is not None:
+        size = next(size for size in STATEMENT_SIZES if size >= len(rest))
+        yield rest + [pad(rest[-1])] * (size - len(rest))
+        return
+    for size in reversed(STATEMENT_SIZES):
+        while len(rest) >= size:
+            yield rest[:size]
+            rest = rest[size:]
+
+
+def _balance_upsert(rows):
+    placeholders = ", ".join(["(%s, %s, %s, %s, NOW())"] * rows)
+    return f"""
+        INSERT INTO balances (user_id, asset, available, reserved, updated_at)
+        VALUES {placeholders}
+        ON DUPLICATE KEY UPDATE
+            available = available + VALUES(available),
+            reserved = GREATEST(reserved + VALUES(reserved), 0),
+            updated_at = NOW()
+    """
+
+
+def _insert_transactions(rows):
+    values = "(%s, %s, %s, %s, %s, FROM_UNIXTIME(%s), %s, %s)"
+    return f"""
+        INSERT INTO transactions (
+            buy_order_id, sell_order_id, symbol, quantity, price, executed_at,
+            buyer_id, seller_id
+        ) VALUES {", ".join([values] * rows)}
+    """
+
+
+def _update_fills(rows):
+    # The fill status is computed from the joined value: assignments of a
+    # multi-table UPDATE are not applied in a guaranteed order
+    fills = " UNION ALL ".join(
+        ["SELECT %s AS id, CAST(%s AS DECIMAL(10,4)) AS filled_quantity"] * rows
+    )
+    return f"""
+        UPDATE orders o
+        JOIN ({fills}) f ON f.id = o.id
+        SET o.filled_quantity = f.filled_quantity,
+            o.status = CASE WHEN f.filled_quantity >= o.quantity THEN 'FILLED' ELSE 'PARTIAL' END,
+            o.updated_at = NOW()
+    """
+
+
+BALANCE_UPSERTS = {size: _balance_upsert(size) for size in STATEMENT_SIZES}
+INSERT_TRANSACTIONS = {size: _insert_transactions(size) for size in STATEMENT_SIZES}
+UPDATE_FILLS = {size: _update_fills(size) for size in STATEMENT_SIZES}
+
+
+class SettlementBatch:
+    """Collects the writes produced by one match and flushes them in bulk"""
+
+    def __init__(self):
+        # (user_id, asset) -> [available_delta, reserved_delta], in amount units
+        self.deltas = {}
+        self.transactions = []
+        # order_id -> filled_quantity in lots, the last fill of an order wins
+        self.fills = {}
+
+    def __bool__(self):
+        return bool(self.deltas or self.transactions or self.fills)
+
+    def adjust(self, user_id, asset, available_change=0, reserved_change=0):
+        delta = self.deltas.setdefault((user_id, asset), [0, 0])
+        delta[0] += available_change
+        delta[1] += reserved_change
+
+    def add_transaction(
+        self,
+        buy_order_id,
+        sell_order_id,
+        symbol,
+        quantity,
+        price,
+        executed_at,
+        buyer_id,
+        seller_id,
+    ):
+        self.transactions.append(
+            (
+                buy_order_id,
+                sell_order_id,
+                symbol,
+                quantity,
+                price,
+                executed_at,
+                buyer_id,
+                seller_id,
+            )
+        )
+
+    def fill(self, order_id, filled_quantity):
+        self.fills[order_id] = filled_quantity
+
+    def to_event(self):
+        """Plain JSON-friendly form of the batch, for the journal"""
+        return {
+            "transactions": [list(t) for t in self.transactions],
+            "fills": [[order_id, filled] for order_id, filled in self.fills.items()],
+            "deltas": [
+                [user_id, asset, available, reserved]
+                for (user_id, asset), (available, reserved) in self.deltas.items()
+            ],
+        }
+
+    def merge(self, event):
+        """Fold a journaled batch (see to_event) into this one"""
+        self.transactions.extend(tuple(t) for t in event["transactions"])
+        for order_id, filled in event["fills"]:
+            self.fill(order_id, filled)
+        for user_id, asset, available, reserved in event["deltas"]:
+            self.adjust(user_id, asset, available, reserved)
+
+    def flush(self, cursor):
+        """
+        Write everything collected so far and reset the batch.  cursor is a
+        plain cursor or db_pool.PreparedStatements.
+        """
+        transactions = [
+            t[:3] + (lots_decimal(t[3]), ticks_decimal(t[4])) + t[5:]
+            for t in self.transactions
+        ]
+        # Transactions cannot be padded, every row is a new trade
+        for chunk in _sized_chunks(transactions):
+            cursor.execute(
+                INSERT_TRANSACTIONS[len(chunk)], [value for row in chunk for value in row]
+            )
+
+        fills = [(order_id, lots_decimal(filled)) for order_id, filled in self.fills.items()]
+        # Padding repeats the last fill, which sets the same value again
+        for chunk in _sized_chunks(fills, pad=lambda row: row):
+            cursor.execute(UPDATE_FILLS[len(chunk)], [value for row in chunk for value in row])
+
+        rows = [
+            (user_id, asset, units_decimal(available), units_decimal(reserved))
+            for (user_id, asset), (available, reserved) in self.deltas.items()
+            if available or reserved
+        ]
+        # Multi-row upserts against ux_balances_user_asset, padding repeats
+        # the last key with a zero delta, which changes nothing
+        for chunk in _sized_chunks(rows, pad=lambda row: (row[0], row[1], 0, 0)):
+            cursor.execute(BALANCE_UPSERTS[len(chunk)], [value for row in chunk for value in row])
+
+        logging.info(
+            f"Settlement flushed: {len(self.transactions)} trades, {len(self.fills)} order fills, {len(rows)} balance deltas"
+        )
+
+        self.deltas = {}
+        self.transactions = []
+        self.fills = {}
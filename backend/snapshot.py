@@ -0,0 +1,264 @@
+# Compact binary snapshots of the matching state
+# a snapshot plus the journal tail after it rebuilds every book and balance
+# on restart without re-querying the open orders and balances from MySQL
+
+import glob
+import logging
+import os
+import struct
+import zlib
+from datetime import datetime
+
+from orderbook import Order
+
+# Snapshots with any other magic are skipped (cold start)
+MAGIC = b"OBSNAP03"
+
+# magic, journal seq and offset taken before any book was copied,
+# next order id, taken at, number of books
+HEADER = struct.Struct("<8sQQQdI")
+# symbol length, journal seq the book was copied at, number of orders
+BOOK = struct.Struct("<HQI")
+# id, user_id, side, status, price ticks, quantity lots, filled lots,
+# created_at, updated_at
+ORDER = struct.Struct("<QIBBqqqdd")
+# journal seq the ledger was copied at, number of balances
+LEDGER = struct.Struct("<QI")
+# user_id, asset length, available and reserved amount units, updated_at (0 for never)
+BALANCE = struct.Struct("<IHqqd")
+TRAILER = struct.Struct("<I")
+
+SIDES = ("BUY", "SELL")
+STATUSES = ("PENDING", "PARTIAL")
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class Snapshot:
+    """Matching state as of a journal position, see take() and read_latest()"""
+
+    def __init__(self, seq, offset, next_order_id, taken_at, books, balances=None):
+        self.seq = seq
+        self.offset = offset
+        self.next_order_id = next_order_id
+        self.taken_at = taken_at
+        # symbol -> (journal seq the book was copied at, [order dicts])
+        self.books = books
+        # (journal seq the ledger was copied at,
+        #  {(user_id, asset): (available, reserved, updated_at)})
+        self.balances = balances or (0, {})
+
+    def order_count(self):
+        return sum(len(orders) for _, orders in self.books.values())
+
+
+def take(registry, journal, next_order_id, ledger=None):
+    """
+    Copy the current books, and the balances when a ledger is given.  Each
+    book is copied under its own lock together with the journal position,
+    so replay knows exactly which events each book has already seen;
+    matching on other symbols keeps running.  The ledger does the same for
+    the balances, see BalanceLedger.take().
+    """
+    seq, offset = journal.position()
+    taken_at = datetime.now().timestamp()
+
+    books = {}
+    for symbol in registry.symbols():
+        book = registry.get(symbol)
+        with book.lock:
+            book_seq, _ = journal.position()
+            orders = [order.copy() for order in book.orders()]
+        books[symbol] = (book_seq, orders)
+
+    balances = ledger.take() if ledger is not None else None
+    return Snapshot(seq, offset, next_order_id, taken_at, books, balances)
+
+
+def encode(snapshot):
+    buf = bytearray(
+        HEADER.pack(
+            MAGIC,
+            snapshot.seq,
+            snapshot.offset,
+            snapshot.next_order_id,
+            snapshot.taken_at,
+            len(snapshot.books),
+        )
+    )
+    for symbol, (book_seq, orders) in snapshot.books.items():
+        name = symbol.encode("utf-8")
+        buf += BOOK.pack(len(name), book_seq, len(orders))
+        buf += name
+        for order in orders:
+            buf += ORDER.pack(
+                order.id,
+                order.user_id,
+                SIDES.index(order.side),
+                STATUSES.index(order.status),
+                order.price,
+                order.quantity,
+                order.filled_quantity,
+                order.created_at,
+                order.updated_at,
+            )
+    ledger_seq, balances = snapshot.balances
+    buf += LEDGER.pack(ledger_seq, len(balances))
+    for (user_id, asset), (available, reserved, updated_at) in balances.items():
+        name = asset.encode("utf-8")
+        buf += BALANCE.pack(user_id, len(name), available, reserved, updated_at or 0)
+        buf += name
+    buf += TRAILER.pack(zlib.crc32(buf))
+    return bytes(buf)
+
+
+def decode(data):
+    if len(data) < HEADER.size + TRAILER.size or data[:8] != MAGIC:
+        raise SnapshotError("Not an order book snapshot")
+    (crc,) = TRAILER.unpack_from(data, len(data) - TRAILER.size)
+    if zlib.crc32(data[: -TRAILER.size]) != crc:
+        raise SnapshotError("Snapshot checksum mismatch")
+
+    _, seq, offset, next_order_id, taken_at, book_count = HEADER.unpack_from(data, 0)
+    pos = HEADER.size
+
+    books = {}
+    for _ in range(book_count):
+        name_length, book_seq, order_count = BOOK.unpack_from(data, pos)
+        pos += BOOK.size
+        symbol = data[pos : pos + name_length].decode("utf-8")
+        pos += name_length
+
+        orders = []
+        for fields in ORDER.iter_unpack(data[pos : pos + order_count * ORDER.size]):
+            order_id, user_id, side, status, price, quantity, filled, created, updated = fields
+            orders.append(
+                Order(
+                    order_id,
+                    user_id,
+                    symbol,
+                    SIDES[side],
+                    price,
+                    quantity,
+                    filled,
+                    STATUSES[status],
+                    created,
+                    updated,
+                )
+            )
+        pos += order_count * ORDER.size
+        books[symbol] = (book_seq, orders)
+
+    ledger_seq, balance_count = LEDGER.unpack_from(data, pos)
+    pos += LEDGER.size
+    balances = {}
+    for _ in range(balance_count):
+        user_id, name_length, available, reserved, updated_at = BALANCE.unpack_from(data, pos)
+        pos += BALANCE.size
+        asset = data[pos : pos + name_length].decode("utf-8")
+        pos += name_length
+        balances[(user_id, asset)] = (available, reserved, updated_at or None)
+
+    return Snapshot(seq, offset, next_order_id, taken_at, books, (ledger_seq, balances))
+
+
+def write(directory, snapshot, keep=2):
+    """Atomically write a snapshot file and prune older ones"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"snapshot-{snapshot.seq:016d}.bin")
+    tmp_path = path + ".tmp"
+
+    with open(tmp_path, "wb") as f:
+        f.write(encode(snapshot))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+    for old in sorted(glob.glob(os.path.join(directory, "snapshot-*.bin")))[:-keep]:
+        os.remove(old)
+
+    logging.info(
+        f"Wrote snapshot at seq {snapshot.seq}: {len(snapshot.books)} books, "
+        f"{snapshot.order_count()} orders, {len(snapshot.balances[1])} balances"
+    )
+    return path
+
+
+def read_latest(directory):
+    """Load the newest readable snapshot, or None if there is none"""
+    for path in sorted(glob.glob(os.path.join(directory, "snapshot-*.bin")), reverse=True):
+        try:
+            with open(path, "rb") as f:
+                return decode(f.read())
+        except (OSError, SnapshotError, struct.error) as e:
+            logging.warning(f"Skipping unreadable snapshot {path}: {e}")
+    return None
+
+
+def _apply(book, event, order):
+    """Apply one journal event to the book it was recorded against"""
+    kind = event["type"]
+    if kind == "order":
+        book.add(order)
+    elif kind == "amend":
+        book.remove(event["id"])
+        book.add(order)
+    elif kind in ("cancel", "move"):
+        book.remove(event["id"])
+    elif kind == "mass_cancel":
+        for order_id in event["ids"]:
+            book.remove(order_id)
+    elif kind == "match":
+        for order_id, filled in event["fills"]:
+            resting = book.set_filled(order_id, filled)
+            if resting is not None:
+                resting.updated_at = event["executed_at"]
+
+
+def _event_order(event):
+    return Order(
+        event["id"],
+        event["user_id"],
+        event["symbol"],
+        event["side"],
+        event["price"],
+        event["quantity"],
+        event["filled_quantity"],
+        event["status"],
+        event["created_at"],
+        event["updated_at"],
+    )
+
+
+def restore(registry, snapshot, records, ledger=None):
+    """
+    Rebuild the registry, and the ledger when one is given, from a snapshot
+    and the journal records after it.  records are (seq, event, next_offset)
+    tuples as returned by Journal.read.  Returns the next free order id.
+    """
+    registry.clear()
+    cuts = {}
+    for symbol, (book_seq, orders) in snapshot.books.items():
+        book = registry.get(symbol)
+        for order in orders:
+            book.add(order)
+        cuts[symbol] = book_seq
+
+    next_order_id = snapshot.next_order_id
+    for seq, event, _ in records:
+        if event["type"] == "balance":
+            continue
+        symbol = event["symbol"]
+        if seq <= cuts.get(symbol, snapshot.seq):
+            continue
+        order = _event_order(event) if event["type"] in ("order", "amend") else None
+        if order:
+            next_order_id = max(next_order_id, order.id + 1)
+        _apply(registry.get(symbol), event, order)
+
+    if ledger is not None:
+        ledger.restore(*snapshot.balances, records)
+    return next_order_id
+
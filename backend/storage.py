@@ -0,0 +1,627 @@
+# Storage backends
+# everything the engine and the endpoints read from or write to the database
+# goes through `storage`: MySQLStorage over db_pool, or MemoryStorage, an
+# in-process store handing back the same rows (Decimal amounts, naive local
+# datetimes) for running the engine, the endpoints and the benchmarks without
+# a MySQL server.  STORAGE_BACKEND picks one (mysql | memory).
+
+import heapq
+import logging
+import os
+import re
+import threading
+from datetime import datetime
+from decimal import Decimal
+
+import mysql.connector
+
+from db_pool import REPLICA_MAX_LAG, get_db_connection, prepared_statements
+from fixedpoint import lots_decimal, ticks_decimal, units_decimal
+from metrics import metrics
+from orderbook import ORDER_COLUMNS
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "mysql")
+# SQL dump whose users and balances MemoryStorage starts with, empty for none
+STORAGE_SEED = os.getenv(
+    "STORAGE_SEED",
+    os.path.join(os.path.dirname(__file__), os.pardir, "database", "dummy_data.sql"),
+)
+
+CHECKPOINT_NAME = "journal"
+
+# Order fields returned by the order listings, in SELECT order
+ORDER_FIELDS = (
+    "id",
+    "symbol",
+    "side",
+    "price",
+    "quantity",
+    "status",
+    "filled_quantity",
+    "created_at",
+    "updated_at",
+)
+# Transaction fields returned by the history listings, in SELECT order
+TRANSACTION_FIELDS = (
+    "id",
+    "buy_order_id",
+    "sell_order_id",
+    "buyer_id",
+    "seller_id",
+    "symbol",
+    "price",
+    "quantity",
+    "executed_at",
+)
+TRANSACTION_COLUMNS = ", ".join(f"t.{field}" for field in TRANSACTION_FIELDS)
+USER_TRANSACTION_FIELDS = TRANSACTION_FIELDS + ("user_side",)
+
+
+class StorageError(Exception):
+    """Raised by MemoryStorage where MySQL would raise a mysql.connector.Error"""
+
+
+# What a storage call may raise, for except clauses
+DatabaseError = (mysql.connector.Error, StorageError)
+
+
+# The MySQL queries, the asyncio serving mode runs them too (see async_routes)
+
+ORDER_QUERY = f"SELECT {', '.join(ORDER_COLUMNS)} FROM orders WHERE id = %s"
+
+
+def user_orders_query(user_id):
+    return (
+        f"""
+        SELECT {", ".join(ORDER_FIELDS)}
+        FROM orders
+        WHERE user_id = %s
+        ORDER BY created_at DESC
+    """,
+        (user_id,),
+    )
+
+
+def _history_conditions(filters):
+    """WHERE conditions and parameters of (symbol, from, to, before) history filters"""
+    symbol, start, end, before = filters
+    conditions = []
+    params = []
+    if symbol:
+        conditions.append("t.symbol = %s")
+        params.append(symbol)
+    if start is not None:
+        conditions.append("t.executed_at >= %s")
+        params.append(start)
+    if end is not None:
+        conditions.append("t.executed_at < %s")
+        params.append(end)
+    if before is not None:
+        # Keyset condition, served straight from the (..., executed_at, id) indexes
+        conditions.append("(t.executed_at, t.id) < (%s, %s)")
+        params.extend(before)
+    return conditions, params
+
+
+def transactions_query(filters, limit):
+    conditions, params = _history_conditions(filters)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return (
+        f"""
+        SELECT {TRANSACTION_COLUMNS}
+        FROM transactions t
+        {where}
+        ORDER BY t.executed_at DESC, t.id DESC
+        LIMIT %s
+    """,
+        (*params, limit),
+    )
+
+
+def user_transactions_query(user_id, filters, limit):
+    # One index range per side instead of an OR across buyer and seller,
+    # a user never trades with themselves so the halves cannot overlap
+    conditions, params = _history_conditions(filters)
+    filters = "".join(f" AND {condition}" for condition in conditions)
+    return (
+        f"""
+        SELECT * FROM (
+            (SELECT {TRANSACTION_COLUMNS}, 'BUY' AS user_side
+             FROM transactions t
+             WHERE t.buyer_id = %s{filters}
+             ORDER BY t.executed_at DESC, t.id DESC
+             LIMIT %s)
+            UNION ALL
+            (SELECT {TRANSACTION_COLUMNS}, 'SELL' AS user_side
+             FROM transactions t
+             WHERE t.seller_id = %s{filters}
+             ORDER BY t.executed_at DESC, t.id DESC
+             LIMIT %s)
+        ) history
+        ORDER BY executed_at DESC, id DESC
+        LIMIT %s
+    """,
+        (user_id, *params, limit, user_id, *params, limit, limit),
+    )
+
+
+class MySQLStorage:
+    """The MySQL database, through the db_pool connection pools"""
+
+    def _fetch(self, query, params=(), max_lag=REPLICA_MAX_LAG, dictionary=False):
+        with get_db_connection(readonly=True, max_lag=max_lag) as db:
+            cursor = db.cursor(dictionary=dictionary)
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+            cursor.close()
+        return rows
+
+    # Orders, rows in ORDER_COLUMNS order unless said otherwise
+
+    def order(self, order_id):
+        rows = self._fetch(ORDER_QUERY, (order_id,))
+        return rows[0] if rows else None
+
+    def order_state(self, order_id):
+        """(user_id, symbol, status) of an order, None if there is no such order"""
+        rows = self._fetch(
+            "SELECT user_id, symbol, status FROM orders WHERE id = %s", (order_id,), max_lag=0
+        )
+        return rows[0] if rows else None
+
+    def user_orders(self, user_id):
+        """Every order of a user, newest first, rows in ORDER_FIELDS order"""
+        return self._fetch(*user_orders_query(user_id), max_lag=0)
+
+    def open_orders(self):
+        """PENDING and PARTIAL orders, oldest first"""
+        return self._fetch(
+            f"""
+            SELECT {", ".join(ORDER_COLUMNS)} FROM orders
+            WHERE status IN ('PENDING', 'PARTIAL')
+            ORDER BY created_at ASC, id ASC
+        """,
+            max_lag=0,
+        )
+
+    def max_order_id(self):
+        return self._fetch("SELECT COALESCE(MAX(id), 0) FROM orders", max_lag=0)[0][0]
+
+    # Trades, rows in TRANSACTION_FIELDS order
+
+    def transactions(self, filters, limit):
+        """
+        Up to limit trades, newest first.  filters are (symbol, from, to,
+        before): from inclusive and to exclusive datetimes, before an
+        (executed_at, id) keyset position; any of them None.
+        """
+        # From the primary: a page cached from a lagging replica would stay
+        # stale until the next trade
+        return self._fetch(*transactions_query(filters, limit), max_lag=0)
+
+    def user_transactions(self, user_id, filters, limit):
+        """transactions() of one user, rows end with the user's side"""
+        return self._fetch(*user_transactions_query(user_id, filters, limit))
+
+    def trade_seconds(self, since=0):
+        """
+        One set-based pass over transactions: a (symbol, second, open, high,
+        low, close, volume, notional, trades) row per symbol and second with
+        trades since the given epoch second, oldest first
+        """
+        return self._fetch(
+            """
+            SELECT symbol, UNIX_TIMESTAMP(executed_at) AS second,
+                   MIN(first_price), MAX(price), MIN(price), MIN(last_price),
+                   SUM(quantity), SUM(price * quantity), COUNT(*)
+            FROM (
+                SELECT symbol, executed_at, price, quantity,
+                       FIRST_VALUE(price) OVER w AS first_price,
+                       LAST_VALUE(price) OVER (
+                           w ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
+                       ) AS last_price
+                FROM transactions
+                WHERE executed_at >= FROM_UNIXTIME(%s)
+                WINDOW w AS (PARTITION BY symbol, executed_at ORDER BY id)
+            ) trades
+            GROUP BY symbol, executed_at
+            ORDER BY executed_at ASC, symbol ASC
+        """,
+            (since,),
+            max_lag=0,
+        )
+
+    # Candles
+
+    def candles(self, resolution, start, before):
+        """
+        (symbol, started_at epoch, open, high, low, close, volume, notional,
+        trades) rows of one resolution started in [start, before), oldest first
+        """
+        return self._fetch(
+            """
+            SELECT symbol, UNIX_TIMESTAMP(started_at), open, high, low, close,
+                   volume, notional, trades
+            FROM candles
+            WHERE resolution = %s
+              AND started_at >= FROM_UNIXTIME(%s) AND started_at < FROM_UNIXTIME(%s)
+            ORDER BY started_at ASC
+        """,
+            (resolution, start, before),
+            max_lag=0,
+        )
+
+    def save_candles(self, rows):
+        """Upsert (symbol, resolution, started_at epoch, open, ..., trades) rows"""
+        if not rows:
+            return
+        with get_db_connection() as db:
+            cursor = db.cursor()
+            cursor.executemany(
+                """
+                INSERT INTO candles (
+                    symbol, resolution, started_at, open, high, low, close, volume, notional, trades
+                ) VALUES (%s, %s, FROM_UNIXTIME(%s), %s, %s, %s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    open = VALUES(open), high = VALUES(high), low = VALUES(low),
+                    close = VALUES(close), volume = VALUES(volume), notional = VALUES(notional),
+                    trades = VALUES(trades)
+            """,
+                rows,
+            )
+            db.commit()
+            cursor.close()
+
+    # Balances
+
+    def balances(self):
+        """(user_id, asset, available, reserved, updated_at) of every balance"""
+        return self._fetch(
+            "SELECT user_id, asset, available, reserved, updated_at FROM balances", max_lag=0
+        )
+
+    # Users
+
+    def user_by_email(self, email):
+        """The users row of an email as a dict, None if nobody has it"""
+        rows = self._fetch(
+            "SELECT * FROM users WHERE email = %s", (email,), max_lag=0, dictionary=True
+        )
+        return rows[0] if rows else None
+
+    def create_user(self, username, email, password):
+        """Insert a user with a bcrypt password hash, returns the new id"""
+        with get_db_connection() as db:
+            cursor = db.cursor()
+            cursor.execute(
+                "INSERT INTO users (username, email, password) VALUES (%s, %s, %s)",
+                (username, email, password),
+            )
+            user_id = cursor.lastrowid
+            db.commit()
+            cursor.close()
+        return user_id
+
+    # Write-behind
+
+    def checkpoint(self):
+        """Journal seq of the last batch applied"""
+        rows = self._fetch(
+            "SELECT seq FROM engine_checkpoint WHERE name = %s", (CHECKPOINT_NAME,), max_lag=0
+        )
+        return rows[0][0] if rows else 0
+
+    def apply(self, batch, seq):
+        """Write a writebehind.PersistBatch and move the checkpoint to seq, in one transaction"""
+        # The connection keeps its prepared statements from one batch to the next
+        with get_db_connection(prepared=True) as db:
+            cursor = db.cursor()
+            statements = prepared_statements(db)
+            try:
+                batch.flush(cursor, statements)
+                statements.execute(
+                    """INSERT INTO engine_checkpoint (name, seq) VALUES (%s, %s)
+                       ON DUPLICATE KEY UPDATE seq = VALUES(seq)""",
+                    (CHECKPOINT_NAME, seq),
+                )
+                db.commit()
+            except Exception:
+                db.rollback()
+                metrics.count("persist_rollbacks")
+                raise
+            finally:
+                cursor.close()
+
+
+# DECIMAL column scales, MemoryStorage hands amounts back quantized like MySQL
+PRICE = Decimal("0.01")
+QUANTITY = Decimal("0.0001")
+AMOUNT = Decimal("0.00000001")
+
+
+def _timestamp(epoch):
+    """What a TIMESTAMP column gives back for FROM_UNIXTIME(epoch)"""
+    return datetime.fromtimestamp(round(epoch))
+
+
+def _insert_rows(text, table):
+    """The VALUES rows of the first INSERT INTO table of a SQL dump"""
+    head = f"INSERT INTO `{table}`"
+    if head not in text:
+        return ""
+    return text.split(head, 1)[1].split(";", 1)[0]
+
+
+def read_seed(path):
+    """(users, balances) rows of the users and balances a SQL dump inserts"""
+    with open(path) as f:
+        text = f.read()
+    users = re.findall(
+        r"^\('([^']*)', '([^']*)', '([^']*)', '([^']*)'\)", _insert_rows(text, "users"), re.M
+    )
+    balances = re.findall(
+        r"^\((\d+), '(\w+)', ([\d.]+), ([\d.]+)\)", _insert_rows(text, "balances"), re.M
+    )
+    return users, balances
+
+
+class MemoryStorage:
+    """
+    The tables in process memory, for tests and benchmarks.  Starts with the
+    users and balances of the seed dump, if any; the write-behind writer
+    fills in the rest from the journal, so a restart replays it all.
+    """
+
+    def __init__(self, seed=None):
+        # order id -> row in ORDER_COLUMNS order
+        self._orders = {}
+        # user id -> ids of the user's orders
+        self._user_orders = {}
+        # rows in TRANSACTION_FIELDS order, in id order
+        self._transactions = []
+        # user id -> (row, side) of the user's trades
+        self._user_transactions = {}
+        # (user_id, asset) -> [available units, reserved units, updated_at]
+        self._balances = {}
+        # (symbol, resolution, started_at epoch) -> candles row
+        self._candles = {}
+        # email -> users row
+        self._users = {}
+        self._checkpoint = 0
+        self._lock = threading.Lock()
+        if seed:
+            self.seed(seed)
+
+    def seed(self, path):
+        users, balances = read_seed(path)
+        for username, email, password, created_at in users:
+            created_at = datetime.fromisoformat(created_at)
+            self._add_user(username, email, password, created_at)
+        for user_id, asset, available, reserved in balances:
+            self._balances[(int(user_id), asset)] = [
+                int(Decimal(available) / AMOUNT),
+                int(Decimal(reserved) / AMOUNT),
+                None,
+            ]
+        logging.info(f"Seeded {len(users)} users and {len(balances)} balances from {path}")
+
+    # Orders
+
+    def order(self, order_id):
+        with self._lock:
+            row = self._orders.get(order_id)
+            return tuple(row) if row else None
+
+    def order_state(self, order_id):
+        with self._lock:
+            row = self._orders.get(order_id)
+            return (row[1], row[2], row[7]) if row else None
+
+    def user_orders(self, user_id):
+        with self._lock:
+            rows = [self._orders[order_id] for order_id in self._user_orders.get(user_id, ())]
+        rows.sort(key=lambda row: (row[8], row[0]), reverse=True)
+        fields = [ORDER_COLUMNS.index(field) for field in ORDER_FIELDS]
+        return [tuple(row[index] for index in fields) for row in rows]
+
+    def open_orders(self):
+        with self._lock:
+            rows = [tuple(row) for row in self._orders.values() if row[7] in ("PENDING", "PARTIAL")]
+        rows.sort(key=lambda row: (row[8], row[0]))
+        return rows
+
+    def max_order_id(self):
+        with self._lock:
+            return max(self._orders, default=0)
+
+    # Trades
+
+    @staticmethod
+    def _matches(row, filters):
+        symbol, start, end, before = filters
+        executed_at = row[8]
+        return (
+            (not symbol or row[5] == symbol)
+            and (start is None or executed_at >= start)
+            and (end is None or executed_at < end)
+            and (before is None or (executed_at, row[0]) < before)
+        )
+
+    def transactions(self, filters, limit):
+        with self._lock:
+            rows = [row for row in self._transactions if self._matches(row, filters)]
+        return heapq.nlargest(limit, rows, key=lambda row: (row[8], row[0]))
+
+    def user_transactions(self, user_id, filters, limit):
+        with self._lock:
+            rows = [
+                row + (side,)
+                for row, side in self._user_transactions.get(user_id, ())
+                if self._matches(row, filters)
+            ]
+        return heapq.nlargest(limit, rows, key=lambda row: (row[8], row[0]))
+
+    def trade_seconds(self, since=0):
+        start = _timestamp(since)
+        seconds = {}
+        with self._lock:
+            for row in self._transactions:
+                if row[8] < start:
+                    continue
+                price, quantity = row[6], row[7]
+                key = (row[8], row[5])
+                bar = seconds.get(key)
+                if bar is None:
+                    seconds[key] = [price, price, price, price, quantity, price * quantity, 1]
+                    continue
+                bar[1] = max(bar[1], price)
+                bar[2] = min(bar[2], price)
+                bar[3] = price
+                bar[4] += quantity
+                bar[5] += price * quantity
+                bar[6] += 1
+        return [
+            (symbol, int(executed_at.timestamp()), *bar)
+            for (executed_at, symbol), bar in sorted(seconds.items())
+        ]
+
+    # Candles
+
+    def candles(self, resolution, start, before):
+        with self._lock:
+            rows = [
+                row
+                for (_, name, started_at), row in self._candles.items()
+                if name == resolution and start <= started_at < before
+            ]
+        rows.sort(key=lambda row: row[1])
+        return rows
+
+    def save_candles(self, rows):
+        with self._lock:
+            for symbol, resolution, started_at, *values in rows:
+                started_at = int(started_at)
+                self._candles[(symbol, resolution, started_at)] = (symbol, started_at, *values)
+
+    # Balances
+
+    def balances(self):
+        with self._lock:
+            return [
+                (
+                    user_id,
+                    asset,
+                    units_decimal(available).quantize(AMOUNT),
+                    units_decimal(reserved).quantize(AMOUNT),
+                    updated_at,
+                )
+                for (user_id, asset), (available, reserved, updated_at) in self._balances.items()
+            ]
+
+    # Users
+
+    def _add_user(self, username, email, password, created_at):
+        if email in self._users or any(user["username"] == username for user in self._users.values()):
+            raise StorageError(f"Duplicate user {username} <{email}>")
+        user_id = len(self._users) + 1
+        self._users[email] = {
+            "id": user_id,
+            "username": username,
+            "email": email,
+            "password": password,
+            "created_at": created_at,
+            "updated_at": created_at,
+        }
+        return user_id
+
+    def user_by_email(self, email):
+        with self._lock:
+            user = self._users.get(email)
+            return dict(user) if user else None
+
+    def create_user(self, username, email, password):
+        if isinstance(password, bytes):
+            password = password.decode("utf-8")
+        with self._lock:
+            return self._add_user(username, email, password, datetime.now().replace(microsecond=0))
+
+    # Write-behind
+
+    def checkpoint(self):
+        return self._checkpoint
+
+    def apply(self, batch, seq):
+        """PersistBatch.flush() against the in-memory tables, in the same order"""
+        now = datetime.now().replace(microsecond=0)
+        with self._lock:
+            for order_id, user_id, symbol, side, price, quantity, created_at, updated_at in batch.new_orders:
+                self._orders[order_id] = [
+                    order_id,
+                    user_id,
+                    symbol,
+                    side,
+                    price.quantize(PRICE),
+                    quantity.quantize(QUANTITY),
+                    Decimal(0).quantize(QUANTITY),
+                    "PENDING",
+                    _timestamp(created_at),
+                    _timestamp(updated_at),
+                ]
+                self._user_orders.setdefault(user_id, []).append(order_id)
+
+            for order_id, (symbol, side, price, quantity, updated_at) in batch.amends.items():
+                row = self._orders[order_id]
+                row[2:6] = [symbol, side, price.quantize(PRICE), quantity.quantize(QUANTITY)]
+                row[9] = _timestamp(updated_at)
+
+            self._settle(batch.settlement, now)
+
+            for order_id, updated_at in batch.cancels.items():
+                row = self._orders[order_id]
+                row[7] = "CANCELLED"
+                row[9] = _timestamp(updated_at)
+
+            self._checkpoint = seq
+
+    def _settle(self, settlement, now):
+        for buy_id, sell_id, symbol, quantity, price, executed_at, buyer, seller in settlement.transactions:
+            row = (
+                len(self._transactions) + 1,
+                buy_id,
+                sell_id,
+                buyer if buyer is not None else self._orders[buy_id][1],
+                seller if seller is not None else self._orders[sell_id][1],
+                symbol,
+                ticks_decimal(price).quantize(PRICE),
+                lots_decimal(quantity).quantize(QUANTITY),
+                _timestamp(executed_at),
+            )
+            self._transactions.append(row)
+            self._user_transactions.setdefault(row[3], []).append((row, "BUY"))
+            self._user_transactions.setdefault(row[4], []).append((row, "SELL"))
+
+        for order_id, filled in settlement.fills.items():
+            row = self._orders[order_id]
+            row[6] = lots_decimal(filled).quantize(QUANTITY)
+            row[7] = "FILLED" if row[6] >= row[5] else "PARTIAL"
+            row[9] = now
+
+        for key, (available, reserved) in settlement.deltas.items():
+            if not (available or reserved):
+                continue
+            balance = self._balances.get(key)
+            if balance is None:
+                self._balances[key] = [available, reserved, now]
+            else:
+                balance[0] += available
+                balance[1] = max(balance[1] + reserved, 0)
+                balance[2] = now
+
+        settlement.deltas = {}
+        settlement.transactions = []
+        settlement.fills = {}
+
+
+BACKENDS = {"mysql": MySQLStorage, "memory": lambda: MemoryStorage(STORAGE_SEED)}
+
+storage = BACKENDS[STORAGE_BACKEND]()
@@ -0,0 +1,78 @@
+"""
+Engine fixtures over MemoryStorage, no MySQL server needed.
+
+The modules read their settings from the environment when they are
+imported, so everything is set here before the first backend import.
+Each test gets a fresh journal, snapshot folder and store of its own.
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+DATA_DIR = tempfile.mkdtemp(prefix="orderbook-tests-")
+SEED = os.path.join(DATA_DIR, "seed.sql")
+
+with open(SEED, "w") as f:
+    f.write(
+        """
+INSERT INTO `users` (`username`, `email`, `password`, `created_at`) VALUES
+('alice', 'alice@example.com', 'x', '2025-08-01 09:00:00'),
+('bob', 'bob@example.com', 'x', '2025-08-01 10:30:00');
+
+INSERT INTO `balances` (`user_id`, `asset`, `available`, `reserved`) VALUES
+(1, 'USD', 50000.00000000, 0.00000000),
+(1, 'BTC', 2.50000000, 0.00000000),
+(2, 'USD', 75000.00000000, 0.00000000),
+(2, 'BTC', 1.25000000, 0.00000000);
+"""
+    )
+
+os.environ.update(
+    STORAGE_BACKEND="memory",
+    STORAGE_SEED=SEED,
+    ORDERBOOK_DATA_DIR=DATA_DIR,
+    SNAPSHOT_INTERVAL="0",
+    METRICS_ENABLED="0",
+)
+
+import candles  # noqa: E402
+import engine  # noqa: E402
+import writebehind  # noqa: E402
+from journal import Journal  # noqa: E402
+from orderbook import order_books  # noqa: E402
+from storage import MemoryStorage  # noqa: E402
+
+ALICE = 1
+BOB = 2
+
+
+@pytest.fixture
+def memory(tmp_path, monkeypatch):
+    """
+    The engine cold-started over a fresh journal and a seeded MemoryStorage,
+    which is returned
+    """
+    store = MemoryStorage(SEED)
+    for module in (engine, writebehind, candles):
+        monkeypatch.setattr(module, "storage", store)
+
+    journal = Journal(str(tmp_path / "orders.journal"), flush_interval=0)
+    monkeypatch.setattr(engine, "journal", journal)
+    monkeypatch.setattr(engine.ledger, "journal", journal)
+    monkeypatch.setattr(engine.writer, "journal", journal)
+    monkeypatch.setattr(engine.writer, "_offset", 0)
+    monkeypatch.setattr(engine.writer, "trades_seq", 0)
+    monkeypatch.setattr(engine, "SNAPSHOT_DIR", str(tmp_path / "snapshots"))
+
+    journal.open()
+    engine.writer.load_checkpoint()
+    engine._cold_start()
+    yield store
+    journal.close()
+    order_books.clear()
@@ -0,0 +1,251 @@
+"""
+The order path end to end over MemoryStorage: matching and settlement in
+the books and the ledger, what the write-behind writer persists, and
+restarts from the journal.
+"""
+
+from decimal import Decimal
+
+import pytest
+
+import candles
+import engine
+import storage
+import writebehind
+from conftest import ALICE, BOB, SEED
+from fixedpoint import lots_decimal, ticks_decimal, to_lots, to_ticks, units_decimal
+from helpers import release_balance_for_order, reserve_balance_for_order
+from journal import Journal, JournalError
+from orderbook import order_books
+
+
+def place(user_id, side, price, quantity, symbol="BTCUSD"):
+    """Reserve, journal and match an order the way POST /orders does"""
+    price, quantity = to_ticks(price), to_lots(quantity)
+    reserve_balance_for_order(engine.ledger, user_id, side, symbol, quantity, price)
+    order = engine.new_order(user_id, symbol, side, price, quantity)
+    engine.submit_order(order)
+    return order
+
+
+def cancel(order):
+    """Release what is left of an order and take it out of its book, as DELETE /orders/<id> does"""
+    remaining = order.quantity - order.filled_quantity
+    release_balance_for_order(
+        engine.ledger, order.user_id, order.side, order.symbol, remaining, order.price
+    )
+    engine.cancel_order(order)
+
+
+def persist():
+    """Flush the journal and apply it to the storage"""
+    engine.journal.flush()
+    engine.writer.drain()
+
+
+def ledger_balance(user_id, asset):
+    available, reserved = engine.ledger.get(user_id, asset)[:2]
+    return units_decimal(available), units_decimal(reserved)
+
+
+def stored_balance(store, user_id, asset):
+    for row_user, row_asset, available, reserved, _ in store.balances():
+        if (row_user, row_asset) == (user_id, asset):
+            return available, reserved
+    return None
+
+
+def assert_balance(store, user_id, asset, available, reserved):
+    expected = (Decimal(available), Decimal(reserved))
+    assert ledger_balance(user_id, asset) == expected
+    assert stored_balance(store, user_id, asset) == expected
+
+
+def test_trade_at_resting_price_refunds_price_improvement(memory):
+    ask = place(ALICE, "SELL", "40000", "1")
+    bid = place(BOB, "BUY", "40100", "1")
+    persist()
+
+    (trade,) = memory.transactions((None, None, None, None), 10)
+    assert trade[1:8] == (bid.id, ask.id, BOB, ALICE, "BTCUSD", Decimal("40000.00"), Decimal("1.0000"))
+    assert memory.order_state(ask.id) == (ALICE, "BTCUSD", "FILLED")
+    assert memory.order_state(bid.id) == (BOB, "BTCUSD", "FILLED")
+
+    # The buyer reserved 40100 and paid 40000, the 100 comes back
+    assert_balance(memory, BOB, "USD", "35000", "0")
+    assert_balance(memory, BOB, "BTC", "2.25", "0")
+    assert_balance(memory, ALICE, "USD", "90000", "0")
+    assert_balance(memory, ALICE, "BTC", "1.5", "0")
+
+
+def test_partially_filled_maker_cancel_releases_the_rest(memory):
+    ask = place(ALICE, "SELL", "40000", "2")
+    place(BOB, "BUY", "40000", "0.5")
+    persist()
+
+    assert memory.order(ask.id)[6:8] == (Decimal("0.5000"), "PARTIAL")
+    assert_balance(memory, ALICE, "BTC", "0.5", "1.5")
+
+    cancel(ask)
+    persist()
+
+    assert memory.order(ask.id)[6:8] == (Decimal("0.5000"), "CANCELLED")
+    assert order_books.get("BTCUSD").get(ask.id) is None
+    assert_balance(memory, ALICE, "BTC", "2", "0")
+    assert_balance(memory, ALICE, "USD", "70000", "0")
+
+
+def test_partially_filled_taker_cancel_releases_the_rest(memory):
+    place(ALICE, "SELL", "40000", "0.25")
+    bid = place(BOB, "BUY", "40100", "1")
+    persist()
+
+    # 0.25 traded at 40000 with 25 of the reservation refunded, the other
+    # 0.75 rests at 40100
+    assert memory.order(bid.id)[6:8] == (Decimal("0.2500"), "PARTIAL")
+    assert_balance(memory, BOB, "USD", "34925", "30075")
+
+    cancel(bid)
+    persist()
+
+    assert memory.order_state(bid.id)[2] == "CANCELLED"
+    assert_balance(memory, BOB, "USD", "65000", "0")
+    assert_balance(memory, BOB, "BTC", "1.5", "0")
+
+
+def test_unjournaled_fills_leave_the_book_unchanged(memory, monkeypatch):
+    ask = place(ALICE, "SELL", "40000", "1")
+
+    def refuse(event):
+        raise JournalError("Journal is full")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(engine.ledger, "append", refuse)
+        with pytest.raises(engine.MatchError):
+            place(BOB, "BUY", "40000", "0.5")
+
+    # The bid rests unmatched as journaled, the ask keeps all of its quantity
+    book = order_books.get("BTCUSD")
+    bid = book.get(engine.order_ids.peek() - 1)
+    assert (bid.filled_quantity, bid.status) == (0, "PENDING")
+    assert (ask.filled_quantity, ask.status) == (0, "PENDING")
+    assert book.level("SELL", ask.price) == (ask.quantity, 1)
+
+
+def engine_state():
+    """Resting orders, balances and the next order id, as a restart must rebuild them"""
+    _, orders = order_books.open_orders()
+    _, balances = engine.ledger.take()
+    return (
+        [
+            (o.id, o.user_id, o.symbol, o.side, o.price, o.quantity, o.filled_quantity, o.status)
+            for o in orders
+        ],
+        {key: values[:2] for key, values in balances.items()},
+        engine.order_ids.peek(),
+    )
+
+
+def stored_state(store):
+    """Everything persisted, less the timestamps the writer sets as it applies"""
+    orders = [store.order(order_id)[:8] for order_id in range(1, store.max_order_id() + 1)]
+    balances = sorted(row[:4] for row in store.balances())
+    return orders, store.transactions((None, None, None, None), 1000), balances
+
+
+def test_warm_restart_matches_cold_rebuild(memory, monkeypatch):
+    monkeypatch.setattr(engine.snapshotter, "last_seq", 0)
+
+    place(ALICE, "SELL", "40000", "1")
+    resting = place(ALICE, "SELL", "40500", "1")
+    place(BOB, "BUY", "40000", "0.4")
+    place(BOB, "BUY", "39000", "0.3")
+    assert engine.snapshotter.snapshot() is not None
+
+    # The journal tail after the snapshot: fills, a cancel and new orders
+    place(BOB, "BUY", "40600", "0.8")
+    cancel(resting)
+    place(ALICE, "SELL", "41000", "0.1")
+    place(BOB, "BUY", "39500", "0.05")
+    persist()
+    live = engine_state()
+
+    order_books.clear()
+    engine.ledger.load([])
+    assert engine._warm_start()
+    assert engine_state() == live
+
+    # Cold: a new store rebuilt from the whole journal
+    rebuilt = storage.MemoryStorage(SEED)
+    for module in (engine, writebehind, candles):
+        monkeypatch.setattr(module, "storage", rebuilt)
+    monkeypatch.setattr(engine.writer, "_offset", 0)
+    engine.writer.load_checkpoint()
+    order_books.clear()
+    engine._cold_start()
+    assert engine_state() == live
+    assert stored_state(rebuilt) == stored_state(memory)
+
+
+def test_snapshot_truncates_what_the_storage_holds(memory, monkeypatch, tmp_path):
+    monkeypatch.setattr(engine.snapshotter, "last_seq", 0)
+
+    place(ALICE, "SELL", "40000", "1")
+    place(BOB, "BUY", "40000", "0.4")
+    persist()
+    current = engine.snapshotter.snapshot()
+    assert engine.journal.base == current.offset > 0
+
+    # The tail after the snapshot, only part of it persisted
+    place(ALICE, "SELL", "40500", "1")
+    persist()
+    place(BOB, "BUY", "40500", "0.2")
+    engine.journal.flush()
+    live = engine_state()
+    engine.journal.close()
+
+    # Reopened, the journal still reads at the offsets taken before the cut
+    journal = Journal(engine.journal.path, flush_interval=0)
+    for target in (engine, engine.ledger, engine.writer):
+        monkeypatch.setattr(target, "journal", journal)
+    journal.open()
+    assert [seq for seq, _, _ in journal.read(0, 0)] == list(range(current.seq + 1, journal.last_seq + 1))
+
+    order_books.clear()
+    engine.ledger.load([])
+    assert engine._warm_start()
+    assert engine_state() == live
+    engine.writer.drain()
+    assert memory.order_state(engine.order_ids.peek() - 1) == (BOB, "BTCUSD", "FILLED")
+    journal.close()
+
+
+@pytest.mark.parametrize(
+    "price, quantity",
+    [("40000.01", "0.0001"), ("0.01", "1.2345"), ("99999999.99", "2.5"), ("123.45", "0.3333")],
+)
+def test_fixed_point_round_trip(memory, price, quantity):
+    assert ticks_decimal(to_ticks(price)) == Decimal(price)
+    assert lots_decimal(to_lots(quantity)) == Decimal(quantity)
+
+    order = place(ALICE, "SELL", price, quantity)
+    persist()
+
+    row = memory.order(order.id)
+    assert row[4:6] == (Decimal(price), Decimal(quantity))
+    assert (str(row[4]), str(row[5])) == (price, str(Decimal(quantity).quantize(Decimal("0.0001"))))
+    assert_balance(memory, ALICE, "BTC", str(Decimal("2.5") - Decimal(quantity)), quantity)
+
+    # Back from the stored DECIMALs to the same ticks and lots
+    order_books.load(memory.open_orders())
+    loaded = order_books.get("BTCUSD").get(order.id)
+    assert (loaded.price, loaded.quantity) == (order.price, order.quantity)
+
+
+def test_fixed_point_from_floats():
+    # Parsing goes through the float's shortest repr, not its binary value
+    assert to_ticks(0.1 + 0.2) == 30
+    assert to_lots(0.1 + 0.2) == 3000
+    # Quantities round down, never more than asked for
+    assert to_lots("0.00019") == 1
+    assert to_ticks("0.015") == 2
@@ -0,0 +1,171 @@
+# Rolling 24h ticker
+# trade prints are folded into per-minute buckets per symbol; running totals
+# and monotonic queues over the buckets make every statistic O(1) to update
+# and (amortized) O(1) to read, no matter how many trades the window holds
+
+import threading
+import time
+from collections import deque
+
+from candles import Candle
+from fixedpoint import PRICE_SCALE, from_lots, from_notional, from_ticks
+
+WINDOW = 86400
+# Bucket length in seconds, the window slides one bucket at a time
+BUCKET = 60
+
+
+class RollingWindow:
+    """24h statistics of one symbol, kept as a queue of per-minute buckets"""
+
+    def __init__(self, window=WINDOW, bucket=BUCKET):
+        self.window = window
+        self.bucket = bucket
+        # non-empty buckets (Candles), oldest first
+        self.buckets = deque()
+        # buckets that can still become the window's high / low, the current
+        # extreme is always at the front
+        self._highs = deque()
+        self._lows = deque()
+        self.volume = 0
+        self.notional = 0
+        self.trades = 0
+        self.last_price = None
+        self.last_trade_at = None
+
+    def add(self, bar, executed_at):
+        """Fold a trade (or a finer bar of trades) into the newest bucket"""
+        start = bar.start - bar.start % self.bucket
+        newest = self.buckets[-1] if self.buckets else None
+        if newest is not None and start <= newest.start:
+            # Same minute, or a clock step back: count it in the newest bucket
+            newest.merge(bar)
+        else:
+            newest = bar.copy(start)
+            self.buckets.append(newest)
+
+        # newest is always at the back of both queues, re-seat it after its
+        # high or low moved and drop the buckets it now dominates
+        if self._highs and self._highs[-1] is newest:
+            self._highs.pop()
+        while self._highs and self._highs[-1].high <= newest.high:
+            self._highs.pop()
+        self._highs.append(newest)
+
+        if self._lows and self._lows[-1] is newest:
+            self._lows.pop()
+        while self._lows and self._lows[-1].low >= newest.low:
+            self._lows.pop()
+        self._lows.append(newest)
+
+        self.volume += bar.volume
+        self.notional += bar.notional
+        self.trades += bar.trades
+        self.last_price = bar.close
+        self.last_trade_at = executed_at
+        self.expire(executed_at)
+
+    def expire(self, now):
+        """Drop the buckets that ended more than a window ago"""
+        cutoff = now - self.window
+        buckets = self.buckets
+        while buckets and buckets[0].start + self.bucket <= cutoff:
+            old = buckets.popleft()
+            self.volume -= old.volume
+            self.notional -= old.notional
+            self.trades -= old.trades
+            if self._highs and self._highs[0] is old:
+                self._highs.popleft()
+            if self._lows and self._lows[0] is old:
+                self._lows.popleft()
+        if not buckets:
+            self.volume = self.notional = self.trades = 0
+
+    def stats(self, now):
+        self.expire(now)
+        if not self.buckets:
+            return {
+                "last_price": from_ticks(self.last_price) if self.last_price is not None else None,
+                "last_trade_at": self.last_trade_at,
+                "open": None,
+                "high": None,
+                "low": None,
+                "volume": 0,
+                "quote_volume": 0,
+                "vwap": None,
+                "trades": 0,
+                "change": None,
+                "change_percent": None,
+            }
+
+        open_price = self.buckets[0].open
+        change = self.last_price - open_price
+        return {
+            "last_price": from_ticks(self.last_price),
+            "last_trade_at": self.last_trade_at,
+            "open": from_ticks(open_price),
+            "high": from_ticks(self._highs[0].high),
+            "low": from_ticks(self._lows[0].low),
+            "volume": from_lots(self.volume),
+            "quote_volume": from_notional(self.notional),
+            "vwap": self.notional / self.volume / PRICE_SCALE if self.volume else None,
+            "trades": self.trades,
+            "change": from_ticks(change),
+            "change_percent": change / open_price * 100 if open_price else None,
+        }
+
+
+class TickerBoard:
+    """Rolling 24h tickers of every symbol that traded"""
+
+    def __init__(self, window=WINDOW, bucket=BUCKET):
+        self.window = window
+        self.bucket = bucket
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def _window(self, symbol):
+        window = self._windows.get(symbol)
+        if window is None:
+            window = self._windows[symbol] = RollingWindow(self.window, self.bucket)
+        return window
+
+    def add_trade(self, symbol, price, quantity, executed_at):
+        bar = Candle(
+            int(executed_at), price, price, price, price, quantity, price * quantity
+        )
+        with self._lock:
+            self._window(symbol).add(bar, executed_at)
+
+    def ticker(self, symbol, now=None):
+        """24h statistics of a symbol, None if it has not traded since startup"""
+        now = time.time() if now is None else now
+        with self._lock:
+            window = self._windows.get(symbol)
+            if window is None:
+                return None
+            return {"symbol": symbol, **window.stats(now)}
+
+    def tickers(self, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            return [
+                {"symbol": symbol, **self._windows[symbol].stats(now)}
+                for symbol in sorted(self._windows)
+            ]
+
+    def warm_up(self, recent, trades):
+        """
+        Rebuild the windows at startup from recent, the 1s bars of the last
+        day from candles.aggregate_trades(), and trades, the (symbol, price,
+        quantity, executed_at) prints MySQL does not have yet.
+        """
+        with self._lock:
+            self._windows = {}
+            for symbol, bar in recent:
+                self._window(symbol).add(bar, bar.start)
+        for trade in trades:
+            self.add_trade(*trade)
+
+
+tickers = TickerBoard()
@@ -0,0 +1,215 @@
+# Write-behind persistence
+# drains durable journal events into the orders, transactions and balances
+# tables in bulk, one MySQL transaction per drained batch
+
+import logging
+import threading
+
+from fixedpoint import lots_decimal, ticks_decimal
+from metrics import metrics
+from settlement import SettlementBatch
+from storage import storage
+
+# Order ids per set-based cancel UPDATE
+CANCEL_BATCH = 1000
+
+
+class PersistBatch:
+    """Everything a run of journal events has to write to MySQL"""
+
+    def __init__(self):
+        self.new_orders = []
+        # order_id -> (symbol, side, price, quantity, updated_at), last amend wins
+        self.amends = {}
+        self.cancels = {}
+        self.settlement = SettlementBatch()
+
+    def add(self, event):
+        kind = event["type"]
+        if kind == "order":
+            self.new_orders.append(
+                (
+                    event["id"],
+                    event["user_id"],
+                    event["symbol"],
+                    event["side"],
+                    ticks_decimal(event["price"]),
+                    lots_decimal(event["quantity"]),
+                    event["created_at"],
+                    event["created_at"],
+                )
+            )
+        elif kind == "match":
+            self.settlement.merge(event)
+        elif kind == "balance":
+            for user_id, asset, available, reserved in event["deltas"]:
+                self.settlement.adjust(user_id, asset, available, reserved)
+        elif kind == "amend":
+            self.amends[event["id"]] = (
+                event["symbol"],
+                event["side"],
+                ticks_decimal(event["price"]),
+                lots_decimal(event["quantity"]),
+                event["updated_at"],
+            )
+        elif kind == "cancel":
+            self.cancels[event["id"]] = event["updated_at"]
+        elif kind == "mass_cancel":
+            for order_id in event["ids"]:
+                self.cancels[order_id] = event["updated_at"]
+
+    def flush(self, cursor, statements=None):
+        """
+        Write the batch.  The settlement's multi-row statements of a fixed
+        shape run through statements, a db_pool.PreparedStatements, when
+        given; the executemany() calls and the IN lists stay on the plain
+        cursor, a prepared executemany() costs two round trips per row.
+        """
+        statements = statements or cursor
+        # Inserts first so fills and transactions can reference the new rows,
+        # amends before fills so the fill status is computed on the final quantity
+        if self.new_orders:
+            cursor.executemany(
+                """
+                INSERT INTO orders (
+                    id, user_id, symbol, side, price, quantity,
+                    status, filled_quantity, created_at, updated_at
+                ) VALUES (%s, %s, %s, %s, %s, %s, 'PENDING', 0.0, FROM_UNIXTIME(%s), FROM_UNIXTIME(%s))
+            """,
+                self.new_orders,
+            )
+
+        if self.amends:
+            cursor.executemany(
+                """
+                UPDATE orders
+                SET symbol = %s, side = %s, price = %s, quantity = %s, updated_at = FROM_UNIXTIME(%s)
+                WHERE id = %s
+            """,
+                [values + (order_id,) for order_id, values in self.amends.items()],
+            )
+
+        if self.settlement:
+            self.settlement.flush(statements)
+
+        if self.cancels:
+            # Cancels sharing a timestamp (a mass cancel) go out as one
+            # set-based UPDATE per CANCEL_BATCH ids
+            by_time = {}
+            for order_id, updated_at in self.cancels.items():
+                by_time.setdefault(updated_at, []).append(order_id)
+            for updated_at, ids in by_time.items():
+                for index in range(0, len(ids), CANCEL_BATCH):
+                    chunk = ids[index : index + CANCEL_BATCH]
+                    cursor.execute(
+                        f"""
+                        UPDATE orders SET status = 'CANCELLED', updated_at = FROM_UNIXTIME(%s)
+                        WHERE id IN ({", ".join(["%s"] * len(chunk))})
+                    """,
+                        (updated_at, *chunk),
+                    )
+
+
+class WriteBehindWriter:
+    """
+    Background thread that applies durable journal events to the storage.
+
+    The last applied sequence number is stored along with the data (in
+    engine_checkpoint, inside the same transaction, on MySQL), so a batch
+    is applied exactly once even if the process dies halfway.
+    """
+
+    def __init__(self, journal, interval=0.05, max_batch=10000, retry_delay=1.0):
+        self.journal = journal
+        self.interval = interval
+        self.max_batch = max_batch
+        self.retry_delay = retry_delay
+        self.persisted_seq = 0
+        # Journal seq of the last trades MySQL took, bumps whenever the
+        # transactions table changes
+        self.trades_seq = 0
+        self._offset = 0
+        self._persisted = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def load_checkpoint(self):
+        self.persisted_seq = storage.checkpoint()
+        return self.persisted_seq
+
+    def apply_pending(self):
+        """Apply one batch of durable events, returns how many were applied"""
+        records = self.journal.read(self.persisted_seq, self._offset, self.max_batch)
+        if not records:
+            return 0
+
+        batch = PersistBatch()
+        trades_seq = self.trades_seq
+        for seq, event, _ in records:
+            batch.add(event)
+            if event["type"] == "match":
+                trades_seq = seq
+        last_seq, _, next_offset = records[-1]
+
+        started = metrics.clock()
+        storage.apply(batch, last_seq)
+        metrics.observe("persist", started)
+
+        with self._persisted:
+            self.persisted_seq = last_seq
+            self.trades_seq = trades_seq
+            self._offset = next_offset
+            self._persisted.notify_all()
+        return len(records)
+
+    def position(self):
+        """(last applied seq, journal offset to read on from), see seek()"""
+        with self._persisted:
+            return self.persisted_seq, self._offset
+
+    def seek(self, seq, offset):
+        """
+        Read on from offset, the journal position right after seq, when
+        every record up to seq is applied already.  Until then reads start
+        at the first record still in the journal.
+        """
+        with self._persisted:
+            if self.persisted_seq >= seq:
+                self._offset = max(self._offset, offset)
+
+    def wait_persisted(self, seq, timeout=None):
+        """Block until MySQL holds every event up to seq, False on timeout"""
+        with self._persisted:
+            return self._persisted.wait_for(lambda: self.persisted_seq >= seq, timeout)
+
+    def drain(self):
+        """Apply everything that is already durable, e.g. at startup"""
+        total = 0
+        while True:
+            applied = self.apply_pending()
+            if not applied:
+                break
+            total += applied
+        if total:
+            logging.info(f"Write-behind drained {total} journal events, now at seq {self.persisted_seq}")
+        return total
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if not self.apply_pending():
+                    self._stop.wait(self.interval)
+            except Exception as e:
+                # Events stay in the journal, retry the same batch later
+                logging.error(f"Write-behind flush failed at seq {self.persisted_seq}: {e}")
+                self._stop.wait(self.retry_delay)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.drain()
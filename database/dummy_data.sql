@@ -134,30 +134,30 @@ INSERT INTO `orders` (`user_id`, `symbol`, `side`, `price`, `quantity`, `filled_
 (4, 'ETHUSD', 'SELL', 3500.00, 2.0000, 0.0000, 'CANCELLED', '2025-08-06 11:00:00', '2025-08-06 17:00:00');
 
 -- Insert transaction history (completed trades)
-INSERT INTO `transactions` (`buy_order_id`, `sell_order_id`, `symbol`, `price`, `quantity`, `executed_at`) VALUES
+INSERT INTO `transactions` (`buy_order_id`, `sell_order_id`, `buyer_id`, `seller_id`, `symbol`, `price`, `quantity`, `executed_at`) VALUES
 -- Today's transactions
-(29, 30, 'BTCUSD', 64700.00, 0.5000, '2025-08-07 06:15:00'),
-(31, 32, 'ETHUSD', 3190.00, 2.0000, '2025-08-07 06:45:00'),
-(33, 34, 'AAPL', 185.25, 100.0000, '2025-08-07 07:10:00'),
+(29, 30, 3, 5, 'BTCUSD', 64700.00, 0.5000, '2025-08-07 06:15:00'),
+(31, 32, 1, 2, 'ETHUSD', 3190.00, 2.0000, '2025-08-07 06:45:00'),
+(33, 34, 4, 1, 'AAPL', 185.25, 100.0000, '2025-08-07 07:10:00'),
 
 -- Partial fills for current orders
-(27, 2, 'BTCUSD', 64900.00, 0.3000, '2025-08-07 07:35:00'), -- Partial fill for order 27
-(2, 18, 'ETHUSD', 3220.00, 2.5000, '2025-08-07 07:50:00'),  -- Partial fill for order 18
-(28, 22, 'AAPL', 185.75, 100.0000, '2025-08-07 07:25:00'),  -- Partial fill for order 28
+(27, 2, 6, 2, 'BTCUSD', 64900.00, 0.3000, '2025-08-07 07:35:00'), -- Partial fill for order 27
+(2, 18, 2, 7, 'ETHUSD', 3220.00, 2.5000, '2025-08-07 07:50:00'),  -- Partial fill for order 18
+(28, 22, 8, 3, 'AAPL', 185.75, 100.0000, '2025-08-07 07:25:00'),  -- Partial fill for order 28
 
 -- Yesterday's transactions
-(35, 36, 'BTCUSD', 64500.00, 1.0000, '2025-08-06 14:20:00'),
-(37, 38, 'ETHUSD', 3170.00, 3.0000, '2025-08-06 15:45:00'),
+(35, 36, 2, 3, 'BTCUSD', 64500.00, 1.0000, '2025-08-06 14:20:00'),
+(37, 38, 4, 5, 'ETHUSD', 3170.00, 3.0000, '2025-08-06 15:45:00'),
 
 -- Some older transactions for history
-(7, 6, 'BTCUSD', 65500.00, 0.3000, '2025-08-05 10:30:00'),
-(15, 16, 'ETHUSD', 3250.00, 1.5000, '2025-08-05 11:45:00'),
-(23, 22, 'AAPL', 186.00, 50.0000, '2025-08-05 14:20:00'),
+(7, 6, 7, 6, 'BTCUSD', 65500.00, 0.3000, '2025-08-05 10:30:00'),
+(15, 16, 1, 3, 'ETHUSD', 3250.00, 1.5000, '2025-08-05 11:45:00'),
+(23, 22, 5, 3, 'AAPL', 186.00, 50.0000, '2025-08-05 14:20:00'),
 
 -- More historical data
-(3, 8, 'BTCUSD', 66000.00, 0.6000, '2025-08-04 16:15:00'),
-(14, 17, 'ETHUSD', 3280.00, 2.0000, '2025-08-04 12:30:00'),
-(21, 24, 'AAPL', 186.25, 75.0000, '2025-08-04 09:45:00');
+(3, 8, 3, 8, 'BTCUSD', 66000.00, 0.6000, '2025-08-04 16:15:00'),
+(14, 17, 8, 5, 'ETHUSD', 3280.00, 2.0000, '2025-08-04 12:30:00'),
+(21, 24, 1, 7, 'AAPL', 186.25, 75.0000, '2025-08-04 09:45:00');
 
 -- Update balances to reflect reserved amounts for pending orders
 -- (This would normally be handled by the application, but for demo purposes)
@@ -192,23 +192,23 @@ UPDATE `balances` SET
 WHERE `user_id` = 4 AND `asset` = 'AAPL';
 
 -- Add some volume and price history simulation with more transactions
-INSERT INTO `transactions` (`buy_order_id`, `sell_order_id`, `symbol`, `price`, `quantity`, `executed_at`) VALUES
+INSERT INTO `transactions` (`buy_order_id`, `sell_order_id`, `buyer_id`, `seller_id`, `symbol`, `price`, `quantity`, `executed_at`) VALUES
 -- BTC price movement simulation
-(1, 6, 'BTCUSD', 65250.00, 0.1000, '2025-08-07 06:00:00'),
-(2, 7, 'BTCUSD', 65300.00, 0.1500, '2025-08-07 06:30:00'),
-(3, 8, 'BTCUSD', 65100.00, 0.2000, '2025-08-07 07:00:00'),
-(4, 9, 'BTCUSD', 65400.00, 0.1000, '2025-08-07 07:30:00'),
+(1, 6, 1, 6, 'BTCUSD', 65250.00, 0.1000, '2025-08-07 06:00:00'),
+(2, 7, 2, 7, 'BTCUSD', 65300.00, 0.1500, '2025-08-07 06:30:00'),
+(3, 8, 3, 8, 'BTCUSD', 65100.00, 0.2000, '2025-08-07 07:00:00'),
+(4, 9, 4, 1, 'BTCUSD', 65400.00, 0.1000, '2025-08-07 07:30:00'),
 
 -- ETH price movement simulation
-(11, 16, 'ETHUSD', 3225.00, 0.5000, '2025-08-07 06:15:00'),
-(12, 17, 'ETHUSD', 3210.00, 1.0000, '2025-08-07 06:45:00'),
-(13, 18, 'ETHUSD', 3235.00, 0.7500, '2025-08-07 07:15:00'),
-(14, 19, 'ETHUSD', 3220.00, 0.8000, '2025-08-07 07:45:00'),
+(11, 16, 2, 3, 'ETHUSD', 3225.00, 0.5000, '2025-08-07 06:15:00'),
+(12, 17, 4, 5, 'ETHUSD', 3210.00, 1.0000, '2025-08-07 06:45:00'),
+(13, 18, 6, 7, 'ETHUSD', 3235.00, 0.7500, '2025-08-07 07:15:00'),
+(14, 19, 8, 2, 'ETHUSD', 3220.00, 0.8000, '2025-08-07 07:45:00'),
 
 -- AAPL trading activity
-(21, 24, 'AAPL', 185.80, 25.0000, '2025-08-07 06:20:00'),
-(22, 25, 'AAPL', 185.60, 40.0000, '2025-08-07 06:50:00'),
-(23, 26, 'AAPL', 185.90, 30.0000, '2025-08-07 07:20:00');
+(21, 24, 1, 7, 'AAPL', 185.80, 25.0000, '2025-08-07 06:20:00'),
+(22, 25, 3, 2, 'AAPL', 185.60, 40.0000, '2025-08-07 06:50:00'),
+(23, 26, 5, 4, 'AAPL', 185.90, 30.0000, '2025-08-07 07:20:00');
 
 -- Create a view for easy market data access (optional)
 CREATE OR REPLACE VIEW `market_summary` AS
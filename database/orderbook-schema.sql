@@ -45,6 +45,9 @@ CREATE TABLE IF NOT EXISTS `transactions` (
   `id`             INT NOT NULL AUTO_INCREMENT,
   `buy_order_id`   INT NOT NULL,
   `sell_order_id`  INT NOT NULL,
+  -- owners of the two orders, copied at execution so history needs no joins
+  `buyer_id`       INT NOT NULL,
+  `seller_id`      INT NOT NULL,
   `symbol`         VARCHAR(10)         NOT NULL,
   `price`          DECIMAL(10,2)       NOT NULL,
   `quantity`       DECIMAL(10,4)       NOT NULL,
@@ -52,6 +55,11 @@ CREATE TABLE IF NOT EXISTS `transactions` (
   PRIMARY KEY (`id`),
   INDEX `idx_txn_buy`  (`buy_order_id`),
   INDEX `idx_txn_sell` (`sell_order_id`),
+  -- keyset pagination on (executed_at, id), newest first
+  INDEX `idx_txn_executed`        (`executed_at`,`id`),
+  INDEX `idx_txn_symbol_executed` (`symbol`,`executed_at`,`id`),
+  INDEX `idx_txn_buyer_executed`  (`buyer_id`,`executed_at`,`id`),
+  INDEX `idx_txn_seller_executed` (`seller_id`,`executed_at`,`id`),
   FOREIGN KEY (`buy_order_id`)  REFERENCES `orders`(`id`) ON DELETE RESTRICT ON UPDATE CASCADE,
   FOREIGN KEY (`sell_order_id`) REFERENCES `orders`(`id`) ON DELETE RESTRICT ON UPDATE CASCADE
 ) ENGINE=InnoDB
@@ -72,3 +80,30 @@ CREATE TABLE IF NOT EXISTS `balances` (
 ) ENGINE=InnoDB
   DEFAULT CHARSET = utf8mb4
   COLLATE = utf8mb4_0900_ai_ci;
+
+-- engine checkpoints (last journal sequence applied by the write-behind writer)
+CREATE TABLE IF NOT EXISTS `engine_checkpoint` (
+  `name` VARCHAR(32)  NOT NULL,
+  `seq`  BIGINT       NOT NULL DEFAULT 0,
+  PRIMARY KEY (`name`)
+) ENGINE=InnoDB
+  DEFAULT CHARSET = utf8mb4
+  COLLATE = utf8mb4_0900_ai_ci;
+
+-- candles (closed OHLCV bars per symbol and interval, see backend/candles.py)
+CREATE TABLE IF NOT EXISTS `candles` (
+  `symbol`     VARCHAR(10)    NOT NULL,
+  `resolution` VARCHAR(4)     NOT NULL,
+  `started_at` TIMESTAMP      NOT NULL,
+  `open`       DECIMAL(10,2)  NOT NULL,
+  `high`       DECIMAL(10,2)  NOT NULL,
+  `low`        DECIMAL(10,2)  NOT NULL,
+  `close`      DECIMAL(10,2)  NOT NULL,
+  `volume`     DECIMAL(18,4)  NOT NULL,
+  `notional`   DECIMAL(24,8)  NOT NULL,
+  `trades`     INT            NOT NULL,
+  PRIMARY KEY (`symbol`,`resolution`,`started_at`),
+  INDEX `idx_candles_resolution_started` (`resolution`,`started_at`)
+) ENGINE=InnoDB
+  DEFAULT CHARSET = utf8mb4
+  COLLATE = utf8mb4_0900_ai_ci;
@@ -23,6 +23,7 @@ export {
 export {
   fetchOrderBook,
   getOrderBookBySymbol,
+  fetchDepth,
   placeOrder,
   cancelOrder,
   updateOrder,
@@ -39,7 +40,12 @@ export {
 } from "./userService";
 
 // Market data services
-export { getMarketData } from "./marketService";
+export {
+  getMarketData,
+  getCandles,
+  getTickers,
+  subscribeMarketData,
+} from "./marketService";
 
 // Re-export the default axios instance for direct access if needed
 export { default } from "./apiClient";
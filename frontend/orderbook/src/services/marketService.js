@@ -15,3 +15,81 @@ export const getMarketData = async () => {
     throw error;
   }
 };
+
+// Subscribe to the push stream of a symbol: a snapshot, then level, trade
+// and own-order events. Level and trade events are numbered; on a gap the
+// stream is reopened from the last applied seq (the server replays the
+// missed events or sends a fresh snapshot). Returns an unsubscribe function.
+export const subscribeMarketData = (
+  symbol,
+  { onSnapshot, onLevel, onTrade, onOrder } = {}
+) => {
+  let lastSeq = null;
+  let source = null;
+
+  const open = () => {
+    const params = new URLSearchParams({
+      jwt: localStorage.getItem("authToken") || "",
+    });
+    if (lastSeq !== null) {
+      params.set("since", lastSeq);
+    }
+    source = new EventSource(
+      `${api.defaults.baseURL}/stream/${encodeURIComponent(symbol)}?${params}`
+    );
+
+    const sequenced = (handler) => (event) => {
+      const message = JSON.parse(event.data);
+      if (lastSeq !== null && message.seq !== lastSeq + 1) {
+        console.warn(
+          `Market data gap on ${symbol}: expected ${lastSeq + 1}, got ${message.seq}`
+        );
+        source.close();
+        open();
+        return;
+      }
+      lastSeq = message.seq;
+      handler?.(message);
+    };
+
+    source.addEventListener("snapshot", (event) => {
+      const message = JSON.parse(event.data);
+      lastSeq = message.seq;
+      onSnapshot?.(message);
+    });
+    source.addEventListener("level", sequenced(onLevel));
+    source.addEventListener("trade", sequenced(onTrade));
+    source.addEventListener("order", (event) => onOrder?.(JSON.parse(event.data)));
+  };
+
+  open();
+  return () => source?.close();
+};
+
+// Get OHLCV candles for a symbol, interval is one of 1s, 1m, 5m, 1h, 1d
+export const getCandles = async (symbol, interval = "1m", limit = 500) => {
+  try {
+    const response = await api.get(
+      `/market/${encodeURIComponent(symbol)}/candles`,
+      { params: { interval, limit } }
+    );
+    return response.data.candles;
+  } catch (error) {
+    console.error("Error fetching candles:", error);
+    throw error;
+  }
+};
+
+// Get rolling 24h statistics, for one symbol or for all of them
+export const getTickers = async (symbol) => {
+  try {
+    const url = symbol
+      ? `/market/ticker/${encodeURIComponent(symbol)}`
+      : "/market/ticker";
+    const response = await api.get(url);
+    return symbol ? response.data.ticker : response.data.tickers;
+  } catch (error) {
+    console.error("Error fetching tickers:", error);
+    throw error;
+  }
+};
@@ -31,6 +31,25 @@ export const getOrderBookBySymbol = async (symbol) => {
   }
 };
 
+// Aggregated price levels (price, quantity, order count) for one symbol
+export const fetchDepth = async (symbol, levels = 20) => {
+  try {
+    if (!symbol) {
+      throw new Error("Symbol is required");
+    }
+
+    const response = await api.get(`/book/${symbol}/depth`, {
+      params: { levels },
+    });
+    return response.data;
+  } catch (error) {
+    if (error.response?.status >= 500) {
+      toast.error(`Failed to load ${symbol} depth`);
+    }
+    throw error;
+  }
+};
+
 export const placeOrder = async (orderData) => {
   const loadingToast = toast.loading("Placing order...");
 